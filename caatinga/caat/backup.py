@@ -17,10 +17,40 @@
 # You should have received a copy of the GNU General Public License
 # along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
 
+import copy
 import os
+import errno
+import json
+import multiprocessing
 import shutil
+import stat
+import threading
+import time
+import caatinga.core.catalog as catalog
+import caatinga.core.chunks as chunks
+import caatinga.core.copier as copier
+import caatinga.core.dirfd as dirfd
+import caatinga.core.events as events
 import caatinga.core.functions as fn
-from os.path import join, exists
+import caatinga.core.ignore as ignore
+import caatinga.core.throttle as throttle
+from caatinga.caat.objects import ObjectStore, getObjectStoreHome
+from caatinga.caat.stats import BackupStats
+from caatinga.caat.workers import openWorkers
+from collections import deque
+from functools import partial
+from os.path import join
+
+# Shards are split from the top levels of the tree until there are this many
+# for each backup process, or the maximum depth is reached.
+_SHARDS_PER_PROCESS = 8
+_MAX_SHARD_DEPTH = 3
+
+# Values recorded by the journal, which only hold for a backup that was
+# made in a single run.
+_JOURNAL_INFO = ["journal_session", "journal_sequence", "walk_settings"]
+
+_UNLIMITED_WRITES = 2 ** 31 - 1
 
 
 def createLockFile(lockFile):
@@ -59,89 +89,1236 @@ def createBackupRoot(backupHome, backup, gid):
     return root
 
 
-def backupDirectory(backupRoot, previousBackup, directory, settings, writer):
+def backupDirectory(backupRoot, previousBackup, directory, settings,
+                    eventLog, catalogWriter=None, segment=None, stats=None,
+                    resume=False):
+    """
+    Primary function to perform a system backup.  The tree of directory is
+    backed up to the backup root, linking the files that didn't change to
+    the previous backup.  Items are recorded in the catalog writer when one
+    is provided and reported to the event log, and the counters and timers
+    of the run are added to stats.  When a journal segment is provided,
+    only the directories it lists are scanned.  With resume, the partial
+    backup in the backup root and its catalog are picked up where they
+    were interrupted.
+    """
+    stats = stats or BackupStats()
+    if directory in settings.ignored:
+        eventLog.log(events.IGNORE, directory)
+        stats.add("ignored")
+        return
+
+    run = _BackupRun(
+        backupRoot, previousBackup, settings, eventLog, catalogWriter, stats)
+    run.previous = _getPreviousCatalog(previousBackup)
+    if resume and catalogWriter:
+        run.resumed = catalog.CatalogReader(catalogWriter.catalogFile)
+        run.completed = run.resumed.getCompleted()
+        # Items kept from the interrupted run may be older than the journal
+        # segment, so the next backup has to scan the whole tree.
+        segment = None
+        for key in _JOURNAL_INFO:
+            catalogWriter.setInfo(key, None)
+    run.journal = _getJournal(run, segment)
+    if catalogWriter:
+        catalogWriter.setInfo(
+            "resume_settings", _getResumeSettings(previousBackup, settings))
+    if segment and catalogWriter:
+        catalogWriter.setInfo("journal_session", segment.session)
+        catalogWriter.setInfo("journal_sequence", str(segment.sequence))
+        catalogWriter.setInfo("walk_settings", _getWalkSettings(settings))
+    if settings.dedup:
+        run.objectStore = ObjectStore(
+            getObjectStoreHome(os.path.dirname(backupRoot)))
+    if settings.chunkThreshold:
+        run.chunkStore = chunks.ChunkStore(
+            chunks.getChunkStoreHome(os.path.dirname(backupRoot)),
+            settings.chunkSize,
+            settings.chunkThreshold)
+    try:
+        if settings.backupProcesses > 1:
+            _backupInShards(run, directory)
+        else:
+            with _DevicePipelines(run) as run.devices:
+                run.devices.handOff(
+                    directory, os.lstat(directory), ignore.IgnoreRules())
+    finally:
+        run.previous and run.previous.close()
+        run.resumed and run.resumed.close()
+
+
+def getResumableBackup(backupHome, previousBackup, settings):
+    """
+    Returns the name of the newest partial backup if it can be resumed, or
+    None.  The partial backup must have a catalog recording that it was
+    made from the same previous backup, using the same settings to decide
+    what is backed up.
+    """
+    if not os.path.exists(backupHome):
+        return None
+    partials = sorted(fn.getPartialBackups(backupHome))
+    if not partials:
+        return None
+    catalogFile = catalog.getCatalogFile(backupHome, partials[-1])
+    if not os.path.exists(catalogFile):
+        return None
+    reader = catalog.CatalogReader(catalogFile)
+    try:
+        resumeSettings = reader.getInfo("resume_settings")
+    finally:
+        reader.close()
+    if resumeSettings == _getResumeSettings(previousBackup, settings):
+        return partials[-1]
+    return None
+
+
+def _getResumeSettings(previousBackup, settings):
+    """
+    Returns the values a partial backup must have been made with to be
+    resumed.
+    """
+    return json.dumps([previousBackup, _getWalkSettings(settings)])
+
+
+def _getPreviousCatalog(previousBackup):
+    """
+    Returns a reader for the catalog of the previous backup, or None if the
+    previous backup doesn't have one.
+    """
+    catalogFile = catalog.getCatalogFile(
+        os.path.dirname(previousBackup),
+        os.path.basename(previousBackup))
+    if previousBackup and os.path.exists(catalogFile):
+        return catalog.CatalogReader(catalogFile)
+    return None
+
+
+def _getJournal(run, segment):
+    """
+    Returns the journal segment if it lists every directory that changed
+    since the previous backup was made, or None when the whole tree has to
+    be scanned.  The previous backup must have read the segment just before
+    this one, using the same settings to decide what is backed up.
+    """
+    if segment is None or run.previous is None:
+        return None
+    previous = run.previous
+    sequence = previous.getInfo("journal_sequence")
+    walkSettings = previous.getInfo("walk_settings")
+    if sequence is None or walkSettings != _getWalkSettings(run.settings):
+        return None
+    if segment.follows(previous.getInfo("journal_session"), int(sequence)):
+        return segment
+    return None
+
+
+def _getWalkSettings(settings):
+    """
+    Returns the settings that decide which items are backed up.
+    """
+    return json.dumps(
+        [settings.root, sorted(settings.ignored), settings.maxFileSize,
+         settings.oneFileSystem, sorted(settings.includedMounts)])
+
+
+class _BackupRun:
+    """
+    State shared by the functions performing a single backup run.
+    """
+
+    def __init__(self, backupRoot, previousBackup, settings, eventLog,
+                 catalogWriter, stats):
+        self.backupRoot = backupRoot
+        self.previousBackup = previousBackup
+        self.settings = settings
+        self.events = eventLog
+        self.catalog = catalogWriter
+        self.stats = stats
+        self.previous = None
+        self.resumed = None
+        self.completed = set()
+        self.progressLock = threading.Lock()
+        self.journal = None
+        self.objectStore = None
+        self.chunkStore = None
+        self.workers = None
+        self.devices = None
+        self.hardLinks = {}
+        self.hardLinksLock = threading.Lock()
+        self.remounted = {}
+        # Jobs writing to the backup hold a slot, which are unlimited unless
+        # max_backup_writes is set.
+        self.writeSlots = threading.BoundedSemaphore(
+            settings.maxBackupWrites or _UNLIMITED_WRITES)
+
+
+class _DevicePipelines:
+    """
+    Pipelines backing up the trees of each source device.  Every device has
+    a thread walking the trees handed to it with its own pool of workers,
+    so a slow device doesn't hold up the others.  A directory found on
+    another device than its parent is handed to the pipeline of its device.
+    """
+
+    def __init__(self, run):
+        self._run = run
+        self._condition = threading.Condition()
+        self._trees = {}
+        self._threads = []
+        self._outstanding = 0
+        self._error = None
+        self._isClosed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exceptionType, exception, traceback):
+        if exceptionType:
+            self._setError(exception)
+            self._close()
+        else:
+            self.join()
+
+    def handOff(self, directory, dirStat, rules, progress=None):
+        """
+        Queue the tree of a directory to the pipeline of its device.  The
+        progress of its parent isn't finished before the tree is walked.
+        """
+        with self._condition:
+            if self._error is not None:
+                return
+            trees = self._trees.get(dirStat.st_dev)
+            if trees is None:
+                trees = self._trees[dirStat.st_dev] = deque()
+                thread = threading.Thread(target=self._work, args=(trees,))
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+            progress and progress.add()
+            trees.append((directory, dirStat, rules, progress))
+            self._outstanding += 1
+            self._condition.notify_all()
+
+    def join(self):
+        """
+        Wait for every tree to be backed up.  The first error raised by a
+        pipeline is raised again here.
+        """
+        self._close()
+        if self._error is not None:
+            raise self._error
+
+    def _close(self):
+        with self._condition:
+            while self._outstanding and self._error is None:
+                self._condition.wait()
+            self._isClosed = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self, trees):
+        run = copy.copy(self._run)
+        try:
+            with openWorkers(run.settings) as run.workers:
+                while self._walkNext(run, trees):
+                    pass
+        except BaseException as ex:
+            # Interrupts are raised again by join as well, so the backup
+            # isn't marked complete with trees missing.
+            self._setError(ex)
+
+    def _walkNext(self, run, trees):
+        """
+        Walk the next tree queued to the pipeline.  Returns False once the
+        pipelines are closed.
+        """
+        with self._condition:
+            while not trees and not self._isClosed:
+                self._condition.wait()
+            if not trees:
+                return False
+            directory, dirStat, rules, progress = trees.popleft()
+        try:
+            if self._error is None:
+                _walk(run, directory, dirStat, rules, progress)
+                progress and progress.finish()
+        finally:
+            with self._condition:
+                self._outstanding -= 1
+                self._condition.notify_all()
+        return True
+
+    def _setError(self, error):
+        with self._condition:
+            if self._error is None:
+                self._error = error
+            self._condition.notify_all()
+
+
+def _walk(run, directory, dirStat, rules, parent=None):
+    """
+    Walk the tree starting at directory, submitting a job to the workers for
+    each file found.  The tree is walked iteratively, and each entry is only
+    stat'ed once, relative to its open directory, so deeply nested trees
+    neither exhaust the recursion limit nor have their paths resolved again
+    for every item.  Rules are the ignore rules inherited by the directory,
+    and parent is the progress of the directory's parent.  The progress of
+    each directory is tracked when a catalog is written, so trees are
+    marked complete once everything under them is backed up.
+    """
+    pending = [(directory, dirStat, rules, None, parent)]
+    while pending:
+        localDir, dirStat, rules, directoryJobs, parent = pending.pop()
+        if directoryJobs:
+            # All children have been queued, so the directory times are
+            # restored once the workers are done with them.
+            run.workers.closeDirectory(directoryJobs)
+            continue
+        if _isCompleted(run, localDir):
+            continue
+        progress = run.catalog and _Progress(
+            run, fn.removeAltRoot(run.settings.root, localDir), parent)
+        if _isClean(run, localDir, dirStat):
+            _cloneDirectory(run, localDir, dirStat, progress)
+            continue
+
+        directoryJobs, subdirectories = _backupDirectoryEntries(
+            run, localDir, dirStat, rules, progress)
+        if directoryJobs:
+            pending.append((localDir, dirStat, rules, directoryJobs, None))
+        pending.extend(
+            (d, st, r, None, progress) for d, st, r in subdirectories)
+
+
+class _Progress:
+    """
+    Tracks the outstanding work of a directory's tree, which is the jobs of
+    the directory itself and the trees of its subdirectories.  Once none
+    are left, the tree is marked complete in the catalog and its parent is
+    told it's done.
+    """
+
+    __slots__ = ("run", "path", "parent", "remaining")
+
+    def __init__(self, run, path, parent):
+        self.run = run
+        self.path = path
+        self.parent = parent
+        self.remaining = 1
+        parent and parent.add()
+
+    def add(self):
+        """
+        Add work that must be done before the tree is complete.
+        """
+        with self.run.progressLock:
+            self.remaining += 1
+
+    def finish(self):
+        """
+        Indicates some of the work of the tree is done.
+        """
+        progress = self
+        while progress:
+            with self.run.progressLock:
+                progress.remaining -= 1
+                isDone = progress.remaining == 0
+            if not isDone:
+                return
+            self.run.catalog.markComplete(progress.path)
+            progress = progress.parent
+
+
+def _isCompleted(run, localDir):
+    """
+    Returns True if the interrupted run being resumed backed up the whole
+    tree of the directory.
+    """
+    if not run.completed:
+        return False
+    if fn.removeAltRoot(run.settings.root, localDir) not in run.completed:
+        return False
+    run.events.log(events.RESUME, localDir)
+    run.stats.add("resumed")
+    return True
+
+
+def _backupDirectoryEntries(run, localDir, dirStat, rules, progress=None):
+    """
+    Create the backup of a directory and queue the jobs for its files and
+    links.  Returns the directory's job handle, which must be closed once
+    its subdirectories are done, along with the subdirectories that still
+    need to be walked and their ignore rules.  No job handle is returned
+    when the directory is a cache directory that isn't backed up.  The
+    progress of the directory is finished once its jobs are done.
+    """
+    settings = run.settings
+    start = time.monotonic()
+    entries = dirfd.scanDirectory(localDir)
+    # Reading the directory and stat'ing each of its entries.
+    throttle.operations(len(entries) + 1)
+    run.stats.addTime("scan", time.monotonic() - start)
+    run.stats.add("directories_scanned")
+    rules = _getIgnoreRules(localDir, entries, rules)
+    if rules is None:
+        _ignore(run, localDir)
+        progress and progress.finish()
+        return None, []
+    path = fn.removeAltRoot(settings.root, localDir)
+    destination = run.backupRoot + path
+    xattrs = _getDirectoryXattrs(run, localDir, path, dirStat)
+    createDestination(localDir, destination, dirStat, xattrs)
+    run.catalog and run.catalog.add(
+        path, catalog.DIRECTORY, dirStat, xattrs=xattrs)
+    directoryJobs = run.workers.openDirectory(
+        partial(_finishDirectory, destination, dirStat, progress))
+    directories = _openDirectories(run, path)
+    previousItems = run.previous and run.previous.listDirectory(path)
+    resumedItems = None
+    if run.resumed:
+        resumedItems = run.resumed.listDirectory(path)
+        _removeStaleItems(run, path, entries, resumedItems)
+    subdirectories = []
+    for entry in entries:
+        if rules and rules.isIgnored(
+                entry.path, entry.name, entry.is_dir(follow_symlinks=False)):
+            _ignore(run, entry.path)
+        elif resumedItems is not None and \
+                _resumeItem(run, entry, resumedItems.get(entry.name)):
+            run.events.log(events.RESUME, entry.path)
+            run.stats.add("resumed")
+        elif entry.is_symlink():
+            target = backupLink(run.backupRoot, entry.path, settings.root)
+            run.catalog and run.catalog.add(
+                fn.removeAltRoot(settings.root, entry.path),
+                catalog.LINK,
+                entry.stat(follow_symlinks=False),
+                target=target)
+            run.stats.add("links")
+        elif entry.is_dir(follow_symlinks=False):
+            st = entry.stat(follow_symlinks=False)
+            if entry.path in settings.ignored:
+                _ignore(run, entry.path)
+            elif _isExcludedMount(settings, entry.path, st, dirStat):
+                _backupMountPoint(run, entry.path, st)
+            elif run.devices and st.st_dev != dirStat.st_dev:
+                _handOff(run, entry.path, st, rules, progress)
+            else:
+                subdirectories.append((entry.path, st, rules))
+        elif entry.is_file(follow_symlinks=False):
+            _backupEntry(
+                run, entry, directoryJobs, previousItems, directories)
+    for directory in directories:
+        directory.release()
+    return directoryJobs, subdirectories
+
+
+def _openDirectories(run, path):
+    """
+    Open the directory of the backup that the files of a directory are
+    written to, followed by the directory of the previous backup they are
+    linked from, if there is one.  The jobs of the files work relative to
+    them and release them once they are done.
+    """
+    destination = dirfd.DirectoryFd(run.backupRoot + path)
+    if not run.previousBackup:
+        return (destination,)
+    return destination, dirfd.DirectoryFd(run.previousBackup + path)
+
+
+def _getDirectoryXattrs(run, localDir, path, st):
+    """
+    Returns the extended attributes of a directory, taken from the previous
+    catalog when its ctime shows they can't have changed.
+    """
+    row = run.previous and run.previous.lookup(path)
+    return _getXattrs(localDir, st, row)
+
+
+def _isExcludedMount(settings, localDir, st, parentStat):
+    """
+    Returns True if the directory is on another file system than its parent
+    and one_file_system keeps the backup from crossing into it.
+    """
+    return settings.oneFileSystem and st.st_dev != parentStat.st_dev and \
+        os.path.normpath(localDir) not in settings.includedMounts
+
+
+def _backupMountPoint(run, localDir, st):
+    """
+    Backup the directory a file system is mounted on without its contents.
+    """
+    path = fn.removeAltRoot(run.settings.root, localDir)
+    destination = run.backupRoot + path
+    xattrs = _getDirectoryXattrs(run, localDir, path, st)
+    createDestination(localDir, destination, st, xattrs)
+    _restoreTimes(destination, st)
+    run.catalog and run.catalog.add(
+        path, catalog.DIRECTORY, st, xattrs=xattrs)
+    _ignore(run, localDir)
+
+
+def _handOff(run, localDir, st, rules, progress):
+    """
+    Hand a directory on another device to the pipeline of its device.  The
+    directory is created right away, since creating it once the times of
+    its parent are restored would change them.
+    """
+    if _isCompleted(run, localDir):
+        return
+    path = fn.removeAltRoot(run.settings.root, localDir)
+    createDestination(
+        localDir, run.backupRoot + path, st,
+        _getDirectoryXattrs(run, localDir, path, st))
+    run.devices.handOff(localDir, st, rules, progress)
+
+
+def _finishDirectory(destination, st, progress):
+    """
+    Restore the times of a backed up directory once its jobs are done, and
+    finish its progress.
+    """
+    _restoreTimes(destination, st)
+    progress and progress.finish()
+
+
+def _resumeItem(run, entry, row):
+    """
+    Returns True if the item was backed up by the interrupted run being
+    resumed and still matches the source, so it can be kept.  Otherwise
+    any part of the item found in the backup is removed, so it can be
+    backed up again.  Directories are always walked again.
+    """
+    backupItem = run.backupRoot + \
+        fn.removeAltRoot(run.settings.root, entry.path)
+    try:
+        backupStat = os.lstat(backupItem)
+    except OSError:
+        return False
+    isDirectory = entry.is_dir(follow_symlinks=False)
+    if isDirectory and stat.S_ISDIR(backupStat.st_mode):
+        return False
+    if not isDirectory and row is not None and \
+            _isBackedUp(entry.stat(follow_symlinks=False), row, backupStat):
+        return True
+    if stat.S_ISDIR(backupStat.st_mode):
+        shutil.rmtree(backupItem)
+    else:
+        os.remove(backupItem)
+    return False
+
+
+def _removeStaleItems(run, path, entries, resumedItems):
+    """
+    Remove the items the interrupted run being resumed backed up in a
+    directory that are no longer found in the source, from the backup and
+    its catalog.  Items written to the backup but not yet recorded in the
+    catalog are removed as well.
+    """
+    destination = run.backupRoot + path
+    names = set(entry.name for entry in entries)
+    stale = (set(resumedItems) | set(os.listdir(destination))) - names
+    for name in stale:
+        backupItem = join(destination, name)
+        if os.path.isdir(backupItem) and not os.path.islink(backupItem):
+            shutil.rmtree(backupItem)
+        elif os.path.lexists(backupItem):
+            os.remove(backupItem)
+        if name in resumedItems:
+            catalog.removeEntries(
+                run.resumed.catalogFile, catalog.getPath(resumedItems[name]))
+
+
+def _isBackedUp(st, row, backupStat):
+    """
+    Returns True if the catalog row and backup item of an interrupted run
+    match the source item.  A plain copy must also have the size of the
+    source, since its contents are written before it's recorded.
+    """
+    if row["type"] != catalog.getType(st) or \
+            row["mtime_ns"] != st.st_mtime_ns or row["size"] != st.st_size:
+        return False
+    if catalog.isFile(row):
+        if row["backup_ino"] != backupStat.st_ino:
+            return False
+        return catalog.getStorage(row) is not None or \
+            backupStat.st_size == st.st_size
+    return True
+
+
+def _ignore(run, path):
+    """
+    Report and count an item that isn't backed up.
+    """
+    run.events.log(events.IGNORE, path)
+    run.stats.add("ignored")
+
+
+def _getIgnoreRules(localDir, entries, rules):
+    """
+    Returns the ignore rules for the entries of a directory, adding the
+    rules of its .caatignore file.  Returns None when the directory has a
+    cache directory tag.
+    """
+    for entry in entries:
+        if entry.name == ignore.CACHEDIR_TAG and \
+                entry.is_file(follow_symlinks=False) and \
+                ignore.isCacheDirTag(entry.path):
+            return None
+        elif entry.name == ignore.IGNORE_FILE and \
+                entry.is_file(follow_symlinks=False):
+            rules = rules.read(localDir, entry.path)
+    return rules
+
+
+def _isClean(run, localDir, dirStat):
+    """
+    Returns True if the journal shows nothing changed in the directory or
+    below it since the previous backup, which has the directory as well,
+    and no file system was mounted or unmounted in its tree.
+    """
+    if run.journal is None or \
+            not run.journal.isClean(os.path.normpath(localDir)):
+        return False
+    path = fn.removeAltRoot(run.settings.root, localDir)
+    row = run.previous.lookup(path)
+    if row is None or not catalog.isDirectory(row) or \
+            _isRemounted(dirStat, row):
+        return False
+    return not _getRemountedDirectories(run, path)
+
+
+def _getRemountedDirectories(run, path):
+    """
+    Returns the directories below path found on another file system than
+    in the previous backup, which includes mount points that were mounted
+    or unmounted.  The journal doesn't see mounts, so the directories of
+    the tree are stat'ed.  Those found in a tree are kept, so the trees
+    below it aren't stat'ed again.
+    """
+    tree = path
+    while tree not in run.remounted:
+        parent = os.path.dirname(tree)
+        if parent == tree:
+            tree = None
+            break
+        tree = parent
+    if tree is None:
+        root = run.settings.root.rstrip("/")
+        remounted = []
+        for row in run.previous.iterEntries(path, catalog.DIRECTORY):
+            itemPath = catalog.getPath(row)
+            try:
+                st = os.lstat(root + itemPath)
+            except OSError:
+                st = None
+            if st is None or _isRemounted(st, row):
+                remounted.append(itemPath)
+        run.remounted[path] = remounted
+        return remounted
+    prefix = path.rstrip("/") + "/"
+    return [d for d in run.remounted[tree] if d.startswith(prefix)]
+
+
+def _isRemounted(st, row):
+    """
+    Returns True if the directory isn't the one recorded by the catalog row,
+    since a file system was mounted on it or unmounted from it.
+    """
+    return st.st_dev != row["src_dev"] or st.st_ino != row["src_ino"]
+
+
+def _cloneDirectory(run, localDir, dirStat, progress=None):
+    """
+    Backup a directory that didn't change since the previous backup using
+    the previous backup's catalog, without reading the source.  Files are
+    linked to the previous backup, while directories and links are created
+    from the catalog.  Rows are ordered by their parent, so each directory
+    is created before its items, and the times of a directory are restored
+    once the rows of its items are done.  The progress of the directory is
+    finished once every directory under it is done.
+    """
+    settings = run.settings
+    path = fn.removeAltRoot(settings.root, localDir)
+    run.events.log(events.UNCHANGED, localDir)
+    run.stats.add("directories_cloned")
+    destination = run.backupRoot + path
+    xattrs = _getDirectoryXattrs(run, localDir, path, dirStat)
+    createDestination(localDir, destination, dirStat, xattrs)
+    run.catalog and run.catalog.add(
+        path, catalog.DIRECTORY, dirStat, xattrs=xattrs)
+    directories = {path: run.workers.openDirectory(
+        partial(_finishDirectory, destination, dirStat, progress))}
+    parent = None
+    for row in run.previous.iterEntries(path):
+        if row["parent"] != parent and parent in directories:
+            run.workers.closeDirectory(directories.pop(parent))
+        parent = row["parent"]
+        itemPath = catalog.getPath(row)
+        backupItem = run.backupRoot + itemPath
+        if catalog.isDirectory(row):
+            st = os.lstat(run.previousBackup + itemPath)
+            xattrs = catalog.getXattrs(row)
+            createDestination(
+                run.previousBackup + itemPath, backupItem, st, xattrs)
+            progress and progress.add()
+            directories[itemPath] = run.workers.openDirectory(
+                partial(_finishDirectory, backupItem, st, progress))
+            run.catalog and run.catalog.add(
+                itemPath, catalog.DIRECTORY, catalog.getStat(row),
+                xattrs=xattrs)
+            run.stats.add("directories_cloned")
+        elif catalog.isLink(row):
+            os.symlink(row["target"], backupItem)
+            run.catalog and run.catalog.add(
+                itemPath, catalog.LINK, catalog.getStat(row),
+                target=row["target"])
+            run.stats.add("links")
+        elif (row["nlink"] or 0) > 1:
+            _backupHardLinkedRow(
+                run, row, settings.root.rstrip("/") + itemPath,
+                directories[parent])
+        else:
+            run.workers.submit(
+                directories[parent], 0, _linkCatalogFile, run, row,
+                settings.root.rstrip("/") + itemPath)
+    for directoryJobs in directories.values():
+        run.workers.closeDirectory(directoryJobs)
+
+
+def _backupHardLinkedRow(run, row, localFile, directoryJobs):
     """
-    Primary function to perform a system backup.
+    Backup a file of an unchanged directory that has other hard links.  It
+    may have been modified through a link in another directory, which the
+    journal doesn't list, so it's stat'ed and backed up like a file found
+    while walking.
     """
-    if directory in settings.ignoredDirectories:
-        writer("Ignore: {0}".format(directory))
+    try:
+        st = os.lstat(localFile)
+    except OSError:
         return
+    entry = dirfd.Entry(os.path.dirname(localFile), row["name"], st)
+    _backupEntry(run, entry, directoryJobs, {row["name"]: row})
 
-    altRootDir = fn.removeAltRoot(settings.root, directory)
-    destination = backupRoot + altRootDir
-    createDestination(directory, destination)
-
-    for item in (join(directory, f) for f in os.listdir(directory)):
-        if os.path.islink(item):
-            backupLink(backupRoot, item, settings.root)
-        elif os.path.isdir(item):
-            backupDirectory(backupRoot, previousBackup, item, settings, writer)
-        elif os.path.isfile(item):
-            if skipFile(item, settings.ignoredFiles, settings.maxFileSize):
-                writer("Ignore: {0}".format(item))
+
+def _linkCatalogFile(run, row, localFile):
+    """
+    Link a file of an unchanged directory to the previous backup and record
+    it in the catalog.  The file is copied from the source when it's
+    missing from the previous backup.
+    """
+    path = catalog.getPath(row)
+    backupFile = run.backupRoot + path
+    start = time.monotonic()
+    try:
+        with run.writeSlots:
+            os.link(run.previousBackup + path, backupFile)
+        st, backupIno = catalog.getStat(row), row["backup_ino"]
+        encoding = catalog.getStorage(row)
+        xattrs = catalog.getXattrs(row)
+        run.stats.add("files_linked")
+        run.stats.addTime("link", time.monotonic() - start)
+    except OSError as ex:
+        if ex.errno != errno.ENOENT:
+            raise
+        st = os.lstat(localFile)
+        with run.writeSlots:
+            copied = fn.copyFile(localFile, backupFile, st)
+        if copied is None:
+            run.events.log(events.ERROR, localFile, "Unable to copy")
+            run.stats.add("errors")
+            return
+        backupIno = copied.st_ino
+        encoding = None
+        xattrs = fn.getXattrs(localFile)
+        run.stats.add("files_copied")
+        run.stats.add("bytes_copied", st.st_size)
+        run.stats.addTime("copy", time.monotonic() - start)
+    run.catalog and run.catalog.add(
+        path, catalog.FILE, st, backupIno, storage=encoding, xattrs=xattrs)
+
+
+def _backupInShards(run, directory):
+    """
+    Split the tree into shards that are walked by a pool of processes.  The
+    top levels of the tree are backed up here until there are enough
+    subdirectories to keep every process busy.  Shards are handed out one at
+    a time, so a process that finishes early picks up the next one.  Each
+    process walks its shards without the device pipelines, and keeps its own
+    map of hard links, so links between shards aren't kept.
+    """
+    processes = run.settings.backupProcesses
+    context = multiprocessing.get_context("fork")
+    # The pool is created before any worker threads are started, and with
+    # the thread writing events stopped, since forking a process that runs
+    # threads isn't safe.
+    queue = context.SimpleQueue()
+    with run.events.paused():
+        pool = context.Pool(processes, _initShardProcess, (run, queue))
+    receiver = run.events.receive(queue)
+    try:
+        with openWorkers(run.settings) as run.workers:
+            expanded = []
+            shards = [
+                (directory, os.lstat(directory), ignore.IgnoreRules())]
+            for _ in range(_MAX_SHARD_DEPTH):
+                if len(shards) >= processes * _SHARDS_PER_PROCESS:
+                    break
+                frontier, shards = shards, []
+                for localDir, dirStat, rules in frontier:
+                    if _isCompleted(run, localDir):
+                        continue
+                    if _isClean(run, localDir, dirStat):
+                        shards.append((localDir, dirStat, rules))
+                        continue
+                    directoryJobs, subdirectories = _backupDirectoryEntries(
+                        run, localDir, dirStat, rules)
+                    directoryJobs and expanded.append(directoryJobs)
+                    shards.extend(subdirectories)
+            for snapshot in pool.imap_unordered(
+                    _backupShard, shards, chunksize=1):
+                run.stats.merge(snapshot)
+            for directoryJobs in reversed(expanded):
+                run.workers.closeDirectory(directoryJobs)
+        # Every process has to exit before its part of the catalog can be
+        # merged, including those that never received a shard.
+        pool.close()
+        pool.join()
+        run.catalog and run.catalog.mergeParts()
+        # Each shard sends its events before returning, so they have all
+        # been received once the end of the queue is.
+        queue.put(None)
+        receiver and receiver.join()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+_shardRun = None
+
+
+def _initShardProcess(run, queue):
+    """
+    Keep the state of the backup run in each shard process.  Events are
+    forwarded to the parent process through the queue.
+    """
+    global _shardRun
+    _shardRun = run
+    run.events = run.events.forProcess(queue)
+    throttle.shareLimits(run.settings.backupProcesses)
+    if run.catalog:
+        run.catalog = run.catalog.forProcess(os.getpid())
+    # SQLite connections can't be shared with a forked process.
+    if run.previous:
+        run.previous = catalog.CatalogReader(run.previous.catalogFile)
+    if run.resumed:
+        run.resumed = catalog.CatalogReader(run.resumed.catalogFile)
+
+
+def _backupShard(shard):
+    """
+    Walk a single shard of the tree in a shard process.  Returns the
+    counters and timers of the shard, which are merged by the parent.
+    """
+    directory, dirStat, rules = shard
+    _shardRun.stats = BackupStats()
+    with openWorkers(_shardRun.settings) as _shardRun.workers:
+        _walk(_shardRun, directory, dirStat, rules)
+    _shardRun.catalog and _shardRun.catalog.commit()
+    _shardRun.events.flush()
+    return _shardRun.stats.snapshot()
+
+
+def _restoreTimes(destination, st):
+    """
+    Set the access and modified times of a backed up item from a stat result.
+    """
+    os.utime(destination, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+
+def _backupEntry(run, entry, directoryJobs, previousItems, directories=()):
+    """
+    Backup a regular file found while walking a directory.  The entry's
+    lstat result is reused for every check that is performed.  When the
+    items of the directory in the previous backup's catalog are provided,
+    they are used to find out if the file changed.  A file with several
+    hard links is only backed up once, and its other links are linked to
+    it in the backup.  The extended attributes of a file that is linked
+    are only read when its ctime changed.  The job of the file works
+    relative to the open directories provided.
+    """
+    settings = run.settings
+    start = time.monotonic()
+    run.stats.add("files_scanned")
+    st = entry.stat(follow_symlinks=False)
+    if skipFile(entry.path, settings.ignored, settings.maxFileSize, st):
+        _ignore(run, entry.path)
+        return
+    path = fn.removeAltRoot(settings.root, entry.path)
+    hardLink = st.st_nlink > 1 and _getHardLink(run, path, st)
+    if hardLink and hardLink.path != path:
+        run.stats.addTime("scan", time.monotonic() - start)
+        run.workers.submit(
+            directoryJobs, 0, _linkHardLink, run, entry.path, st, hardLink)
+        return
+    previousFile = run.previousBackup + path
+    previousRow = previousItems.get(entry.name) if previousItems else None
+    if previousItems is not None:
+        isChanged = _isChangedSinceCatalog(
+            entry.path,
+            previousFile,
+            st,
+            previousRow,
+            settings.changeDetection,
+            os.path.dirname(run.backupRoot))
+    else:
+        isChanged = isFileModifiedOrNew(
+            previousFile, entry.path, st, settings.changeDetection)
+    xattrs = None
+    if run.catalog and not isChanged:
+        isChanged, xattrs = _checkXattrs(entry.path, st, previousRow)
+    encoding = _getEncoding(run, entry, st, isChanged, previousRow)
+    size, job, args = getFileJob(
+        run.backupRoot,
+        run.previousBackup,
+        entry.path,
+        settings.root,
+        run.events,
+        st,
+        isChanged,
+        run.objectStore,
+        run.chunkStore,
+        encoding,
+        directories)
+    run.stats.addTime("scan", time.monotonic() - start)
+    if hardLink:
+        hardLink.encoding = encoding
+    for directory in directories:
+        directory.acquire()
+    run.workers.submit(
+        directoryJobs, size, _runFileJob, run, entry.path, st, job, args,
+        encoding, isChanged, hardLink or None, xattrs, directories)
+
+
+def _checkXattrs(file_, st, previousRow):
+    """
+    Returns whether a file that didn't change otherwise has to be copied
+    for its extended attributes, along with the attributes to record.  A
+    file is copied when they changed, since the file it would be linked
+    to has the old ones.
+    """
+    recorded = previousRow and catalog.getXattrs(previousRow)
+    xattrs = _getXattrs(file_, st, previousRow)
+    return recorded is not None and xattrs != recorded, xattrs
+
+
+def _getXattrs(item, st, previousRow):
+    """
+    Returns the extended attributes of an item.  Setting them changes the
+    ctime, so the ones recorded by the previous catalog are returned
+    without reading them when the ctime is the same.
+    """
+    recorded = previousRow and catalog.getXattrs(previousRow)
+    if recorded is not None and st.st_ctime_ns == previousRow["ctime_ns"]:
+        return recorded
+    return fn.getXattrs(item)
+
+
+class _HardLink:
+    """
+    The first link found of a file with several hard links.  The other
+    links wait for it to be backed up before they are linked to it.
+    """
+
+    __slots__ = ("path", "encoding", "xattrs", "done")
+
+    def __init__(self, path):
+        self.path = path
+        self.encoding = None
+        self.xattrs = None
+        self.done = threading.Event()
+
+
+def _getHardLink(run, path, st):
+    """
+    Returns the first link found of a file with several hard links, which
+    is the file itself when it's found for the first time.
+    """
+    key = (st.st_dev, st.st_ino)
+    with run.hardLinksLock:
+        hardLink = run.hardLinks.get(key)
+        if hardLink is None:
+            hardLink = run.hardLinks[key] = _HardLink(path)
+        return hardLink
+
+
+def _linkHardLink(run, file_, st, hardLink):
+    """
+    Link a file to the backup of the first link found of it.  Jobs are run
+    in the order they are submitted, so the job of the first link has
+    already started.
+    """
+    hardLink.done.wait()
+    path = fn.removeAltRoot(run.settings.root, file_)
+    start = time.monotonic()
+    try:
+        with run.writeSlots:
+            os.link(run.backupRoot + hardLink.path, run.backupRoot + path)
+    except OSError:
+        # The first link couldn't be backed up.
+        run.events.log(events.ERROR, file_, "Unable to link")
+        run.stats.add("errors")
+        return
+    run.events.log(events.LINK, file_)
+    run.stats.add("hard_links")
+    run.stats.addTime("link", time.monotonic() - start)
+    run.catalog and run.catalog.add(
+        path, catalog.FILE, st, os.lstat(run.backupRoot + path).st_ino,
+        storage=hardLink.encoding, xattrs=hardLink.xattrs)
+
+
+def _getEncoding(run, entry, st, isChanged, previousRow):
+    """
+    Returns how the contents of a file are encoded in the backup.  Linked
+    files keep the encoding they had in the previous backup.  Small files
+    and files in formats that are already compressed are left as is.
+    """
+    settings = run.settings
+    if not isChanged:
+        return previousRow and catalog.getStorage(previousRow)
+    if run.chunkStore and run.chunkStore.accepts(st):
+        return chunks.STORAGE
+    if settings.compression != "none" and \
+            st.st_size >= settings.compressionMinSize and \
+            _getExtension(entry.name) not in settings.compressionSkip:
+        return settings.compression
+    return None
+
+
+def _getExtension(name):
+    """
+    Returns the extension of a file name in lower case, without the dot.
+    """
+    return os.path.splitext(name)[1][1:].lower()
+
+
+def _runFileJob(run, file_, st, job, args, encoding=None, isChanged=True,
+                hardLink=None, xattrs=None, directories=()):
+    """
+    Run the job that backs up a file, then record the file in the catalog
+    with its extended attributes.  They are read unless they are provided,
+    and the copy applies the same ones.
+    The other links of a file with several hard links are released once
+    it's backed up, as are the open directories of the job once the file
+    is recorded.
+    """
+    try:
+        _backupFileAndRecord(
+            run, file_, st, job, args, encoding, isChanged, hardLink, xattrs,
+            directories[0] if directories else None)
+    finally:
+        for directory in directories:
+            directory.release()
+
+
+def _backupFileAndRecord(run, file_, st, job, args, encoding, isChanged,
+                         hardLink, xattrs, destination):
+    """
+    Backup a file using its job and record it in the catalog, looking up
+    the backed up file relative to its open directory when there is one.
+    """
+    start = time.monotonic()
+    try:
+        # Opening or linking the file.
+        throttle.operations()
+        if run.catalog and xattrs is None:
+            xattrs = fn.getXattrs(file_)
+        with run.writeSlots:
+            job(*args, xattrs=xattrs)
+        if hardLink:
+            hardLink.xattrs = xattrs
+    finally:
+        hardLink and hardLink.done.set()
+    if isChanged:
+        run.stats.addTime("copy", time.monotonic() - start)
+        run.stats.add("files_copied")
+        run.stats.add("bytes_copied", st.st_size)
+    else:
+        run.stats.addTime("link", time.monotonic() - start)
+        run.stats.add("files_linked")
+    if run.catalog:
+        path = fn.removeAltRoot(run.settings.root, file_)
+        try:
+            if destination:
+                backupFile, dirFd = destination.item(os.path.basename(path))
             else:
-                backupFile(
-                    backupRoot, previousBackup, item, settings.root, writer)
+                backupFile, dirFd = run.backupRoot + path, None
+            backupIno = os.lstat(backupFile, dir_fd=dirFd).st_ino
+        except OSError:
+            # The file couldn't be copied, so there is nothing to record.
+            run.events.log(events.ERROR, file_, "Unable to copy")
+            run.stats.add("errors")
+            return
+        run.catalog.add(
+            path, catalog.FILE, st, backupIno, storage=encoding,
+            xattrs=xattrs)
 
-    os.utime(
-        destination,
-        (os.path.getatime(directory), os.path.getmtime(directory)))
 
+def _isChangedSinceCatalog(file_, previousFile, st, previousRow,
+                           changeDetection, backupHome=None):
+    """
+    Returns True if the file is new or modified compared to its row in the
+    previous backup's catalog.  The contents of the previous file are read
+    using the backup home and the encoding recorded by the catalog when
+    they are compared.
+    """
+    if previousRow is None or not catalog.isFile(previousRow):
+        return True
+    return fn.isModified(
+        file_,
+        previousFile,
+        st,
+        catalog.getStat(previousRow),
+        changeDetection,
+        backupHome,
+        catalog.getStorage(previousRow))
 
-def skipFile(file_, ignoreList, maxSize):
+
+def skipFile(file_, ignoreList, maxSize, st=None):
     """
-    Returns True if the provided file should not be backed up.
+    Returns True if the provided file should not be backed up.  The ignore
+    list can be any container of paths, such as the settings' matcher.  An
+    optional stat result can be provided to avoid stat'ing the file again.
     """
     if file_ in ignoreList:
         return True
     if maxSize > 0:
-        if os.path.getsize(file_) > maxSize:
+        size = st.st_size if st else os.path.getsize(file_)
+        if size > maxSize:
             return True
     return False
 
 
-def createDestination(localDir, backupDir):
+def createDestination(localDir, backupDir, st=None, xattrs=None):
     """
     Create a backup directory with the same stat and ownership
-    as the local directory.
+    as the local directory.  The extended attributes already read from the
+    local directory can be provided.  The metadata is applied through the
+    new directory's file descriptor, so its path is only resolved once.
     """
-    if exists(backupDir) is False:
+    try:
         os.mkdir(backupDir)
-        shutil.copystat(localDir, backupDir)
-        fn.copyOwnership(localDir, backupDir)
+    except OSError as ex:
+        if ex.errno == errno.EEXIST:
+            return
+        raise
+    st = st or os.lstat(localDir)
+    if xattrs is None:
+        xattrs = fn.getXattrs(localDir)
+    fd = os.open(backupDir, os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW)
+    try:
+        copier.applyDirectoryMetadata(fd, backupDir, st, xattrs)
+    finally:
+        os.close(fd)
 
 
 def backupLink(backupRoot, symbolicLink, altRoot):
     """
-    Backup a symbolic link.
+    Backup a symbolic link.  Returns the value of the link.
     """
     realValue = os.readlink(symbolicLink)
     newLinkDest = backupRoot + fn.removeAltRoot(altRoot, symbolicLink)
     os.symlink(realValue, newLinkDest)
+    return realValue
 
 
-def backupFile(backupRoot, previousBackup, file_, altRoot, writer):
+def backupFile(backupRoot, previousBackup, file_, altRoot, eventLog,
+               st=None):
     """
     Backup a file to according to the files state.  If it's new or modified,
     it's copied otherwise a hard link is created pointing to the file found
     in the previous backup.
     """
+    _, job, args = getFileJob(
+        backupRoot, previousBackup, file_, altRoot, eventLog, st)
+    job(*args)
+
+
+def getFileJob(backupRoot, previousBackup, file_, altRoot, eventLog,
+               st=None, isChanged=None, objectStore=None, chunkStore=None,
+               encoding=None, directories=()):
+    """
+    Returns the job needed to backup a file as a tuple of the number of
+    bytes it will write, the function to call and its arguments.  If it's
+    not known whether the file changed, the previous backup is checked.
+    Changed files are written with the provided encoding, through the
+    object store when one is given.  Files are linked relative to the open
+    directories of the backup and the previous backup when they are given.
+    """
     previousFileName = previousBackup + fn.removeAltRoot(altRoot, file_)
     backupFileName = backupRoot + fn.removeAltRoot(altRoot, file_)
 
-    if isFileModifiedOrNew(previousFileName, file_):
-        writer("Copying: {0}".format(file_))
-        fn.copy(file_, backupFileName)
+    if isChanged is None:
+        isChanged = isFileModifiedOrNew(previousFileName, file_, st)
+    if isChanged:
+        eventLog.log(events.COPY, file_)
+        st = st or os.lstat(file_)
+        if chunkStore and encoding == chunks.STORAGE:
+            return st.st_size, chunkStore.writeFile, \
+                (file_, backupFileName, st)
+        if objectStore:
+            return st.st_size, objectStore.backupFile, \
+                (file_, backupFileName, st, encoding)
+        return st.st_size, fn.copyFile, \
+            (file_, backupFileName, st, None, encoding)
     else:
-        writer("Linking: {0}".format(file_))
-        os.link(previousFileName, backupFileName)
+        eventLog.log(events.LINK, file_)
+        return 0, linkFile, \
+            (previousFileName, backupFileName, file_, st, directories)
+
+
+def linkFile(previousFile, backupFile, localFile, st=None, directories=(),
+             xattrs=None):
+    """
+    Hard link a file from the previous backup.  The file is copied instead
+    when it's missing from the previous backup, which can happen when it
+    was removed after the previous backup's catalog was written, using the
+    extended attributes provided.  When the open directories of the backup
+    and the previous backup are provided, the file is linked relative to
+    them.
+    """
+    try:
+        if len(directories) == 2:
+            name = os.path.basename(backupFile)
+            dest, destFd = directories[0].item(name)
+            src, srcFd = directories[1].item(name)
+            os.link(src, dest, src_dir_fd=srcFd, dst_dir_fd=destFd)
+        else:
+            os.link(previousFile, backupFile)
+    except OSError as ex:
+        if ex.errno != errno.ENOENT:
+            raise
+        fn.copyFile(localFile, backupFile, st, xattrs=xattrs)
 
 
-def isFileModifiedOrNew(previousFile, localFile):
+def isFileModifiedOrNew(previousFile, localFile, localStat=None,
+                        changeDetection=fn.DEFAULT_CHANGE_DETECTION):
     """
     Returns true if the local file is a new file or if it has been modified
-    since the last backup was ran.
+    since the last backup was ran.  Comparators that only apply to the
+    source file are skipped, since the previous file itself is compared.
+    Without a catalog, the previous file is compared as a plain copy, which
+    is all the backups made before catalogs were written have.
     """
-    if os.path.exists(previousFile) is False:
+    try:
+        previousStat = os.lstat(previousFile)
+    except OSError:
         return True
-    return fn.isModified(localFile, previousFile)
+    return fn.isModified(
+        localFile,
+        previousFile,
+        localStat,
+        previousStat,
+        [c for c in changeDetection
+         if c not in fn.SOURCE_ONLY_CHANGE_DETECTION])
@@ -17,8 +17,12 @@
 # You should have received a copy of the GNU General Public License
 # along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
 from datetime import datetime, timedelta
+import caatinga.core.catalog as catalog
+import caatinga.core.chunks as chunks
 import caatinga.core.functions as fn
+from caatinga.caat.objects import getObjectStoreHome
 
 
 def checkMaxImages(backupHome, maxImages):
@@ -56,3 +60,84 @@ def checkForKeepDays(backupHome, keepDays):
     toRemove = filter(isOld, backups)
     for backup in toRemove:
         fn.markBackupForDeletion(backupHome, backup)
+
+
+def deleteUnreferencedObjects(backupHome, writer):
+    """
+    Delete objects from the object store that are no longer part of any
+    backup.  Those are the objects that don't have any other hard links.
+    The directories of metadata left without objects are removed as well.
+    """
+    home = getObjectStoreHome(backupHome)
+    if not os.path.exists(home):
+        return
+    for bucket in _listDirectories(home):
+        for directory in _listDirectories(bucket):
+            with os.scandir(directory) as objects:
+                unreferenced = [
+                    o for o in objects
+                    if o.stat(follow_symlinks=False).st_nlink == 1]
+            for objectFile in unreferenced:
+                writer("Deleting object: {0}".format(objectFile.name))
+                os.remove(objectFile.path)
+            if not os.listdir(directory):
+                os.rmdir(directory)
+
+
+def _listDirectories(directory):
+    with os.scandir(directory) as entries:
+        return [e.path for e in entries if e.is_dir(follow_symlinks=False)]
+
+
+def deleteUnreferencedChunks(backupHome, writer):
+    """
+    Delete chunks that aren't listed by any chunked file in the backups.
+    Chunked files are found using the catalogs, so nothing is deleted while
+    a backup without a catalog remains.
+    """
+    home = chunks.getChunkStoreHome(backupHome)
+    if not os.path.exists(home):
+        return
+    referenced = set()
+    manifests = set()
+    for backup in fn.getBackups(backupHome).values():
+        catalogFile = catalog.getCatalogFile(backupHome, backup)
+        if not os.path.exists(catalogFile):
+            writer("Keeping chunks, {0} has no catalog".format(backup))
+            return
+        _addReferencedChunks(
+            os.path.join(backupHome, backup),
+            catalogFile,
+            referenced,
+            manifests)
+    with os.scandir(home) as buckets:
+        buckets = [b.path for b in buckets if b.is_dir(follow_symlinks=False)]
+    for bucket in buckets:
+        with os.scandir(bucket) as chunkFiles:
+            unreferenced = [c for c in chunkFiles if c.name not in referenced]
+        for chunkFile in unreferenced:
+            writer("Deleting chunk: {0}".format(chunkFile.name))
+            os.remove(chunkFile.path)
+
+
+def _addReferencedChunks(backup, catalogFile, referenced, manifests):
+    """
+    Add the digests of the chunks used by the chunked files of a backup.
+    Manifests shared between backups through hard links are read once,
+    using the inodes of the manifests that were already read.
+    """
+    reader = catalog.CatalogReader(catalogFile)
+    try:
+        for row in reader.iterEntries():
+            if catalog.getStorage(row) != chunks.STORAGE or \
+                    row["backup_ino"] in manifests:
+                continue
+            manifests.add(row["backup_ino"])
+            try:
+                referenced.update(
+                    chunks.readManifest(backup + catalog.getPath(row))[1])
+            except (IOError, ValueError, IndexError):
+                # The file was copied rather than chunked, or removed.
+                pass
+    finally:
+        reader.close()
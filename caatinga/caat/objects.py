@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Chris Taylor
+#
+# This file is part of caatinga.
+#
+# Caatinga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Caatinga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
+
+import errno
+import hashlib
+import os
+import caatinga.core.functions as fn
+from os.path import join
+
+__all__ = ["ObjectStore", "getObjectStoreHome"]
+
+
+def getObjectStoreHome(backupHome):
+    """
+    Returns the directory of the object store for the provided backup home.
+    """
+    return join(backupHome, "objects")
+
+
+class ObjectStore:
+    """
+    Content addressed store of the files written to the backups of a host.
+    Each object is a hard link to a file found in one or more backups,
+    named after a digest of its contents.  New and modified files with the
+    same contents as an object are linked to it instead of being copied,
+    which covers moved or renamed files as well as duplicates.
+
+    Hard links share their ownership, permissions, times and extended
+    attributes, so objects are kept in a directory named after a digest of
+    these.  Contents are only shared by files that agree on them, which
+    keeps every backup image a faithful copy of the source.  Copies and
+    files reverted to an older version have a new modified time, so they
+    aren't shared.
+
+    Files are digested while they are copied.  Only when an object with the
+    same metadata exists, as it does for moved and renamed files, is the
+    file digested before it's copied, so it can be linked instead.
+    """
+
+    def __init__(self, home):
+        self.home = home
+
+    def backupFile(self, src, dest, st, encoding=None, xattrs=None):
+        """
+        Link dest to the object matching src if there is one, otherwise
+        copy src to dest using the provided encoding and add it to the store.
+        The extended attributes of src are read unless they are provided,
+        and are applied to the copy.
+        """
+        if xattrs is None:
+            xattrs = fn.getXattrs(src)
+        directory = self._getObjectDirectory(st, encoding, xattrs)
+        if os.path.isdir(directory):
+            objectFile = join(directory, fn.getDigest(src))
+            try:
+                os.link(objectFile, dest)
+                return
+            except OSError as ex:
+                if ex.errno != errno.ENOENT:
+                    raise
+            copied = fn.copyFile(
+                src, dest, st, encoding=encoding, xattrs=xattrs)
+        else:
+            digest = hashlib.sha256()
+            copied = fn.copyFile(
+                src, dest, st, encoding=encoding, digest=digest,
+                xattrs=xattrs)
+            objectFile = join(directory, digest.hexdigest())
+        if copied and self._isUnchanged(src, st):
+            self._add(dest, objectFile)
+
+    def _getObjectDirectory(self, st, encoding, xattrs):
+        """
+        Returns the directory of the objects sharing the provided metadata.
+        Objects are also shared by files that are encoded the same way.
+        """
+        key = hashlib.sha256("{0:o}-{1}-{2}-{3}-{4}-{5}".format(
+            st.st_mode, st.st_uid, st.st_gid, st.st_mtime_ns, st.st_size,
+            encoding or "").encode())
+        for name, value in sorted(xattrs.items()):
+            key.update(b"\0" + os.fsencode(name) + b"\0" +
+                       str(len(value)).encode() + b"\0" + value)
+        name = key.hexdigest()
+        return join(self.home, name[:2], name)
+
+    def _isUnchanged(self, src, st):
+        """
+        Returns True if src wasn't modified while it was being backed up,
+        so the copy really has the contents the object is named after.
+        """
+        try:
+            current = os.stat(src)
+        except OSError:
+            return False
+        return current.st_mtime_ns == st.st_mtime_ns and \
+            current.st_size == st.st_size
+
+    def _add(self, file_, objectFile):
+        try:
+            os.makedirs(os.path.dirname(objectFile), exist_ok=True)
+            os.link(file_, objectFile)
+        except OSError as ex:
+            # Another worker may have stored the same contents first, or the
+            # copy may have failed.  Either way the backup is still correct.
+            if ex.errno not in (errno.EEXIST, errno.ENOENT):
+                raise
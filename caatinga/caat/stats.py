@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Chris Taylor
+#
+# This file is part of caatinga.
+#
+# Caatinga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Caatinga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+__all__ = ["BackupStats"]
+
+_COUNTERS = [
+    ("directories_scanned", "Directories scanned"),
+    ("directories_cloned", "Directories cloned"),
+    ("files_scanned", "Files scanned"),
+    ("files_copied", "Files copied"),
+    ("files_linked", "Files linked"),
+    ("hard_links", "Hard links"),
+    ("links", "Symbolic links"),
+    ("ignored", "Items ignored"),
+    ("resumed", "Items resumed"),
+    ("bytes_copied", "Bytes copied"),
+    ("errors", "Errors"),
+]
+_TIMERS = [
+    ("hooks", "Hooks"),
+    ("scan", "Scan"),
+    ("copy", "Copy"),
+    ("link", "Link"),
+    ("backup", "Backup"),
+    ("sync", "Sync"),
+    ("maintenance", "Maintenance"),
+]
+
+
+class BackupStats:
+    """
+    Counters and timers describing a backup run.  Every thread updates its
+    own counters, so nothing is locked while files are backed up, and the
+    totals are only added up when they are read.  Timers add up the seconds
+    spent in each phase, which for the copy and link jobs is the time spent
+    by all of the workers together.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._threads = []
+        self._merged = (Counter(), Counter())
+        self.started = time.time()
+        self.finished = None
+
+    def add(self, name, value=1):
+        """
+        Add the value to the named counter.
+        """
+        self._getThreadStats()[0][name] += value
+
+    def addTime(self, name, seconds):
+        """
+        Add the seconds to the named timer.
+        """
+        self._getThreadStats()[1][name] += seconds
+
+    @contextmanager
+    def timer(self, name):
+        """
+        Time the enclosed block using the named timer.
+        """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.addTime(name, time.monotonic() - start)
+
+    def getCounters(self):
+        """
+        Returns the totals of the counters.
+        """
+        return self._getTotals()[0]
+
+    def getTimers(self):
+        """
+        Returns the totals of the timers in seconds.
+        """
+        return self._getTotals()[1]
+
+    def snapshot(self):
+        """
+        Returns the totals as a pair of plain dictionaries, which can be
+        handed from a shard process back to the parent.
+        """
+        counters, timers = self._getTotals()
+        return dict(counters), dict(timers)
+
+    def merge(self, snapshot):
+        """
+        Add the totals of a snapshot taken in another process.
+        """
+        counters, timers = snapshot
+        with self._lock:
+            self._merged[0].update(counters)
+            self._merged[1].update(timers)
+
+    def finish(self):
+        """
+        Record the time the run finished.
+        """
+        self.finished = time.time()
+
+    def toDict(self):
+        """
+        Returns the statistics as a dictionary suitable for JSON.
+        """
+        counters, timers = self._getTotals()
+        return {
+            "started": _formatTime(self.started),
+            "finished": self.finished and _formatTime(self.finished),
+            "counters": dict((n, counters[n]) for n, _ in _COUNTERS),
+            "timers": dict((n, round(timers[n], 3)) for n, _ in _TIMERS),
+            "bytes_per_second": self._getThroughput(counters, timers),
+        }
+
+    def write(self, fileName):
+        """
+        Write the statistics to a JSON file.
+        """
+        with open(fileName, 'w') as f:
+            json.dump(self.toDict(), f, indent=2, sort_keys=True)
+            f.write("\n")
+
+    def getSummary(self):
+        """
+        Returns a human readable summary of the statistics.
+        """
+        counters, timers = self._getTotals()
+        width = max(len(label) for _, label in _COUNTERS + _TIMERS) + 2
+        lines = ["{0:<{1}}{2}".format(label + ":", width, counters[name])
+                 for name, label in _COUNTERS]
+        lines.append("{0:<{1}}{2}/s".format(
+            "Throughput:", width,
+            _formatBytes(self._getThroughput(counters, timers))))
+        lines.extend("{0:<{1}}{2:.2f}s".format(label + ":", width,
+                                               timers[name])
+                     for name, label in _TIMERS)
+        return "\n".join(lines)
+
+    def _getThreadStats(self):
+        stats = getattr(self._local, "stats", None)
+        if stats is None:
+            stats = self._local.stats = (Counter(), Counter())
+            with self._lock:
+                self._threads.append(stats)
+        return stats
+
+    def _getTotals(self):
+        counters, timers = Counter(), Counter()
+        with self._lock:
+            for threadCounters, threadTimers in \
+                    [self._merged] + self._threads:
+                counters.update(threadCounters)
+                timers.update(threadTimers)
+        return counters, timers
+
+    def _getThroughput(self, counters, timers):
+        if timers["backup"] <= 0:
+            return 0
+        return int(counters["bytes_copied"] / timers["backup"])
+
+
+def _formatTime(seconds):
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(seconds))
+
+
+def _formatBytes(size):
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if size < 1024:
+            return "{0:.1f} {1}".format(size, unit)
+        size /= 1024.0
+    return "{0:.1f} TiB".format(size)
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Chris Taylor
+#
+# This file is part of caatinga.
+#
+# Caatinga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Caatinga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+from collections import deque
+
+__all__ = ["BackupWorkers", "ConcurrencyController", "openWorkers"]
+
+_MAX_IN_FLIGHT_BYTES = 256 * 1024 * 1024
+_MAX_QUEUED_PER_WORKER = 64
+
+# A window of completed jobs is measured before the concurrency changes.
+_WINDOW_JOBS = 32
+_WINDOW_SECONDS = 0.25
+# Cost of a job in bytes on top of the bytes it writes, so windows of small
+# files and links are compared fairly with windows of large files.
+_JOB_COST = 64 * 1024
+# Latency growing past this factor of the previous window, or throughput
+# gaining less than this factor after the limit was raised, means the
+# devices are saturated.
+_LATENCY_FACTOR = 2.0
+_THROUGHPUT_GAIN = 1.05
+
+
+def openWorkers(settings):
+    """
+    Returns the pool of workers configured by the settings.  With
+    adaptive_workers, the number of workers copying at once is adjusted
+    between min_backup_workers and backup_workers.
+    """
+    minWorkers = settings.minBackupWorkers if settings.adaptiveWorkers \
+        else None
+    return BackupWorkers(settings.backupWorkers, minWorkers=minWorkers)
+
+
+class BackupWorkers:
+    """
+    Pool of threads that perform the copy and link jobs queued by the backup
+    walker.  Jobs are grouped by the directory they are written to, allowing
+    a directory to be finished only after all of its children are written.
+    When a single worker is requested, jobs run right away on the calling
+    thread.  When a minimum number of workers is provided, the number of
+    jobs running at once is adjusted between it and the number of workers
+    by a ConcurrencyController.
+    """
+
+    def __init__(self, workers=1, maxInFlightBytes=_MAX_IN_FLIGHT_BYTES,
+                 minWorkers=None):
+        self._maxInFlightBytes = maxInFlightBytes
+        self._maxQueued = workers * _MAX_QUEUED_PER_WORKER
+        self._condition = threading.Condition()
+        self._jobs = deque()
+        self._inFlightBytes = 0
+        self._running = 0
+        self._controller = None
+        if minWorkers is not None and 1 < workers:
+            self._controller = ConcurrencyController(minWorkers, workers)
+        self._error = None
+        self._isClosed = False
+        self._threads = []
+        if workers > 1:
+            for _ in range(workers):
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exceptionType, exception, traceback):
+        if exceptionType:
+            self.cancel()
+        else:
+            self.join()
+
+    def openDirectory(self, onFinished):
+        """
+        Returns a handle used to group jobs of a directory.  The provided
+        function is called once the directory is closed and every job that
+        was submitted for it has finished.
+        """
+        return _DirectoryJobs(onFinished)
+
+    def closeDirectory(self, directory):
+        """
+        Indicates no more jobs will be submitted for the directory.
+        """
+        with self._condition:
+            directory.isClosed = True
+            isFinished = directory.pending == 0
+        if isFinished:
+            directory.onFinished()
+
+    def submit(self, directory, size, job, *args):
+        """
+        Queue a job for the provided directory.  Size is the number of bytes
+        the job will write, and is used to bound the amount of outstanding
+        work.  Blocks while the pool is full.
+        """
+        if not self._threads:
+            job(*args)
+            return
+        with self._condition:
+            while self._error is None and self._isFull(size):
+                self._condition.wait()
+            self._raiseError()
+            directory.pending += 1
+            self._inFlightBytes += size
+            self._jobs.append((directory, size, job, args))
+            self._condition.notify_all()
+
+    def join(self):
+        """
+        Wait for all queued jobs to finish.  The first error raised by a job
+        is raised again here.
+        """
+        with self._condition:
+            self._isClosed = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._raiseError()
+
+    def cancel(self):
+        """
+        Discard any queued jobs and wait for the running ones to finish.
+        """
+        with self._condition:
+            self._jobs.clear()
+            self._isClosed = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    def getConcurrency(self):
+        """
+        Returns the number of jobs allowed to run at once.
+        """
+        if self._controller:
+            return self._controller.limit
+        return max(len(self._threads), 1)
+
+    def _isFull(self, size):
+        if len(self._jobs) >= self._maxQueued:
+            return True
+        return self._inFlightBytes > 0 and \
+            self._inFlightBytes + size > self._maxInFlightBytes
+
+    def _raiseError(self):
+        if self._error is not None:
+            raise self._error
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._canStart():
+                    if not self._jobs and self._isClosed:
+                        return
+                    self._condition.wait()
+                directory, size, job, args = self._jobs.popleft()
+                self._running += 1
+            start = time.monotonic()
+            try:
+                if self._error is None:
+                    job(*args)
+            except BaseException as ex:
+                # Interrupts are raised again by join as well, so a job
+                # isn't dropped without the backup failing.
+                self._setError(ex)
+            if self._completeJob(directory, size, start):
+                try:
+                    directory.onFinished()
+                except BaseException as ex:
+                    self._setError(ex)
+
+    def _canStart(self):
+        return self._jobs and self._running < self.getConcurrency()
+
+    def _completeJob(self, directory, size, start):
+        with self._condition:
+            directory.pending -= 1
+            self._inFlightBytes -= size
+            self._running -= 1
+            if self._controller:
+                self._controller.record(size, time.monotonic() - start)
+            self._condition.notify_all()
+            return directory.isClosed and directory.pending == 0 and \
+                self._error is None
+
+    def _setError(self, error):
+        with self._condition:
+            if self._error is None:
+                self._error = error
+            self._condition.notify_all()
+
+
+class ConcurrencyController:
+    """
+    Adjusts the number of jobs running at once from the latency and
+    throughput of the jobs, within the provided bounds.  Completed jobs are
+    measured in windows, and the limit is raised by one after each window
+    until the devices are saturated.  They are saturated when raising the
+    limit didn't gain throughput, or when latency jumps because of other
+    work on the devices, and the limit is then cut by a quarter.  The
+    controller isn't thread safe, the pool records jobs while holding its
+    lock.
+    """
+
+    def __init__(self, minimum, maximum):
+        self.minimum = max(minimum, 1)
+        self.maximum = max(maximum, self.minimum)
+        self.limit = self.minimum
+        self._throughput = None
+        self._latency = None
+        self._isRaised = False
+        self._resetWindow(None)
+
+    def record(self, size, elapsed, now=None):
+        """
+        Record a completed job that wrote size bytes in elapsed seconds.
+        """
+        now = time.monotonic() if now is None else now
+        if self._windowStart is None:
+            self._windowStart = now - elapsed
+        self._windowJobs += 1
+        self._windowCost += size + _JOB_COST
+        self._windowLatency += elapsed
+        if self._windowJobs >= _WINDOW_JOBS and \
+                now - self._windowStart >= _WINDOW_SECONDS:
+            self._adjust(
+                self._windowCost / (now - self._windowStart),
+                self._windowLatency / self._windowJobs)
+            self._resetWindow(now)
+
+    def _adjust(self, throughput, latency):
+        isSaturated = self._throughput is not None and (
+            latency > self._latency * _LATENCY_FACTOR or
+            self._isRaised and
+            throughput < self._throughput * _THROUGHPUT_GAIN)
+        previous = self.limit
+        if isSaturated:
+            self.limit = max(self.minimum, self.limit * 3 // 4)
+        else:
+            self.limit = min(self.maximum, self.limit + 1)
+        self._isRaised = self.limit > previous
+        self._throughput = throughput
+        self._latency = latency
+
+    def _resetWindow(self, now):
+        self._windowStart = now
+        self._windowJobs = 0
+        self._windowCost = 0
+        self._windowLatency = 0.0
+
+
+class _DirectoryJobs:
+    """
+    Tracks the outstanding jobs of a single directory.
+    """
+
+    __slots__ = ("pending", "isClosed", "onFinished")
+
+    def __init__(self, onFinished):
+        self.pending = 0
+        self.isClosed = False
+        self.onFinished = onFinished
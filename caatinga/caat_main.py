@@ -20,12 +20,18 @@
 import os
 import re
 import errno
+import caatinga.core.catalog as catalog
+import caatinga.core.durability as durability
 import caatinga.core.functions as fn
+import caatinga.core.journal as journal
+import caatinga.core.throttle as throttle
 import caatinga.caat.backup as backup
 import caatinga.caat.maintenance as maint
 from time import strftime
 from caatinga.core.args import getArgs
+from caatinga.core.events import openEventLog
 from caatinga.caat.organizer import organize
+from caatinga.caat.stats import BackupStats
 from caatinga.core.validation import SettingsValidator, ValidationException
 
 __version__ = "1.1.1"
@@ -76,21 +82,35 @@ def run_backup():
     settings = fn.getSettingsInstance(commandArgs)
     lockFileName = settings.hostName + "-caatinga"
     SettingsValidator().validate(settings)
+    throttle.setPriority(settings.ioClass, settings.ioPriority, settings.nice)
+    throttle.setLimits(
+        settings.maxReadRate, settings.maxWriteRate, settings.maxIops)
+    durability.setMode(settings.durability)
     bkHome = fn.getBackupHome(settings.backupLocation, settings.hostName)
     lockFile = backup.getLockFile("/tmp", lockFileName)
     outWriter = fn.getOutputWriter(commandArgs.verbose)
     previousBackup = os.path.realpath(fn.getLatestLink(bkHome))
+    stats = BackupStats()
 
-    fn.runHooks(settings.preBackupHooksDir)
+    with stats.timer("hooks"):
+        fn.runHooks(settings.preBackupHooksDir)
     checkForRegisterOption(settings, commandArgs, bkHome)
     insureBackupLocationIsRegistered(
         settings.backupLocation,
         settings.hostName)
     lock(lockFile)
-    runNonBackupFunctions(bkHome, settings, commandArgs, outWriter, lockFile)
-    executeBackup(bkHome, previousBackup, settings, outWriter, lockFile)
-    runMaintenanceFunctions(bkHome, settings, outWriter)
-    fn.runHooks(settings.postBackupHooksDir)
+    resumable = backup.getResumableBackup(bkHome, previousBackup, settings)
+    runNonBackupFunctions(
+        bkHome, settings, commandArgs, outWriter, lockFile, resumable)
+    eventLog = openEventLog(settings, commandArgs.verbose)
+    backupRoot = executeBackup(
+        bkHome, previousBackup, settings, eventLog, lockFile, stats,
+        resumable)
+    with stats.timer("maintenance"):
+        runMaintenanceFunctions(bkHome, settings, outWriter)
+    with stats.timer("hooks"):
+        fn.runHooks(settings.postBackupHooksDir)
+    writeStats(bkHome, backupRoot, stats, commandArgs.stats)
 
 
 def checkForRegisterOption(settings, commandArgs, bkHome):
@@ -151,14 +171,16 @@ def _isPidRunning(pid):
         return e.errno == errno.EPERM
 
 
-def runNonBackupFunctions(bkHome, settings, commandArgs, outWriter, lockFile):
+def runNonBackupFunctions(bkHome, settings, commandArgs, outWriter, lockFile,
+                          resumable=None):
     """
     Execute functions that do not pertain to actually performing a backup and
-    are more intended on pre-backup conditions.
+    are more intended on pre-backup conditions.  The partial backup that
+    will be resumed, if any, is kept.
     """
     try:
         checkForDeleteOldest(commandArgs, bkHome)
-        markPartialBackupForDeletion(bkHome)
+        markPartialBackupForDeletion(bkHome, resumable)
         checkForClean(commandArgs, bkHome, outWriter)
     except CleanExitException:
         fn.runHooks(settings.postBackupHooksDir)
@@ -177,16 +199,21 @@ def checkForDeleteOldest(commandArgs, bkHome):
         raise CleanExitException()
 
 
-def markPartialBackupForDeletion(bkHome):
+def markPartialBackupForDeletion(bkHome, resumable=None):
     """
-    Looks for any partial backups and marks them for deletion.
+    Looks for any partial backups and marks them for deletion, except the
+    one that will be resumed.
     """
     if not os.path.exists(bkHome):
         return
     partials = fn.getPartialBackups(bkHome)
     for partial in partials:
+        if partial == resumable:
+            continue
         partialBackup = os.path.join(bkHome, partial)
         os.rename(partialBackup, partialBackup.replace(".part", ".delete"))
+        catalog.renameCatalog(
+            bkHome, partial, partial.replace(".part", ".delete"))
 
 
 def checkForClean(commandArgs, bkHome, writer):
@@ -199,28 +226,100 @@ def checkForClean(commandArgs, bkHome, writer):
         raise CleanExitException()
 
 
-def executeBackup(bkHome, previousBackup, settings, outWriter, lockFile):
+def executeBackup(bkHome, previousBackup, settings, eventLog, lockFile,
+                  stats=None, resumable=None):
     """
-    Perform the backup using the settings provided by the user.
+    Perform the backup using the settings provided by the user.  Returns the
+    root of the completed backup image.  Items backed up are reported to
+    the event log, which is closed once the backup is done.  The counters
+    and timers of the backup are added to stats when it's provided.  When
+    the name of a resumable partial backup is provided, the backup picks
+    up where that one was interrupted.  The backup is synced to the backup
+    device before it's renamed to mark it complete, according to the
+    durability setting, so a crash can't leave a complete backup with
+    missing contents.
     """
+    stats = stats or BackupStats()
     try:
-        backupRoot = backup.createBackupRoot(
-            bkHome,
-            strftime("%Y-%m-%d-%H%M%S") + ".part",
-            settings.backupgid)
-
-        backup.backupDirectory(
-            backupRoot,
-            previousBackup,
-            settings.root,
-            settings,
-            outWriter)
-        os.rename(backupRoot, backupRoot.replace(".part", ""))
+        if resumable:
+            partName = resumable
+            backupName = partName.replace(".part", "")
+            backupRoot = os.path.join(bkHome, partName)
+        else:
+            backupName = strftime("%Y-%m-%d-%H%M%S")
+            partName = backupName + ".part"
+            backupRoot = backup.createBackupRoot(
+                bkHome,
+                partName,
+                settings.backupgid)
+        catalogWriter = catalog.CatalogWriter(
+            catalog.getCatalogFile(bkHome, partName))
+        try:
+            # Parts written by the processes of the interrupted backup.
+            resumable and catalogWriter.mergeParts()
+            segment = None
+            if settings.journal:
+                segment = journal.takeSegment(settings.journal)
+
+            with stats.timer("backup"):
+                backup.backupDirectory(
+                    backupRoot,
+                    previousBackup,
+                    settings.root,
+                    settings,
+                    eventLog,
+                    catalogWriter,
+                    segment,
+                    stats,
+                    resumable is not None)
+                catalogWriter.clearProgress()
+        finally:
+            # The items and progress still buffered are written when the
+            # backup fails as well, so the next run can resume from them.
+            catalogWriter.close()
+        with stats.timer("sync"):
+            durability.syncFileSystem(backupRoot)
+        completeBackup(bkHome, partName, backupName)
         fn.updateLatestLink(bkHome)
+        durability.syncDirectory(bkHome)
+        return os.path.join(bkHome, backupName)
     finally:
+        eventLog.close()
         backup.removeLockFile(lockFile)
 
 
+def completeBackup(bkHome, partName, backupName):
+    """
+    Rename a partial backup and its catalog to mark the backup complete.
+    A backup that already has the name is never replaced.  The image is
+    renamed first, so a catalog with the final name always belongs to a
+    complete image.
+    """
+    if os.path.lexists(os.path.join(bkHome, backupName)) or \
+            os.path.lexists(catalog.getCatalogFile(bkHome, backupName)):
+        raise Exception("A backup named {0} already exists".format(
+            backupName))
+    os.rename(
+        os.path.join(bkHome, partName), os.path.join(bkHome, backupName))
+    catalog.renameCatalog(bkHome, partName, backupName)
+    durability.syncDirectory(bkHome)
+
+
+def writeStats(bkHome, backupRoot, stats, isPrinted):
+    """
+    Write the statistics of the backup next to its catalog, and print a
+    summary of them if requested.  The image may have already been removed
+    by the maintenance functions, in which case only the summary is
+    printed.
+    """
+    stats.finish()
+    if os.path.isdir(backupRoot):
+        stats.write(catalog.getStatsFile(
+            bkHome, os.path.basename(backupRoot)))
+    if isPrinted:
+        print(stats.getSummary())
+
+
 def runMaintenanceFunctions(bkHome, settings, outputWriter):
     """
     Execute maintenance functions that are intended to be ran after a
@@ -230,6 +329,9 @@ def runMaintenanceFunctions(bkHome, settings, outputWriter):
     settings.keepDays and maint.checkForKeepDays(bkHome, settings.keepDays)
     settings.maxImages and maint.checkMaxImages(bkHome, settings.maxImages)
     maint.deleteBackupsMarkedForDeletion(bkHome, outputWriter)
+    settings.dedup and maint.deleteUnreferencedObjects(bkHome, outputWriter)
+    settings.chunkThreshold and \
+        maint.deleteUnreferencedChunks(bkHome, outputWriter)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Chris Taylor
+#
+# This file is part of caatinga.
+#
+# Caatinga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Caatinga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
+
+import ctypes
+import ctypes.util
+import os
+import struct
+
+__all__ = ["Inotify", "IN_MODIFY", "IN_ATTRIB", "IN_CLOSE_WRITE",
+           "IN_MOVED_FROM", "IN_MOVED_TO", "IN_CREATE", "IN_DELETE",
+           "IN_DELETE_SELF", "IN_MOVE_SELF", "IN_Q_OVERFLOW", "IN_IGNORED",
+           "IN_ISDIR"]
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = os.O_CLOEXEC
+_EVENT = struct.Struct("iIII")
+_READ_SIZE = 64 * 1024
+
+
+class Inotify:
+    """
+    Minimal interface to the Linux inotify API using ctypes.
+    """
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._libc.inotify_add_watch.argtypes = [
+            ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = self._check(
+            self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC))
+
+    def addWatch(self, path, mask):
+        """
+        Watch a directory for the events in the mask.  Returns the watch
+        descriptor, which is the same one when the directory is already
+        watched under another path.
+        """
+        return self._check(self._libc.inotify_add_watch(
+            self.fd,
+            os.fsencode(path),
+            mask | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK))
+
+    def readEvents(self):
+        """
+        Returns the events that are waiting as a list of tuples of the watch
+        descriptor, mask and name.  Returns an empty list when there are
+        none.
+        """
+        try:
+            data = os.read(self.fd, _READ_SIZE)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+    def _check(self, result):
+        if result < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+        return result
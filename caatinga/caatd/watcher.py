@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Chris Taylor
+#
+# This file is part of caatinga.
+#
+# Caatinga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Caatinga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
+
+import errno
+import os
+import caatinga.core.ignore as ignore
+import caatinga.core.journal as journal
+from caatinga.caatd.inotify import (
+    IN_MODIFY, IN_ATTRIB, IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE,
+    IN_DELETE_SELF, IN_MOVE_SELF, IN_Q_OVERFLOW, IN_IGNORED, IN_ISDIR)
+from os.path import join
+
+__all__ = ["Watcher"]
+
+_MASK = IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | \
+    IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+
+# Files that change which items are backed up below their directory.
+_TREE_FILES = (ignore.IGNORE_FILE, ignore.CACHEDIR_TAG)
+
+
+class Watcher:
+    """
+    Watches every directory of a tree and records the directories that
+    change to the journal.  A directory is recorded when any of its entries
+    are created, removed, renamed, written or have their metadata changed.
+    Directories created or moved into the tree are recorded as trees, since
+    nothing below them was seen before.
+    """
+
+    def __init__(self, inotify, journalWriter, ignored, writer):
+        self.inotify = inotify
+        self.journal = journalWriter
+        self.ignored = ignored
+        self.writer = writer
+        self._paths = {}
+
+    def watchTree(self, directory):
+        """
+        Watch a directory and every directory below it.  A directory that
+        is already watched, such as one that was moved, keeps its watch
+        under its new path.
+        """
+        pending = [directory]
+        while pending:
+            directory = pending.pop()
+            if directory in self.ignored:
+                continue
+            try:
+                self._paths[self.inotify.addWatch(directory, _MASK)] = \
+                    directory
+                with os.scandir(directory) as entries:
+                    pending.extend(e.path for e in entries
+                                   if e.is_dir(follow_symlinks=False))
+            except OSError as ex:
+                if ex.errno == errno.ENOENT:
+                    continue
+                # Changes below this directory can't be seen, which includes
+                # running out of watches.
+                self.writer("Unable to watch {0}: {1}".format(
+                    directory, ex.strerror))
+                self.journal.overflow()
+
+    def handleEvents(self, events):
+        """
+        Record the directories changed by a list of inotify events.
+        """
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                self.writer("Event queue overflow")
+                self.journal.overflow()
+                continue
+            directory = self._paths.get(wd)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                del self._paths[wd]
+            elif not name:
+                # The watched directory itself changed.
+                self.journal.add(journal.DIRECTORY, directory)
+                self.journal.add(
+                    journal.DIRECTORY, os.path.dirname(directory))
+            else:
+                self._handleEntry(directory, mask, name)
+
+    @property
+    def watches(self):
+        return len(self._paths)
+
+    def _handleEntry(self, directory, mask, name):
+        path = join(directory, name)
+        self.journal.add(journal.DIRECTORY, directory)
+        if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+            if path not in self.ignored:
+                self.journal.add(journal.TREE, path)
+                self.watchTree(path)
+        elif name in _TREE_FILES:
+            self.journal.add(journal.TREE, directory)
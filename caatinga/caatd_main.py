@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Chris Taylor
+#
+# This file is part of caatinga.
+#
+# Caatinga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Caatinga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import re
+import select
+import signal
+import uuid
+import caatinga.caat_main as caat
+import caatinga.core.functions as fn
+import caatinga.core.journal as journal
+from caatinga.caatd.inotify import Inotify
+from caatinga.caatd.watcher import Watcher
+from caatinga.core.args import getArgs
+
+_FLUSH_INTERVAL = 1.0
+
+
+def main():
+    """
+    Application entry point.
+    """
+    try:
+        run_daemon()
+        exit(0)
+    except KeyboardInterrupt:
+        exit(0)
+    except Exception as ex:
+        print(str(ex).strip("'"))
+        exit(1)
+
+
+def run_daemon():
+    """
+    Main method that watches the root directory and records changes to the
+    journal until the daemon is stopped.
+    """
+    commandArgs = getArgs()
+    if commandArgs.version:
+        print("caatd version: " + caat.__version__)
+        exit(0)
+
+    settings = fn.getSettingsInstance(commandArgs)
+    if not settings.journal:
+        raise Exception(
+            "No journal directory specified (see man caatinga.conf)")
+    if not os.path.isdir(settings.root):
+        raise Exception("Root directory doesn't exist.")
+    os.makedirs(settings.journal, exist_ok=True)
+    pidFile = journal.getPidFile(settings.journal)
+    lock(pidFile)
+    try:
+        watch(settings, fn.getOutputWriter(commandArgs.verbose))
+    finally:
+        os.remove(pidFile)
+
+
+def lock(pidFile):
+    """
+    Write the pid file of the daemon.  An exception is raised if another
+    daemon is already running for the journal.
+    """
+    if os.path.exists(pidFile):
+        with open(pidFile) as f:
+            pid = f.readline()
+        if re.match(r"^[0-9]+$", pid) and caat._isPidRunning(pid):
+            raise Exception("caatd is already running [{0}]".format(pid))
+    with open(pidFile, 'w') as f:
+        f.write(str(os.getpid()))
+
+
+def watch(settings, writer):
+    """
+    Record the directories that change below the root directory.  The
+    current segment of the journal is ended whenever caat asks for it by
+    sending SIGUSR1.
+    """
+    requests = []
+    wakeupRead, wakeupWrite = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+    signal.set_wakeup_fd(wakeupWrite)
+    signal.signal(signal.SIGUSR1, lambda *args: requests.append(True))
+    signal.signal(signal.SIGTERM, _stop)
+
+    inotify = Inotify()
+    journalWriter = journal.JournalWriter(settings.journal, uuid.uuid4().hex)
+    watcher = Watcher(inotify, journalWriter, settings.ignored, writer)
+    watcher.watchTree(os.path.normpath(settings.root))
+    writer("Watching {0} directories".format(watcher.watches))
+    try:
+        while True:
+            select.select([inotify.fd, wakeupRead], [], [], _FLUSH_INTERVAL)
+            _drain(wakeupRead)
+            _readAllEvents(inotify, watcher)
+            if requests:
+                del requests[:]
+                journalWriter.rotate()
+                writer("Ended journal segment {0}".format(
+                    journalWriter.sequence - 1))
+            journalWriter.flush()
+    finally:
+        inotify.close()
+
+
+def _readAllEvents(inotify, watcher):
+    """
+    Handle every event that is waiting, so a segment ended afterwards
+    includes all changes made before caat asked for it.
+    """
+    events = inotify.readEvents()
+    while events:
+        watcher.handleEvents(events)
+        events = inotify.readEvents()
+
+
+def _drain(fd):
+    try:
+        while os.read(fd, 4096):
+            pass
+    except BlockingIOError:
+        pass
+
+
+def _stop(*args):
+    raise KeyboardInterrupt()
+
+if __name__ == "__main__":
+    main()
@@ -51,14 +51,31 @@ def getArgParser():
     parser.add_argument("-g", "--register",
                         action="store_true",
                         help="Register the backup location as backup device.")
+    parser.add_argument("-j", "--jobs",
+                        metavar="N",
+                        type=int,
+                        default=0,
+                        help="Number of workers copying and linking files.")
     parser.add_argument("-n", "--hostname",
                         default="",
                         dest="hostName",
                         help="Alternate hostname.")
+    parser.add_argument("--processes",
+                        metavar="N",
+                        type=int,
+                        default=0,
+                        help="Number of processes walking the file system.")
     parser.add_argument("-r", "--root",
                         metavar="PATH",
                         default="",
                         help="Alternate root directory to be backed up.")
+    parser.add_argument("-x", "--one-file-system",
+                        dest="oneFileSystem",
+                        action="store_true",
+                        help="Don't cross file system boundaries.")
+    parser.add_argument("--stats",
+                        action="store_true",
+                        help="Display statistics once the backup is done.")
     parser.add_argument("-v", "--verbose",
                         action="store_true",
                         help="Verbose mode.  Display backup activity.")
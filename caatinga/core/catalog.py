@@ -0,0 +1,546 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Chris Taylor
+#
+# This file is part of caatinga.
+#
+# Caatinga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Caatinga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sqlite3
+import stat
+import struct
+import threading
+from glob import glob
+from itertools import groupby
+
+__all__ = ["CatalogWriter", "CatalogReader", "getCatalogFile",
+           "renameCatalog", "removeCatalog", "removeEntries", "getPath",
+           "getStat", "getStorage", "getType", "getXattrs", "isDirectory",
+           "isLink", "isFile"]
+
+FILE = "F"
+DIRECTORY = "D"
+LINK = "L"
+
+_FLUSH_SIZE = 10000
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    parent TEXT NOT NULL,
+    name TEXT NOT NULL,
+    type TEXT NOT NULL,
+    size INTEGER,
+    mtime_ns INTEGER,
+    ctime_ns INTEGER,
+    mode INTEGER,
+    uid INTEGER,
+    gid INTEGER,
+    src_ino INTEGER,
+    backup_ino INTEGER,
+    target TEXT,
+    storage TEXT,
+    src_dev INTEGER,
+    nlink INTEGER,
+    xattrs BLOB,
+    PRIMARY KEY (parent, name)
+) WITHOUT ROWID
+"""
+# The length of the value of an extended attribute, which follows its name.
+_XATTR_LENGTH = struct.Struct(">I")
+_INFO_SCHEMA = """
+CREATE TABLE IF NOT EXISTS info (
+    key TEXT PRIMARY KEY,
+    value TEXT
+)
+"""
+_PROGRESS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS progress (
+    path TEXT PRIMARY KEY
+)
+"""
+_INSERT = "INSERT OR REPLACE INTO entries VALUES " + \
+          "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+
+def getCatalogFile(backupHome, backup):
+    """
+    Returns the name of the catalog file that describes the provided backup.
+    Catalogs are kept next to the backup images in the backup home.
+    """
+    return os.path.join(backupHome, backup + ".catalog")
+
+
+def getStatsFile(backupHome, backup):
+    """
+    Returns the name of the file holding the statistics of the provided
+    backup, which is kept next to its catalog so the image only holds the
+    items backed up.
+    """
+    return os.path.join(backupHome, backup + ".stats.json")
+
+
+def renameCatalog(backupHome, backup, newName):
+    """
+    Rename the catalog and statistics of a backup along with the backup
+    itself.
+    """
+    newFile = getCatalogFile(backupHome, newName)
+    for catalogFile, suffix in _getCatalogFiles(
+            getCatalogFile(backupHome, backup)):
+        if os.path.exists(catalogFile):
+            os.rename(catalogFile, newFile + suffix)
+    statsFile = getStatsFile(backupHome, backup)
+    if os.path.exists(statsFile):
+        os.rename(statsFile, getStatsFile(backupHome, newName))
+
+
+def removeCatalog(backupHome, backup):
+    """
+    Remove the catalog and statistics of a backup, if it has them.
+    """
+    catalogFile = getCatalogFile(backupHome, backup)
+    for part in [catalogFile] + _getCatalogParts(catalogFile):
+        _removeCatalogFiles(part)
+    statsFile = getStatsFile(backupHome, backup)
+    if os.path.exists(statsFile):
+        os.remove(statsFile)
+
+
+def removeEntries(catalogFile, path):
+    """
+    Remove an item from the catalog, including everything under it when the
+    item is a directory.
+    """
+    parent, name = _split(path)
+    connection = sqlite3.connect(catalogFile)
+    try:
+        with connection:
+            connection.execute(
+                "DELETE FROM entries WHERE parent = ? AND name = ?",
+                (parent, name))
+            connection.execute(
+                "DELETE FROM entries WHERE parent = ? OR " +
+                "(parent >= ? AND parent < ?)",
+                _getTreeRange(path))
+            # The backup no longer matches the source as recorded by the
+            # journal, so the next backup has to scan the whole tree.
+            connection.execute(
+                "DELETE FROM info WHERE key LIKE 'journal_%'")
+    finally:
+        connection.close()
+
+
+class CatalogWriter:
+    """
+    Records the metadata of every item written to a backup image.  Items
+    are buffered and written in batches, and may be added from any thread.
+    Directories whose whole tree was backed up are recorded as progress
+    in the same batches, so a partial backup can be resumed from its
+    catalog.  An existing catalog is added to rather than replaced.
+    """
+
+    def __init__(self, catalogFile):
+        self.catalogFile = catalogFile
+        self._lock = threading.Lock()
+        self._rows = []
+        self._completed = []
+        self._connection = sqlite3.connect(
+            catalogFile, check_same_thread=False)
+        # The write ahead log keeps the catalog consistent when a backup is
+        # interrupted, without syncing every batch to disk.
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.execute("PRAGMA synchronous = NORMAL")
+        self._connection.execute(_SCHEMA)
+        self._connection.execute(_INFO_SCHEMA)
+        self._connection.execute(_PROGRESS_SCHEMA)
+
+    def add(self, path, type_, st, backupIno=None, target=None,
+            storage=None, xattrs=None):
+        """
+        Add an item using the stat result of the source item.  The path is
+        relative to the root of the backup.  Storage names how the contents
+        of a file were encoded in the backup, if they were, and xattrs are
+        the extended attributes of the item, if they were read.
+        """
+        parent, name = _split(path)
+        row = (parent, name, type_, st.st_size, st.st_mtime_ns,
+               st.st_ctime_ns, st.st_mode, st.st_uid, st.st_gid, st.st_ino,
+               backupIno, target, storage, st.st_dev, st.st_nlink,
+               _encodeXattrs(xattrs))
+        with self._lock:
+            self._rows.append(row)
+            if len(self._rows) >= _FLUSH_SIZE:
+                self._flush()
+
+    def setInfo(self, key, value):
+        """
+        Record a value describing the backup as a whole, or remove it when
+        the value is None.
+        """
+        with self._lock:
+            if value is None:
+                self._connection.execute(
+                    "DELETE FROM info WHERE key = ?", (key,))
+            else:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO info VALUES (?, ?)",
+                    (key, value))
+            self._connection.commit()
+
+    def markComplete(self, path):
+        """
+        Record that the directory and everything under it were backed up.
+        The mark is written along with the items added before it.
+        """
+        with self._lock:
+            self._completed.append((path,))
+
+    def clearProgress(self):
+        """
+        Remove the progress of the backup once it's complete.
+        """
+        with self._lock:
+            self._completed = []
+            self._connection.execute("DELETE FROM progress")
+            self._connection.commit()
+
+    def forProcess(self, pid):
+        """
+        Returns a writer for a child process.  Each process writes to its
+        own part, which is merged back using mergeParts.
+        """
+        return CatalogWriter("{0}.{1}".format(self.catalogFile, pid))
+
+    def mergeParts(self):
+        """
+        Merge the parts written by child processes into this catalog.
+        """
+        with self._lock:
+            self._flush()
+            for part in _getCatalogParts(self.catalogFile):
+                self._connection.execute("ATTACH DATABASE ? AS part", (part,))
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO entries " +
+                    "SELECT * FROM part.entries")
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO progress " +
+                    "SELECT * FROM part.progress")
+                self._connection.commit()
+                self._connection.execute("DETACH DATABASE part")
+                _removeCatalogFiles(part)
+
+    def commit(self):
+        """
+        Write any buffered items to the catalog file.
+        """
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        """
+        Write any buffered items and close the catalog file.  The write
+        ahead log is folded back into the catalog, leaving a single file,
+        unless the catalog is still being read.
+        """
+        self.commit()
+        try:
+            self._connection.execute("PRAGMA journal_mode = DELETE")
+        except sqlite3.OperationalError:
+            pass
+        self._connection.close()
+
+    def _flush(self):
+        if self._rows:
+            self._connection.executemany(_INSERT, self._rows)
+            self._rows = []
+        if self._completed:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO progress VALUES (?)", self._completed)
+            self._completed = []
+        self._connection.commit()
+
+
+class CatalogReader:
+    """
+    Provides queries against the catalog of a backup, without touching the
+    backup image.  Items are returned as rows that can be indexed by the
+    column names.
+    """
+
+    def __init__(self, catalogFile):
+        if not os.path.exists(catalogFile):
+            raise IOError("Catalog {0} doesn't exist.".format(catalogFile))
+        self.catalogFile = catalogFile
+        self._connection = sqlite3.connect(
+            catalogFile, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+
+    def lookup(self, path):
+        """
+        Returns the item found at path, or None if it's not in the catalog.
+        """
+        return self._connection.execute(
+            "SELECT * FROM entries WHERE parent = ? AND name = ?",
+            _split(path)).fetchone()
+
+    def getInfo(self, key):
+        """
+        Returns a value describing the backup, or None if it wasn't
+        recorded.
+        """
+        row = self._connection.execute(
+            "SELECT value FROM info WHERE key = ?", (key,)).fetchone()
+        return row and row["value"]
+
+    def getCompleted(self):
+        """
+        Returns the directories whose whole tree was backed up, as recorded
+        while the backup was running.
+        """
+        rows = self._connection.execute("SELECT path FROM progress")
+        return set(row["path"] for row in rows)
+
+    def listDirectory(self, directory):
+        """
+        Returns a dictionary of the items found in a directory keyed by name.
+        """
+        rows = self._connection.execute(
+            "SELECT * FROM entries WHERE parent = ?",
+            (directory,))
+        return dict((row["name"], row) for row in rows)
+
+    def iterEntries(self, directory="/", type_=None):
+        """
+        Iterate over every item found under a directory, ordered by path.
+        Only the items of a type are returned when one is provided.
+        """
+        if type_ is None:
+            return self._connection.execute(
+                "SELECT * FROM entries WHERE parent = ? OR " +
+                "(parent >= ? AND parent < ?) ORDER BY parent, name",
+                _getTreeRange(directory))
+        return self._connection.execute(
+            "SELECT * FROM entries WHERE (parent = ? OR " +
+            "(parent >= ? AND parent < ?)) AND type = ? " +
+            "ORDER BY parent, name",
+            _getTreeRange(directory) + (type_,))
+
+    def getXattrs(self, path="/"):
+        """
+        Returns the extended attributes recorded for an item and the items
+        under it, as a dict of their paths.  Items whose extended attributes
+        weren't recorded aren't included.
+        """
+        rows = self._connection.execute(
+            "SELECT * FROM entries WHERE ((parent = ? AND name = ?) OR " +
+            "parent = ? OR (parent >= ? AND parent < ?)) AND " +
+            "xattrs IS NOT NULL",
+            _split(path) + _getTreeRange(path)).fetchall()
+        return dict((getPath(row), getXattrs(row)) for row in rows)
+
+    def getStorages(self, path="/"):
+        """
+        Returns how the contents of a file and the files under it were
+        encoded in the backup, as a dict of their paths.  Plain copies
+        aren't included.
+        """
+        rows = self._connection.execute(
+            "SELECT * FROM entries WHERE ((parent = ? AND name = ?) OR " +
+            "parent = ? OR (parent >= ? AND parent < ?)) AND " +
+            "storage IS NOT NULL",
+            _split(path) + _getTreeRange(path)).fetchall()
+        return dict((getPath(row), row["storage"]) for row in rows)
+
+    def getHardLinks(self, directory="/"):
+        """
+        Returns the paths of the files under a directory that were hard links
+        of each other in the source, as a list of groups.
+        """
+        rows = self._connection.execute(
+            "SELECT * FROM entries WHERE (parent = ? OR " +
+            "(parent >= ? AND parent < ?)) AND type = ? AND nlink > 1 " +
+            "ORDER BY src_dev, src_ino, parent, name",
+            _getTreeRange(directory) + (FILE,)).fetchall()
+        groups = [[getPath(row) for row in group] for _, group in groupby(
+            rows, lambda row: (row["src_dev"], row["src_ino"]))]
+        return [group for group in groups if len(group) > 1]
+
+    def close(self):
+        """
+        Close the catalog file.
+        """
+        self._connection.close()
+
+
+def getPath(row):
+    """
+    Returns the path of a catalog row relative to the root of the backup.
+    """
+    if row["parent"] == "":
+        return "/"
+    return _join(row["parent"], row["name"])
+
+
+def isDirectory(row):
+    """
+    Returns True if the catalog row describes a directory.
+    """
+    return row["type"] == DIRECTORY
+
+
+def isLink(row):
+    """
+    Returns True if the catalog row describes a symbolic link.
+    """
+    return row["type"] == LINK
+
+
+def isFile(row):
+    """
+    Returns True if the catalog row describes a regular file.
+    """
+    return row["type"] == FILE
+
+
+class CatalogStat:
+    """
+    Exposes the source stat values of a catalog row using the same
+    attribute names as os.stat_result.
+    """
+
+    __slots__ = ("st_size", "st_mtime", "st_mtime_ns", "st_ctime_ns",
+                 "st_mode", "st_uid", "st_gid", "st_ino", "st_dev",
+                 "st_nlink")
+
+    def __init__(self, row):
+        self.st_size = row["size"]
+        self.st_mtime_ns = row["mtime_ns"]
+        self.st_mtime = row["mtime_ns"] / 1e9
+        self.st_ctime_ns = row["ctime_ns"]
+        self.st_mode = row["mode"]
+        self.st_uid = row["uid"]
+        self.st_gid = row["gid"]
+        self.st_ino = row["src_ino"]
+        self.st_dev = row["src_dev"]
+        self.st_nlink = row["nlink"]
+
+
+def getStat(row):
+    """
+    Returns the source stat values recorded in a catalog row.
+    """
+    return CatalogStat(row)
+
+
+def getStorage(row):
+    """
+    Returns how the contents of a file were encoded in the backup, or None
+    if the file is a plain copy.
+    """
+    return row["storage"]
+
+
+def getXattrs(row):
+    """
+    Returns the extended attributes recorded for the item of a catalog row,
+    or None if they weren't recorded.
+    """
+    value = row["xattrs"]
+    if value is None:
+        return None
+    xattrs = {}
+    offset = 0
+    while offset < len(value):
+        end = value.index(b"\0", offset)
+        name = os.fsdecode(value[offset:end])
+        length, = _XATTR_LENGTH.unpack_from(value, end + 1)
+        offset = end + 1 + _XATTR_LENGTH.size
+        xattrs[name] = bytes(value[offset:offset + length])
+        offset += length
+    return xattrs
+
+
+def getType(st):
+    """
+    Returns the catalog type of a stat result.
+    """
+    if stat.S_ISLNK(st.st_mode):
+        return LINK
+    elif stat.S_ISDIR(st.st_mode):
+        return DIRECTORY
+    return FILE
+
+
+def _encodeXattrs(xattrs):
+    """
+    Encode extended attributes for the catalog, as the name of each one
+    followed by the length of its value and the value.
+    """
+    if xattrs is None:
+        return None
+    return b"".join(
+        os.fsencode(name) + b"\0" + _XATTR_LENGTH.pack(len(value)) + value
+        for name, value in sorted(xattrs.items()))
+
+
+def _split(path):
+    """
+    Split a path into the parent and name columns used by the catalog.
+    """
+    if path == "/":
+        return "", ""
+    parent, name = path.rsplit("/", 1)
+    return parent or "/", name
+
+
+def _join(parent, name):
+    """
+    Join the parent and name columns back into a path.
+    """
+    if parent == "/":
+        return "/" + name
+    return parent + "/" + name
+
+
+def _getTreeRange(directory):
+    """
+    Returns the parent values used to select everything under a directory.
+    Parents of nested items sort between "<dir>/" and "<dir>0", since "0"
+    directly follows "/".
+    """
+    prefix = directory.rstrip("/")
+    return directory, prefix + "/", prefix + "0"
+
+
+def _getCatalogParts(catalogFile):
+    """
+    Returns the parts of a catalog that were written by child processes.
+    """
+    return [part for part in glob(catalogFile + ".[0-9]*")
+            if part.rsplit(".", 1)[1].isdigit()]
+
+
+def _getCatalogFiles(catalogFile):
+    """
+    Returns the files of a catalog along with their suffix.  The write
+    ahead log of a catalog is left next to it when its backup was
+    interrupted.
+    """
+    return [(catalogFile + suffix, suffix) for suffix in ["", "-wal", "-shm"]]
+
+
+def _removeCatalogFiles(catalogFile):
+    for fileName, _ in _getCatalogFiles(catalogFile):
+        if os.path.exists(fileName):
+            os.remove(fileName)
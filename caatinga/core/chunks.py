@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Chris Taylor
+#
+# This file is part of caatinga.
+#
+# Caatinga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Caatinga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import os
+import threading
+import caatinga.core.copier as copier
+import caatinga.core.durability as durability
+import caatinga.core.throttle as throttle
+from os.path import join
+
+__all__ = ["ChunkStore", "getChunkStoreHome", "isChunked", "readManifest"]
+
+MAGIC = b"CAATINGA-CHUNKS 1\n"
+STORAGE = "chunked"
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+
+def getChunkStoreHome(backupHome):
+    """
+    Returns the directory of the chunk store for the provided backup home.
+    """
+    return join(backupHome, "chunks")
+
+
+def isChunked(fileName):
+    """
+    Returns True if the file is the manifest of a chunked file.
+    """
+    try:
+        with open(fileName, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except IOError:
+        return False
+
+
+def readManifest(fileName):
+    """
+    Returns the size of the original file and the digests of its chunks.
+    """
+    with open(fileName, 'rb') as f:
+        if f.readline() != MAGIC:
+            raise IOError("{0} is not a chunked file.".format(fileName))
+        size = int(f.readline().split()[1])
+        return size, [d.strip().decode() for d in f if d.strip()]
+
+
+class ChunkStore:
+    """
+    Stores large files as a list of fixed size chunks.  Each chunk is kept
+    once in the chunk store of the backup home, named after its digest, and
+    the file in the backup image becomes a small manifest listing them.
+    Chunks that didn't change since an earlier backup are shared, so only
+    the modified parts of a file are written.  Files smaller than the
+    threshold are left to be copied as usual.
+    """
+
+    def __init__(self, home, chunkSize=DEFAULT_CHUNK_SIZE, threshold=0):
+        self.home = home
+        self.chunkSize = chunkSize
+        self.threshold = threshold
+
+    def accepts(self, st):
+        """
+        Returns True if the file with the provided stat result should be
+        stored as chunks.
+        """
+        return 0 < self.threshold <= st.st_size
+
+    def writeFile(self, src, dest, st, xattrs=None):
+        """
+        Split src into chunks, store the ones that are missing and write
+        the manifest to dest using the metadata of src.  The extended
+        attributes already read from src can be provided.
+        """
+        digests = []
+        total = 0
+        buf = bytearray(self.chunkSize)
+        view = memoryview(buf)
+        srcFd = os.open(src, os.O_RDONLY)
+        try:
+            with os.fdopen(srcFd, 'rb', buffering=0, closefd=False) as f:
+                size = self._fill(f, view)
+                while size:
+                    digests.append(self._store(view[:size]))
+                    total += size
+                    size = self._fill(f, view)
+            self._writeManifest(srcFd, dest, st, total, digests, xattrs)
+        finally:
+            os.close(srcFd)
+
+    def getChunkFile(self, digest):
+        """
+        Returns the name of the file that holds the chunk.
+        """
+        return join(self.home, digest[:2], digest)
+
+    def readFile(self, manifest):
+        """
+        Iterate over the chunks of the file described by the manifest.
+        """
+        size, digests = readManifest(manifest)
+        read = 0
+        for digest in digests:
+            with open(self.getChunkFile(digest), 'rb') as f:
+                chunk = f.read()
+            read += len(chunk)
+            yield chunk
+        if read != size:
+            raise IOError("Chunked file {0} is incomplete.".format(manifest))
+
+    def _fill(self, f, view):
+        """
+        Fill the buffer from the file, returning the number of bytes read.
+        """
+        size = 0
+        while size < len(view):
+            read = f.readinto(view[size:])
+            if not read:
+                break
+            size += read
+        throttle.read(size)
+        return size
+
+    def _store(self, chunk):
+        """
+        Store the chunk unless the store already has it.  Chunks are written
+        to a temporary name of their own first, so a chunk is never seen
+        half written.  Workers storing the same chunk at once each write
+        their own copy, and the last one renamed replaces the others.
+        """
+        digest = hashlib.sha256(chunk).hexdigest()
+        chunkFile = self.getChunkFile(digest)
+        if os.path.exists(chunkFile):
+            return digest
+        os.makedirs(os.path.dirname(chunkFile), exist_ok=True)
+        temp = "{0}.{1}.{2}.tmp".format(
+            chunkFile, os.getpid(), threading.get_ident())
+        with open(temp, 'wb') as f:
+            f.write(chunk)
+            f.flush()
+            durability.syncFile(f.fileno())
+        throttle.write(len(chunk))
+        os.rename(temp, chunkFile)
+        return digest
+
+    def _writeManifest(self, srcFd, dest, st, size, digests, xattrs):
+        content = MAGIC + "size {0}\n{1}\n".format(
+            size, "\n".join(digests)).encode()
+        destFd = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            os.write(destFd, content)
+            copier.applyMetadata(srcFd, destFd, dest, st, xattrs)
+            durability.syncFile(destFd)
+        finally:
+            os.close(destFd)
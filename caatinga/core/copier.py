@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Chris Taylor
+#
+# This file is part of caatinga.
+#
+# Caatinga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Caatinga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
+
+import errno
+import os
+import stat
+import sys
+import threading
+import caatinga.core.durability as durability
+import caatinga.core.throttle as throttle
+
+__all__ = ["copyFile", "copyData", "isSparse", "applyMetadata",
+           "applyDirectoryMetadata"]
+
+_CHUNK_SIZE = 8 * 1024 * 1024
+_BUFFER_SIZE = 1024 * 1024
+_PREALLOCATE_MIN_SIZE = 1024 * 1024
+_UNTIL_END = sys.maxsize
+_HAS_SEEK_DATA = hasattr(os, "SEEK_DATA") and hasattr(os, "SEEK_HOLE")
+
+# Errors raised when the kernel can't perform a zero copy between the two
+# files, in which case the next method is tried.
+_UNSUPPORTED = (errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP,
+                errno.EBADF, errno.ENOTSUP)
+
+_local = threading.local()
+
+
+def copyFile(src, dest, st=None, digest=None, xattrs=None):
+    """
+    Copy the contents of src to dest, then apply the ownership, permissions,
+    extended attributes and times of src to dest through its file
+    descriptor.  An optional stat result of src avoids stat'ing it again,
+    and the extended attributes already read from src can be provided.
+    Only the data of sparse files is copied, leaving holes in dest.  When a
+    hashlib object is provided, it's updated with the contents as they are
+    copied.  Returns the stat result of dest.
+    """
+    srcFd = os.open(src, os.O_RDONLY)
+    try:
+        st = st or os.fstat(srcFd)
+        destFd = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            if isSparse(st):
+                _copySparse(srcFd, destFd, st.st_size, digest)
+            else:
+                _preallocate(destFd, st.st_size)
+                copyData(srcFd, destFd, digest=digest)
+            applyMetadata(srcFd, destFd, dest, st, xattrs)
+            durability.syncFile(destFd)
+            return os.fstat(destFd)
+        finally:
+            os.close(destFd)
+    finally:
+        os.close(srcFd)
+
+
+def copyData(srcFd, destFd, length=None, digest=None):
+    """
+    Copy everything from the current offset of srcFd to destFd, or only
+    length bytes when it's provided.  The kernel copies the data with
+    copy_file_range or sendfile when possible, otherwise a reused buffer is
+    filled with readinto.  The data has to pass through the buffer when a
+    hashlib object is provided to digest it.
+    """
+    remaining = _UNTIL_END if length is None else length
+    if digest is not None:
+        _copyWithBuffer(srcFd, destFd, remaining, digest)
+        return
+    for method in (_copyFileRange, _sendFile):
+        remaining = method(srcFd, destFd, remaining)
+        if not remaining:
+            return
+    _copyWithBuffer(srcFd, destFd, remaining)
+
+
+def isSparse(st):
+    """
+    Returns True if fewer blocks are allocated to the file than its size
+    needs, meaning it has holes that don't have to be copied.
+    """
+    return _HAS_SEEK_DATA and hasattr(st, "st_blocks") and \
+        st.st_blocks * 512 < st.st_size
+
+
+def _copySparse(srcFd, destFd, size, digest=None):
+    """
+    Copy the data of a sparse file one extent at a time, found with
+    SEEK_DATA and SEEK_HOLE.  The holes are skipped over in dest, which is
+    truncated to the size of the file so a hole at its end is kept.  The
+    zeros of the holes are digested along with the data.
+    """
+    offset = 0
+    while offset < size:
+        start = _seek(srcFd, offset, os.SEEK_DATA)
+        if start is None:
+            break
+        end = min(_seek(srcFd, start, os.SEEK_HOLE), size)
+        digest and _digestZeros(digest, start - offset)
+        os.lseek(srcFd, start, os.SEEK_SET)
+        os.lseek(destFd, start, os.SEEK_SET)
+        copyData(srcFd, destFd, end - start, digest)
+        offset = end
+    digest and _digestZeros(digest, size - offset)
+    os.ftruncate(destFd, size)
+
+
+def _digestZeros(digest, length):
+    zeros = bytes(min(length, _BUFFER_SIZE))
+    while length > 0:
+        digest.update(zeros[:length])
+        length -= len(zeros)
+
+
+def _seek(fd, offset, whence):
+    """
+    Returns the offset of the next data or hole at or after offset, or None
+    when there is no more data.  File systems that can't find holes treat
+    the whole file as data.
+    """
+    try:
+        return os.lseek(fd, offset, whence)
+    except OSError as ex:
+        if ex.errno == errno.ENXIO:
+            return None
+        if ex.errno in _UNSUPPORTED:
+            return offset if whence == os.SEEK_DATA else _UNTIL_END
+        raise
+
+
+def _copyFileRange(srcFd, destFd, remaining):
+    """
+    Copy with copy_file_range.  Returns the number of bytes left to copy,
+    which is 0 once the copy is done.
+    """
+    if not hasattr(os, "copy_file_range"):
+        return remaining
+    return _copyWithKernel(
+        lambda count: os.copy_file_range(srcFd, destFd, count), remaining)
+
+
+def _sendFile(srcFd, destFd, remaining):
+    """
+    Copy with sendfile.  Returns the number of bytes left to copy, which is
+    0 once the copy is done.
+    """
+    if not hasattr(os, "sendfile") or not sys.platform.startswith("linux"):
+        return remaining
+    return _copyWithKernel(
+        lambda count: os.sendfile(destFd, srcFd, None, count), remaining)
+
+
+def _copyWithKernel(copyChunk, remaining):
+    """
+    Call copyChunk until remaining bytes are copied or it reaches the end
+    of the file.  Any data already copied has moved the file offsets, so
+    when the method turns out to be unsupported the next one picks up
+    where it left off with the bytes that are left.  Some file systems,
+    like procfs and sysfs, copy nothing at all even though their files
+    have data, so when the first call copies nothing the next method is
+    tried as well.
+    """
+    isFirst = True
+    try:
+        while remaining:
+            size = copyChunk(min(remaining, _CHUNK_SIZE))
+            if size == 0:
+                if isFirst:
+                    return remaining
+                break
+            isFirst = False
+            throttle.read(size)
+            throttle.write(size)
+            remaining -= size
+        return 0
+    except OSError as ex:
+        if ex.errno in _UNSUPPORTED:
+            return remaining
+        raise
+
+
+def _copyWithBuffer(srcFd, destFd, remaining=None, digest=None):
+    """
+    Copy using a buffer that is reused by every copy made on this thread.
+    """
+    remaining = _UNTIL_END if remaining is None else remaining
+    buf = getattr(_local, "buffer", None)
+    if buf is None:
+        buf = _local.buffer = bytearray(_BUFFER_SIZE)
+    view = memoryview(buf)
+    with os.fdopen(srcFd, 'rb', buffering=0, closefd=False) as f:
+        size = f.readinto(view[:min(remaining, _BUFFER_SIZE)])
+        while size:
+            throttle.read(size)
+            digest and digest.update(view[:size])
+            written = 0
+            while written < size:
+                written += os.write(destFd, view[written:size])
+            throttle.write(size)
+            remaining -= size
+            size = remaining and \
+                f.readinto(view[:min(remaining, _BUFFER_SIZE)])
+
+
+def _preallocate(destFd, size):
+    """
+    Reserve the space of larger files up front to limit fragmentation on
+    the backup device.  Not every file system supports this, which is fine.
+    """
+    if size < _PREALLOCATE_MIN_SIZE or not hasattr(os, "posix_fallocate"):
+        return
+    try:
+        os.posix_fallocate(destFd, 0, size)
+    except OSError as ex:
+        if ex.errno not in _UNSUPPORTED:
+            raise
+
+
+def applyMetadata(srcFd, destFd, dest, st, xattrs=None):
+    """
+    Apply the metadata of the source to the destination.  The extended
+    attributes are read through srcFd unless they are provided.  Times are
+    set last, as writing the other metadata doesn't change them.
+    """
+    _applyOwnershipAndMode(destFd, dest, st)
+    if xattrs is None:
+        _copyXattrs(srcFd, destFd)
+    else:
+        _setXattrs(destFd, xattrs)
+    os.utime(destFd, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+
+def applyDirectoryMetadata(destFd, dest, st, xattrs):
+    """
+    Apply the ownership, permissions and extended attributes of a directory
+    to a new directory through its file descriptor.  Its times are left to
+    be restored once its items are written.
+    """
+    _applyOwnershipAndMode(destFd, dest, st)
+    _setXattrs(destFd, xattrs)
+
+
+def _applyOwnershipAndMode(destFd, dest, st):
+    """
+    Ownership is set before the mode, since changing it clears the setuid
+    and setgid bits.
+    """
+    try:
+        os.fchown(destFd, st.st_uid, st.st_gid)
+    except OSError:
+        # Ownership can't be changed unless you are root
+        sys.stderr.write("Unable to copy ownership for {0}\n".format(dest))
+    os.fchmod(destFd, stat.S_IMODE(st.st_mode))
+
+
+def _copyXattrs(srcFd, destFd):
+    """
+    Copy the extended attributes when the platform supports them.
+    Attributes that can't be read or written are skipped.
+    """
+    if not hasattr(os, "listxattr"):
+        return
+    try:
+        names = os.listxattr(srcFd)
+    except OSError:
+        return
+    for name in names:
+        try:
+            os.setxattr(destFd, name, os.getxattr(srcFd, name))
+        except OSError:
+            pass
+
+
+def _setXattrs(destFd, xattrs):
+    for name, value in xattrs.items():
+        try:
+            os.setxattr(destFd, name, value)
+        except OSError:
+            pass
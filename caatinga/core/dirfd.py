@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Chris Taylor
+#
+# This file is part of caatinga.
+#
+# Caatinga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Caatinga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import stat
+import threading
+
+__all__ = ["Entry", "DirectoryFd", "scanDirectory"]
+
+# Directories are opened while fewer than this many are open, so deep and
+# wide trees can't run out of file descriptors.  Others use their path.
+_MAX_OPEN_DIRECTORIES = 256
+_openSlots = threading.BoundedSemaphore(_MAX_OPEN_DIRECTORIES)
+
+
+class Entry:
+    """
+    An item found while scanning a directory, along with its lstat result.
+    It provides the parts of os.DirEntry used to walk a tree, and its path
+    is the path of the directory joined with its name.
+    """
+
+    __slots__ = ("name", "path", "_stat")
+
+    def __init__(self, directory, name, st):
+        self.name = name
+        self.path = os.path.join(directory, name)
+        self._stat = st
+
+    def stat(self, follow_symlinks=True):
+        """
+        Returns the stat result of the item, which is the lstat result read
+        while scanning unless a symbolic link is followed.
+        """
+        if follow_symlinks and self.is_symlink():
+            return os.stat(self.path)
+        return self._stat
+
+    def is_dir(self, follow_symlinks=True):
+        """
+        Returns True if the item is a directory.
+        """
+        return self._isType(stat.S_ISDIR, follow_symlinks)
+
+    def is_file(self, follow_symlinks=True):
+        """
+        Returns True if the item is a regular file.
+        """
+        return self._isType(stat.S_ISREG, follow_symlinks)
+
+    def is_symlink(self):
+        """
+        Returns True if the item is a symbolic link.
+        """
+        return stat.S_ISLNK(self._stat.st_mode)
+
+    def _isType(self, isType, followSymlinks):
+        try:
+            return isType(self.stat(followSymlinks).st_mode)
+        except OSError:
+            # A broken symbolic link.
+            return False
+
+
+def scanDirectory(directory):
+    """
+    Returns the entries of a directory.  The directory is opened once and
+    each of its items is lstat'ed relative to it, so the kernel doesn't
+    resolve the path of the directory again for every item.  Items removed
+    while the directory is read are left out.  The directory is closed
+    before returning, so file descriptors aren't held while the entries are
+    processed.
+    """
+    fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        entries = []
+        with os.scandir(fd) as items:
+            for item in items:
+                try:
+                    st = item.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                entries.append(Entry(directory, item.name, st))
+        return entries
+    finally:
+        os.close(fd)
+
+
+class DirectoryFd:
+    """
+    A directory whose items are accessed relative to its file descriptor,
+    which saves resolving its path for each of them and keeps accessing the
+    same directory if it's renamed.  It's shared by the jobs of the items,
+    which acquire it, and closed once it's released by all of them and its
+    creator.  When too many directories are open or it can't be opened, its
+    path is used instead.
+    """
+
+    __slots__ = ("path", "fd", "_references", "_lock")
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+        self._references = 1
+        self._lock = threading.Lock()
+        if _openSlots.acquire(blocking=False):
+            try:
+                self.fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+            except OSError:
+                _openSlots.release()
+
+    def item(self, name):
+        """
+        Returns the path and dir_fd arguments that access an item of the
+        directory.
+        """
+        if self.fd is None:
+            return os.path.join(self.path, name), None
+        return name, self.fd
+
+    def acquire(self):
+        """
+        Keep the directory open until it's released again.
+        """
+        with self._lock:
+            self._references += 1
+
+    def release(self):
+        """
+        Release the directory, closing it once nothing uses it anymore.
+        """
+        with self._lock:
+            self._references -= 1
+            if self._references or self.fd is None:
+                return
+            os.close(self.fd)
+            self.fd = None
+        _openSlots.release()
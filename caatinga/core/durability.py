@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Chris Taylor
+#
+# This file is part of caatinga.
+#
+# Caatinga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Caatinga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
+
+import ctypes
+import ctypes.util
+import os
+
+__all__ = ["NONE", "COMMIT", "PARANOID", "DEFAULT_MODE", "getModes",
+           "setMode", "syncFile", "syncDirectory", "syncFileSystem"]
+
+NONE = "none"
+COMMIT = "commit"
+PARANOID = "paranoid"
+DEFAULT_MODE = COMMIT
+
+# How much of a backup is synced to the backup device, applied to every
+# backup worker of the process.
+_mode = NONE
+_libc = None
+
+
+def getModes():
+    """
+    Returns the names of the durability modes.
+    """
+    return [NONE, COMMIT, PARANOID]
+
+
+def setMode(mode):
+    """
+    Set how much of a backup is synced.  With none, nothing is synced.  With
+    commit, the backup device is synced once before a backup is renamed to
+    mark it complete.  With paranoid, each file written is synced as well.
+    """
+    global _mode
+    _mode = mode
+
+
+def syncFile(fd):
+    """
+    Sync a file that was written to the backup when each file is synced.
+    """
+    if _mode == PARANOID:
+        os.fsync(fd)
+
+
+def syncDirectory(directory):
+    """
+    Sync a directory, so the items created, renamed or removed in it are on
+    the backup device, unless nothing is synced.
+    """
+    if _mode == NONE:
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def syncFileSystem(directory):
+    """
+    Sync every file of the file system the directory is on, then the
+    directory itself, unless nothing is synced.  This is a single call
+    instead of one per file written.  The whole system is synced where
+    syncfs isn't available.
+    """
+    if _mode == NONE:
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        syncfs = _getSyncfs()
+        if syncfs is None or syncfs(fd) != 0:
+            os.sync()
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _getSyncfs():
+    """
+    Returns the syncfs function of the C library, which Python doesn't
+    expose, or None if it doesn't have one.
+    """
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    return getattr(_libc, "syncfs", None)
@@ -0,0 +1,383 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Chris Taylor
+#
+# This file is part of caatinga.
+#
+# Caatinga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Caatinga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+__all__ = ["EventLog", "NullEventLog", "openEventLog", "getFormats",
+           "getModes"]
+
+COPY = "copy"
+LINK = "link"
+UNCHANGED = "unchanged"
+RESUME = "resume"
+IGNORE = "ignore"
+ERROR = "error"
+
+TEXT = "text"
+JSON = "json"
+ALL = "all"
+SAMPLE = "sample"
+SUMMARY = "summary"
+
+_LABELS = {
+    COPY: "Copying",
+    LINK: "Linking",
+    UNCHANGED: "Unchanged",
+    RESUME: "Resuming",
+    IGNORE: "Ignore",
+    ERROR: "Error",
+}
+_FLUSH_INTERVAL = 0.2
+_BATCH_SIZE = 1024
+_MAX_QUEUED = 64 * 1024
+_BUFFER_SIZE = 1024 * 1024
+# Paths that aren't valid UTF-8 are written with their original bytes.
+_ENCODING = "utf-8"
+_ERRORS = "surrogateescape"
+
+
+def getFormats():
+    """
+    Returns the names of the supported event log formats.
+    """
+    return [TEXT, JSON]
+
+
+def getModes():
+    """
+    Returns the names of the supported event log modes.
+    """
+    return [ALL, SAMPLE, SUMMARY]
+
+
+def openEventLog(settings, isVerbose):
+    """
+    Returns the event log described by the settings.  Events are printed
+    when verbose, and written to the event_log file when one is set.  A
+    log that ignores every event is returned when neither is requested.
+    """
+    sinks = []
+    if isVerbose:
+        sinks.append(_Sink(sys.stdout, TEXT))
+    if settings.eventLog:
+        sinks.append(_FileSink(
+            settings.eventLog,
+            settings.eventLogFormat,
+            settings.eventLogMaxSize,
+            settings.eventLogKeep))
+    if not sinks:
+        return NullEventLog()
+    return EventLog(sinks, settings.eventLogMode, settings.eventLogSample)
+
+
+class NullEventLog:
+    """
+    Event log used when events aren't reported.  Logging an event does
+    nothing.
+    """
+
+    isEnabled = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exceptionType, exception, traceback):
+        self.close()
+
+    def log(self, level, path, message=None):
+        """
+        Report an event about the item at path.
+        """
+        pass
+
+    def flush(self):
+        """
+        Hand the events logged so far to the sinks.
+        """
+        pass
+
+    def close(self):
+        """
+        Write any pending events and stop the log.
+        """
+        pass
+
+    @contextmanager
+    def paused(self):
+        """
+        Write the events logged so far and stop writing events while the
+        block runs, so child processes can be forked without a thread
+        running.  Events logged in the meantime are written afterwards.
+        """
+        yield
+
+    def forProcess(self, queue):
+        """
+        Returns the log used by a child process, which forwards events to
+        this log through the queue.
+        """
+        return self
+
+    def receive(self, queue):
+        """
+        Log the events forwarded by child processes through the queue until
+        None is put on it.  Returns the thread receiving them, if any.
+        """
+        return None
+
+
+class EventLog(NullEventLog):
+    """
+    Reports the events of a backup, such as a file being copied or linked.
+    Logging an event only queues it, so the threads performing the backup
+    never wait on the terminal or the disk.  A background thread formats
+    queued events and writes them in batches to each sink.  In sample mode
+    only every nth event of a level is written, and in summary mode none
+    are, with the number of events of each level written on close.  Errors
+    are written in every mode but summary.
+    """
+
+    isEnabled = True
+
+    def __init__(self, sinks, mode=ALL, sampleRate=1):
+        self._sinks = sinks
+        self._mode = mode
+        self._sampleRate = max(sampleRate, 1)
+        self._counts = Counter()
+        self._events = deque()
+        self._wakeup = threading.Event()
+        self._isClosed = False
+        self._isStopped = False
+        self._startThread()
+
+    def log(self, level, path, message=None):
+        self._events.append((time.time(), level, path, message))
+        if len(self._events) >= _BATCH_SIZE:
+            self._throttle()
+
+    def flush(self):
+        self._wakeup.set()
+
+    @contextmanager
+    def paused(self):
+        self._stopThread()
+        try:
+            yield
+        finally:
+            self._isStopped = False
+            self._startThread()
+
+    def forProcess(self, queue):
+        # The thread writing the events doesn't exist in a forked process.
+        return _ForwardingEventLog(queue)
+
+    def receive(self, queue):
+        thread = threading.Thread(target=self._receive, args=(queue,))
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def close(self):
+        if self._isClosed:
+            return
+        self._isClosed = True
+        self._stopThread()
+        if self._mode != ALL:
+            for sink in self._sinks:
+                sink.writeSummary(self._counts)
+        for sink in self._sinks:
+            sink.close()
+
+    def _startThread(self):
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _stopThread(self):
+        self._isStopped = True
+        self._wakeup.set()
+        self._thread.join()
+
+    def _throttle(self):
+        self._wakeup.set()
+        while len(self._events) >= _MAX_QUEUED and self._thread.is_alive():
+            # The sinks can't keep up, so wait for the queue to drain rather
+            # than holding every event in memory.
+            time.sleep(0.01)
+
+    def _receive(self, queue):
+        for batch in iter(queue.get, None):
+            self._events.extend(batch)
+            self._throttle()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(_FLUSH_INTERVAL)
+            self._wakeup.clear()
+            isStopped = self._isStopped
+            self._drain()
+            for sink in self._sinks:
+                sink.flush()
+            if isStopped:
+                return
+
+    def _drain(self):
+        events = self._events
+        while events:
+            event = events.popleft()
+            level = event[1]
+            self._counts[level] += 1
+            if self._isWritten(level):
+                for sink in self._sinks:
+                    sink.write(event)
+
+    def _isWritten(self, level):
+        if self._mode == ALL:
+            return True
+        elif self._mode == SAMPLE:
+            return level == ERROR or \
+                (self._counts[level] - 1) % self._sampleRate == 0
+        return False
+
+
+class _ForwardingEventLog(NullEventLog):
+    """
+    Event log of a child process.  Events are sent in batches to the log
+    of the parent process, which writes them.
+    """
+
+    isEnabled = True
+
+    def __init__(self, queue):
+        self._queue = queue
+        self._events = deque()
+
+    def log(self, level, path, message=None):
+        self._events.append((time.time(), level, path, message))
+        if len(self._events) >= _BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        batch = []
+        try:
+            while True:
+                batch.append(self._events.popleft())
+        except IndexError:
+            pass
+        batch and self._queue.put(batch)
+
+    def close(self):
+        self.flush()
+
+
+class _Sink:
+    """
+    Writes events to a stream in the text or JSON lines format.
+    """
+
+    def __init__(self, stream, format_):
+        self.stream = stream
+        self.format = format_
+
+    def write(self, event):
+        self._writeLine(self._formatEvent(event))
+
+    def writeSummary(self, counts):
+        if self.format == JSON:
+            line = json.dumps({
+                "time": round(time.time(), 3),
+                "level": SUMMARY,
+                "counts": dict(counts)})
+        else:
+            line = "Summary: " + ", ".join(
+                "{0} {1}".format(level, counts[level])
+                for level in sorted(counts))
+        self._writeLine(line)
+
+    def flush(self):
+        self.stream.flush()
+
+    def close(self):
+        self.flush()
+
+    def _formatEvent(self, event):
+        timestamp, level, path, message = event
+        if self.format == JSON:
+            record = {"time": round(timestamp, 3), "level": level,
+                      "path": path}
+            if message:
+                record["message"] = message
+            return json.dumps(record)
+        if message:
+            return "{0}: {1}: {2}".format(_LABELS[level], path, message)
+        return "{0}: {1}".format(_LABELS[level], path)
+
+    def _writeLine(self, line):
+        self.stream.write(line + "\n")
+
+
+class _FileSink(_Sink):
+    """
+    Writes events to a buffered log file.  Once the file grows past the
+    maximum size it's rotated, keeping the provided number of older files
+    named with a numeric suffix.
+    """
+
+    def __init__(self, fileName, format_, maxSize=0, keep=0):
+        self.fileName = fileName
+        self.maxSize = maxSize
+        self.keep = keep
+        _Sink.__init__(self, self._open(), format_)
+
+    def close(self):
+        self.stream.close()
+
+    def _writeLine(self, line):
+        line += "\n"
+        # The size of the file is in bytes, which non-ASCII paths have more
+        # of than characters.
+        size = len(line.encode(_ENCODING, _ERRORS))
+        if self.maxSize and self.size and self.size + size > self.maxSize:
+            self._rotate()
+        self.stream.write(line)
+        self.size += size
+
+    def _open(self):
+        stream = open(self.fileName, 'a', buffering=_BUFFER_SIZE,
+                      encoding=_ENCODING, errors=_ERRORS)
+        self.size = stream.tell()
+        return stream
+
+    def _rotate(self):
+        self.stream.close()
+        for number in range(self.keep - 1, 0, -1):
+            older = "{0}.{1}".format(self.fileName, number)
+            if os.path.exists(older):
+                os.rename(older, "{0}.{1}".format(self.fileName, number + 1))
+        if self.keep:
+            os.rename(self.fileName, self.fileName + ".1")
+        else:
+            os.remove(self.fileName)
+        self.stream = self._open()
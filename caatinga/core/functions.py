@@ -20,14 +20,28 @@
 import os
 import pwd
 import grp
+import hashlib
 import re
 import shutil
 import stat
 import sys
+import caatinga.core.catalog as catalog
+import caatinga.core.dirfd as dirfd
+import caatinga.core.storage as storage
+import caatinga.core.throttle as throttle
 from datetime import datetime
 from glob import glob
 from os.path import join
 
+DEFAULT_CHANGE_DETECTION = ("mtime_ns", "size")
+
+# Comparators that check values of the source file.  These are only
+# meaningful when a file is compared against the catalog of a backup, since
+# a backed up file never has the ctime or inode of the original.
+SOURCE_ONLY_CHANGE_DETECTION = ("ctime", "inode")
+
+_DIGEST_BUFFER_SIZE = 1024 * 1024
+
 
 def registerBackupLocation(backupLocation, gid, backupHome):
     """
@@ -72,6 +86,12 @@ def getSettingsInstance(commandArgs):
         settings.hostName = commandArgs.hostName
     if commandArgs.backupLocation:
         settings.backupLocation = commandArgs.backupLocation
+    if commandArgs.jobs:
+        settings.backupWorkers = commandArgs.jobs
+    if commandArgs.processes:
+        settings.backupProcesses = commandArgs.processes
+    if commandArgs.oneFileSystem:
+        settings.oneFileSystem = True
     return settings
 
 
@@ -175,9 +195,10 @@ def getOutputWriter(isVerbose):
 
 def deleteBackup(backupHome, backup):
     """
-    Delete the provided backup.
+    Delete the provided backup along with its catalog.
     """
     shutil.rmtree(join(backupHome, backup))
+    catalog.removeCatalog(backupHome, backup)
 
 
 def markBackupForDeletion(backupHome, backup):
@@ -186,6 +207,7 @@ def markBackupForDeletion(backupHome, backup):
     """
     fullBackupName = join(backupHome, backup)
     os.rename(fullBackupName, fullBackupName + ".delete")
+    catalog.renameCatalog(backupHome, backup, backup + ".delete")
 
 
 def getBackupsMarkedForDeletion(backupHome):
@@ -257,6 +279,20 @@ def getInfo(fileSystemItem):
         "group": getGroup(os.stat(fileSystemItem).st_gid)}
 
 
+def getCatalogInfo(row):
+    """
+    Returns the same information as getInfo for an item found in the catalog
+    of a backup.
+    """
+    return {
+        "type": row["type"],
+        "size": row["size"],
+        "modified": datetime.fromtimestamp(row["mtime_ns"] / 1e9),
+        "name": row["name"],
+        "owner": getUser(row["uid"]),
+        "group": getGroup(row["gid"])}
+
+
 def parseWordArgs(args):
     """
     Returns a dictionary of the args for use in lscaat.
@@ -332,17 +368,28 @@ def getBackupOrLatest(wordArgs, backupHome):
         return getLatestBackup(backupHome)
 
 
-def copy(src, dest):
+def copy(src, dest, backupHome=None, workers=None, encodings=None):
     """
-    Copies an item while preserving permissions and stat.
+    Copies an item while preserving permissions and stat.  When the item
+    comes from a backup, the backup home is used to decode the files that
+    aren't plain copies, which are found in the encodings recorded by the
+    catalog of the backup, keyed by file name.  When a pool of workers is
+    provided, files are copied by its threads.
     """
     try:
         if os.path.islink(src):
             copyLink(src, dest)
         elif os.path.isdir(src):
-            copyDir(src, dest)
+            copyDir(src, dest, backupHome, workers, encodings)
+        elif os.path.isfile(src) and workers:
+            directory = workers.openDirectory(lambda: None)
+            _submitCopy(
+                workers, directory, src, dest, backupHome,
+                _getEncoding(encodings, src))
+            workers.closeDirectory(directory)
         elif os.path.isfile(src):
-            copyFile(src, dest)
+            copyFile(src, dest, backupHome=backupHome,
+                     encoding=_getEncoding(encodings, src))
     except OSError as ex:
         if ex.errno == 20:
             raise OSError("Permission Denied")
@@ -357,61 +404,235 @@ def copyLink(src, dest):
     os.symlink(os.readlink(src), dest)
 
 
-def copyDir(src, dest):
+def copyDir(src, dest, backupHome=None, workers=None, encodings=None):
     """
     Recursively copies a directory while preserving
-    permissions and stat.
+    permissions and stat.  When a pool of workers is provided, files are
+    copied by its threads and the times of the directory are copied once
+    they are done.  The items of each directory are stat'ed once, relative
+    to the directory.  Files found in the encodings are decoded.
     """
     if os.path.exists(dest) is False:
         os.mkdir(dest)
         shutil.copystat(src, dest)
         copyOwnership(src, dest)
-    for item in os.listdir(src):
-        srcItem = src + os.sep + item
-        destItem = dest + os.sep + item
-        if os.path.islink(srcItem):
-            copyLink(srcItem, destItem)
-        elif os.path.isdir(srcItem):
-            copyDir(srcItem, destItem)
-        elif os.path.isfile(srcItem):
-            copyFile(srcItem, destItem)
+    directory = workers and workers.openDirectory(
+        lambda: _copyTimes(src, dest))
+    for entry in dirfd.scanDirectory(src):
+        destItem = dest + os.sep + entry.name
+        if entry.is_symlink():
+            copyLink(entry.path, destItem)
+        elif entry.is_dir():
+            copyDir(entry.path, destItem, backupHome, workers, encodings)
+        elif entry.is_file() and workers:
+            _submitCopy(
+                workers, directory, entry.path, destItem, backupHome,
+                _getEncoding(encodings, entry.path), entry.stat())
+        elif entry.is_file():
+            copyFile(entry.path, destItem, entry.stat(), backupHome,
+                     _getEncoding(encodings, entry.path))
+    if workers:
+        workers.closeDirectory(directory)
+    else:
+        _copyTimes(src, dest)
+
+
+def _copyTimes(src, dest):
     os.utime(dest, (os.path.getatime(src), os.path.getmtime(src)))
 
 
-def copyFile(src, dest):
+def _getEncoding(encodings, fileName):
+    """
+    Returns the encoding of a file of a backup, or None for a plain copy.
+    """
+    return encodings.get(os.path.normpath(fileName)) if encodings else None
+
+
+def _submitCopy(workers, directory, src, dest, backupHome, encoding=None,
+                st=None):
     """
-    Copies a file while preserving permissions and stat.
+    Queue the copy of a file to the pool of workers.
+    """
+    st = st or os.stat(src)
+    workers.submit(
+        directory, st.st_size, copyFile, src, dest, st, backupHome, encoding)
+
+
+def copyFile(src, dest, st=None, backupHome=None, encoding=None,
+             digest=None, xattrs=None):
+    """
+    Copies a file while preserving permissions and stat.  An optional stat
+    result of the source can be provided to avoid stat'ing it again.  When
+    a backup home is provided, the file comes from a backup and is decoded
+    using the encoding recorded by its catalog.  Otherwise the contents are
+    compressed with the encoding when one is provided.  A hashlib object
+    can be provided to digest the contents while they are copied, along
+    with the extended attributes already read from the source.
+    Returns the stat result of the copy.
     """
     try:
-        if stat.S_ISCHR(os.stat(src).st_mode) is False:
-            shutil.copy2(src, dest)
-            shutil.copystat(src, dest)
-            copyOwnership(src, dest)
+        st = st or os.stat(src)
+        if stat.S_ISCHR(st.st_mode) is False:
+            if backupHome:
+                return storage.restoreFile(
+                    src, dest, backupHome, st, encoding)
+            return storage.writeFile(
+                src, dest, st, encoding, digest, xattrs)
     except IOError:
         # Normally a permissions problem so the file can't be copied.
         sys.stderr.write("Permission denied: {0}\n".format(src))
 
 
-def copyOwnership(src, dest):
+def copyOwnership(src, dest, st=None):
     """
     Copies user and group information.
     """
     try:
-        uid = os.stat(src).st_uid
-        gid = os.stat(src).st_gid
-        os.chown(dest, uid, gid)
+        st = st or os.stat(src)
+        os.chown(dest, st.st_uid, st.st_gid)
     except OSError:
         # Ownership can't be changed unless you are root
         sys.stderr.write("Unable to copy ownership for {0}\n".format(dest))
 
 
-def isModified(item1, item2):
+def copyXattrs(src, dest, xattrs=None):
+    """
+    Copies the extended attributes of an item when the platform supports
+    them.  Attributes that can't be read or written are skipped.  The
+    attributes already read from the source can be provided.
+    """
+    if xattrs is None:
+        xattrs = getXattrs(src)
+    for name, value in xattrs.items():
+        try:
+            os.setxattr(dest, name, value, follow_symlinks=False)
+        except OSError:
+            pass
+
+
+def getXattrs(item):
+    """
+    Returns the extended attributes of an item as a dict of their values,
+    which includes POSIX ACLs.  It's empty when the platform doesn't
+    support them.  Attributes that can't be read are skipped.
+    """
+    xattrs = {}
+    if not hasattr(os, "listxattr"):
+        return xattrs
+    try:
+        names = os.listxattr(item, follow_symlinks=False)
+    except OSError:
+        return xattrs
+    for name in names:
+        try:
+            xattrs[name] = os.getxattr(item, name, follow_symlinks=False)
+        except OSError:
+            pass
+    return xattrs
+
+
+def setXattrs(item, xattrs):
     """
-    Returns True if the modified date for both items are different.
+    Set the extended attributes of an item to the provided ones, removing
+    the others it has.  Attributes that can't be written are skipped.
     """
-    item1ModifiedDate = datetime.fromtimestamp(os.path.getmtime(item1))
-    item2ModifiedDate = datetime.fromtimestamp(os.path.getmtime(item2))
-    return item1ModifiedDate.ctime() != item2ModifiedDate.ctime()
+    current = getXattrs(item)
+    for name in current:
+        if name not in xattrs:
+            try:
+                os.removexattr(item, name, follow_symlinks=False)
+            except OSError:
+                pass
+    for name, value in xattrs.items():
+        if current.get(name) != value:
+            try:
+                os.setxattr(item, name, value, follow_symlinks=False)
+            except OSError:
+                pass
+
+
+def isModified(item1, item2, stat1=None, stat2=None,
+               changeDetection=DEFAULT_CHANGE_DETECTION, backupHome=None,
+               encoding=None):
+    """
+    Returns True if the two items are different according to the provided
+    change detection comparators.  Stat results for either item can be
+    provided to avoid stat'ing them again.  When item2 comes from a backup,
+    its contents are read using the backup home and the encoding recorded
+    by its catalog.  The contents of item1 are always read as they are.
+    """
+    stat1 = stat1 or os.stat(item1)
+    stat2 = stat2 or os.stat(item2)
+    for name in changeDetection:
+        if _CHANGE_DETECTORS[name](
+                item1, item2, stat1, stat2, backupHome, encoding):
+            return True
+    return False
+
+
+def getChangeDetection(value):
+    """
+    Parse the change_detection setting into a tuple of comparator names.
+    Names starting with a plus are added to the default comparators.
+    """
+    names = [n.strip() for n in value.split(",") if n.strip()]
+    if names and all(n.startswith("+") for n in names):
+        names = list(DEFAULT_CHANGE_DETECTION) + [n[1:] for n in names]
+    return tuple(n.lstrip("+") for n in names)
+
+
+def getChangeDetectors():
+    """
+    Returns the names of the available change detection comparators.
+    """
+    return sorted(_CHANGE_DETECTORS.keys())
+
+
+def getDigest(file_, encoding=None, backupHome=None):
+    """
+    Returns the SHA-256 digest of the contents of a file as a hex string.
+    When the file comes from a backup, the encoding recorded by its catalog
+    and the backup home are used to digest its original contents.
+    """
+    digest = hashlib.sha256()
+    buf = bytearray(_DIGEST_BUFFER_SIZE)
+    view = memoryview(buf)
+    with (storage.openFile(file_, encoding, backupHome) if encoding else
+          open(file_, 'rb', buffering=0)) as f:
+        for size in iter(lambda: f.readinto(buf), 0):
+            throttle.read(size)
+            digest.update(view[:size])
+    return digest.hexdigest()
+
+
+def _isMtimeModified(item1, item2, stat1, stat2, backupHome, encoding):
+    return stat1.st_mtime_ns != stat2.st_mtime_ns
+
+
+def _isSizeModified(item1, item2, stat1, stat2, backupHome, encoding):
+    return stat1.st_size != stat2.st_size
+
+
+def _isCtimeModified(item1, item2, stat1, stat2, backupHome, encoding):
+    return stat1.st_ctime_ns != stat2.st_ctime_ns
+
+
+def _isInodeModified(item1, item2, stat1, stat2, backupHome, encoding):
+    return stat1.st_ino != stat2.st_ino
+
+
+def _isContentModified(item1, item2, stat1, stat2, backupHome, encoding):
+    if stat1.st_size != stat2.st_size:
+        return True
+    return getDigest(item1) != getDigest(item2, encoding, backupHome)
+
+
+_CHANGE_DETECTORS = {
+    "mtime_ns": _isMtimeModified,
+    "size": _isSizeModified,
+    "ctime": _isCtimeModified,
+    "inode": _isInodeModified,
+    "checksum": _isContentModified}
 
 
 def removeAltRoot(altRoot, item):
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Chris Taylor
+#
+# This file is part of caatinga.
+#
+# Caatinga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Caatinga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import re
+from fnmatch import translate
+from glob import has_magic
+
+__all__ = ["IgnoreMatcher", "IgnoreRules", "isCacheDirTag",
+           "IGNORE_FILE", "CACHEDIR_TAG"]
+
+IGNORE_FILE = ".caatignore"
+CACHEDIR_TAG = "CACHEDIR.TAG"
+_CACHEDIR_SIGNATURE = b"Signature: 8a477f597d28d172789f06886806bc55"
+
+
+class IgnoreMatcher:
+    """
+    Matches paths against the ignore patterns from the settings.  Patterns
+    are split into their path components and kept in a trie, where literal
+    components are found by name and glob components are compiled once.
+    Checking a path follows it down the trie, so the cost depends on the
+    depth of the path rather than the number of patterns.
+
+    Glob components follow the rules of the glob module: wildcards don't
+    match a "/", and only match names starting with a dot when the
+    component itself starts with one.
+    """
+
+    def __init__(self, patterns=()):
+        self._root = _Node()
+        self._patterns = []
+        for pattern in patterns:
+            self.add(pattern)
+
+    def add(self, pattern):
+        """
+        Add a full path, which may contain glob wildcards.
+        """
+        node = self._root
+        for component in _split(pattern):
+            node = node.getChild(component)
+        node.isEnd = True
+        self._patterns.append(pattern)
+
+    def matches(self, path):
+        """
+        Returns True if the path matches one of the patterns.
+        """
+        nodes = [self._root]
+        for name in _split(path):
+            nodes = [child for node in nodes for child in node.match(name)]
+            if not nodes:
+                return False
+        return any(node.isEnd for node in nodes)
+
+    __contains__ = matches
+
+    def __iter__(self):
+        return iter(self._patterns)
+
+    def __len__(self):
+        return len(self._patterns)
+
+
+class _Node:
+    """
+    A component of the patterns in the trie.
+    """
+
+    __slots__ = ("children", "globs", "isEnd")
+
+    def __init__(self):
+        self.children = {}
+        self.globs = []
+        self.isEnd = False
+
+    def getChild(self, component):
+        """
+        Returns the node below this one for a pattern component, adding it
+        when it doesn't exist yet.
+        """
+        if not has_magic(component):
+            return self.children.setdefault(component, _Node())
+        for glob, node in self.globs:
+            if glob.component == component:
+                return node
+        node = _Node()
+        self.globs.append((_Glob(component), node))
+        return node
+
+    def match(self, name):
+        """
+        Returns the nodes below this one that match a path component.
+        """
+        found = [glob[1] for glob in self.globs if glob[0].match(name)]
+        child = self.children.get(name)
+        if child is not None:
+            found.append(child)
+        return found
+
+
+class _Glob:
+    """
+    A compiled glob pattern for a single path component.
+    """
+
+    __slots__ = ("component", "_regex", "_matchesHidden")
+
+    def __init__(self, component):
+        self.component = component
+        self._regex = re.compile(translate(component))
+        self._matchesHidden = component.startswith(".")
+
+    def match(self, name):
+        if name.startswith(".") and not self._matchesHidden:
+            return False
+        return self._regex.match(name) is not None
+
+
+class IgnoreRules:
+    """
+    Rules read from the .caatignore files of a directory and its parents.
+    The files use the gitignore syntax: a pattern without a "/" matches a
+    name at any depth, other patterns are relative to the directory of the
+    file, a trailing "/" only matches directories and a leading "!"
+    includes an item again.  Rules of deeper files are checked after those
+    of their parents, and the last rule that matches wins.  Rules are
+    never changed once created, so a directory's rules can be shared with
+    every directory below it.
+    """
+
+    __slots__ = ("_rules",)
+
+    def __init__(self, rules=()):
+        self._rules = tuple(rules)
+
+    def extend(self, directory, lines):
+        """
+        Returns the rules of a subdirectory with the lines of its ignore
+        file added to the rules inherited from its parents.
+        """
+        rules = [r for r in (_Rule.parse(directory, line) for line in lines)
+                 if r is not None]
+        if not rules:
+            return self
+        return IgnoreRules(self._rules + tuple(rules))
+
+    def read(self, directory, ignoreFile):
+        """
+        Returns the rules extended by an ignore file.  A file that can't
+        be read adds no rules.
+        """
+        try:
+            with open(ignoreFile, errors="replace") as f:
+                return self.extend(directory, f.read().splitlines())
+        except IOError:
+            return self
+
+    def isIgnored(self, path, name, isDirectory):
+        """
+        Returns True if the item should not be backed up.
+        """
+        ignored = False
+        for rule in self._rules:
+            if rule.match(path, name, isDirectory):
+                ignored = not rule.negate
+        return ignored
+
+    def __bool__(self):
+        return bool(self._rules)
+
+
+class _Rule:
+    """
+    A single pattern from an ignore file.
+    """
+
+    __slots__ = ("base", "negate", "directoryOnly", "anchored", "_regex")
+
+    def __init__(self, base, pattern, negate, directoryOnly):
+        self.base = base.rstrip("/") + "/"
+        self.negate = negate
+        self.directoryOnly = directoryOnly
+        self.anchored = "/" in pattern
+        if self.anchored:
+            self._regex = re.compile(_translatePath(pattern.lstrip("/")))
+        else:
+            self._regex = re.compile(translate(pattern))
+
+    @classmethod
+    def parse(cls, base, line):
+        """
+        Returns the rule for a line of an ignore file, or None when the
+        line is blank or a comment.
+        """
+        line = line.rstrip()
+        if not line or line.startswith("#"):
+            return None
+        negate = line.startswith("!")
+        if negate:
+            line = line[1:]
+        elif line.startswith("\\"):
+            line = line[1:]
+        directoryOnly = line.endswith("/")
+        line = line.rstrip("/")
+        if not line:
+            return None
+        return cls(base, line, negate, directoryOnly)
+
+    def match(self, path, name, isDirectory):
+        if self.directoryOnly and not isDirectory:
+            return False
+        if not self.anchored:
+            return self._regex.match(name) is not None
+        if not path.startswith(self.base):
+            return False
+        return self._regex.match(path[len(self.base):]) is not None
+
+
+def isCacheDirTag(fileName):
+    """
+    Returns True if the file is a cache directory tag, as described by the
+    Cache Directory Tagging Specification.
+    """
+    try:
+        with open(fileName, 'rb') as f:
+            return f.read(len(_CACHEDIR_SIGNATURE)) == _CACHEDIR_SIGNATURE
+    except IOError:
+        return False
+
+
+def _translatePath(pattern):
+    """
+    Translate a glob that is matched against a relative path into a
+    regular expression.  Wildcards don't match a "/", except for "**",
+    which matches any number of directories.
+    """
+    parts = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            parts.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            parts.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            parts.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            parts.append("[^/]")
+            i += 1
+        elif pattern[i] == "[" and "]" in pattern[i + 2:]:
+            end = pattern.index("]", i + 2)
+            body = pattern[i + 1:end].replace("\\", "\\\\")
+            if body.startswith("!"):
+                body = "^" + body[1:]
+            parts.append("[" + body + "]")
+            i = end + 1
+        else:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+    return "(?s:" + "".join(parts) + r")\Z"
+
+
+def _split(path):
+    return [c for c in path.split("/") if c]
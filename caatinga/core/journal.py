@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Chris Taylor
+#
+# This file is part of caatinga.
+#
+# Caatinga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Caatinga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+import signal
+import time
+from os.path import join
+
+__all__ = ["JournalWriter", "Segment", "takeSegment", "getPidFile",
+           "DIRECTORY", "TREE"]
+
+# A directory whose entries changed, and a directory whose whole tree must
+# be scanned again, such as one that was created or moved into place.
+DIRECTORY = "D"
+TREE = "T"
+_OVERFLOW = "overflow"
+_BEGIN = "begin"
+_END = "end"
+
+_CURRENT = "current"
+_ROTATED = "rotated"
+_PID_FILE = "caatd.pid"
+_ROTATE_TIMEOUT = 30
+
+
+def getPidFile(journalDir):
+    """
+    Returns the name of the file holding the pid of the journal daemon.
+    """
+    return join(journalDir, _PID_FILE)
+
+
+class JournalWriter:
+    """
+    Writes the directories that changed to the journal.  The journal is
+    split into segments, one for each backup.  A segment starts with the
+    session of the daemon and its sequence number, so a backup can tell
+    whether the segment directly follows the one read by the previous
+    backup.  Records are buffered in memory and each directory is written
+    once per segment.
+    """
+
+    def __init__(self, journalDir, session):
+        self.journalDir = journalDir
+        self.session = session
+        self.sequence = 0
+        self._written = set()
+        self._pending = []
+        self._begin()
+
+    def add(self, type_, path):
+        """
+        Record a changed directory.
+        """
+        record = (type_, path)
+        if record not in self._written:
+            self._written.add(record)
+            self._pending.append(record)
+
+    def overflow(self):
+        """
+        Record that changes were lost, so the segment can't be trusted.
+        """
+        self.add(_OVERFLOW, "")
+
+    def flush(self):
+        """
+        Append the buffered records to the current segment.
+        """
+        if self._pending:
+            self._append(self._pending)
+            self._pending = []
+
+    def rotate(self):
+        """
+        End the current segment and make it available to caat, then start
+        the next one.
+        """
+        self.flush()
+        self._append([(_END, "{0} {1}".format(self.session, self.sequence))])
+        os.rename(join(self.journalDir, _CURRENT),
+                  join(self.journalDir, _ROTATED))
+        self.sequence += 1
+        self._written = set()
+        self._begin()
+
+    def _begin(self):
+        with open(join(self.journalDir, _CURRENT), 'w') as f:
+            f.write(_toLine(
+                _BEGIN, "{0} {1}".format(self.session, self.sequence)))
+
+    def _append(self, records):
+        with open(join(self.journalDir, _CURRENT), 'a') as f:
+            f.writelines(_toLine(type_, path) for type_, path in records)
+
+
+class Segment:
+    """
+    The directories that changed between two backups, as recorded by the
+    journal daemon.  A segment is complete when the daemon saw every change
+    it covers.
+    """
+
+    def __init__(self, session, sequence, isComplete, directories, trees):
+        self.session = session
+        self.sequence = sequence
+        self.isComplete = isComplete
+        self.directories = frozenset(directories)
+        self.trees = frozenset(trees)
+        self._parents = frozenset(
+            parent
+            for path in self.directories | self.trees
+            for parent in _getParents(path))
+
+    @classmethod
+    def read(cls, fileName):
+        """
+        Read a segment from a journal file.
+        """
+        session = sequence = end = None
+        isComplete = True
+        directories = set()
+        trees = set()
+        with open(fileName, errors="surrogateescape") as f:
+            for line in f:
+                try:
+                    type_, value = json.loads(line)
+                except ValueError:
+                    isComplete = False
+                    continue
+                if type_ == _BEGIN:
+                    session, sequence = value.split()
+                elif type_ == _END:
+                    end = value
+                elif type_ == DIRECTORY:
+                    directories.add(value)
+                elif type_ == TREE:
+                    trees.add(value)
+                else:
+                    isComplete = False
+        if session is None:
+            raise IOError("Journal {0} has no session.".format(fileName))
+        isComplete = isComplete and end == "{0} {1}".format(session, sequence)
+        return cls(session, int(sequence), isComplete, directories, trees)
+
+    def follows(self, session, sequence):
+        """
+        Returns True if the segment directly follows the provided one, so
+        no changes could have been missed between them.
+        """
+        return self.isComplete and self.session == session and \
+            self.sequence == sequence + 1
+
+    def isClean(self, directory):
+        """
+        Returns True if nothing changed in the directory or below it.
+        """
+        if directory in self.directories or directory in self._parents:
+            return False
+        return not any(p in self.trees for p in _getParents(directory)) and \
+            directory not in self.trees
+
+
+def takeSegment(journalDir, timeout=_ROTATE_TIMEOUT):
+    """
+    Ask the journal daemon to end its current segment and return it.
+    Returns None when the daemon isn't running or doesn't answer.
+    """
+    pid = _getDaemonPid(journalDir)
+    if pid is None:
+        return None
+    rotated = join(journalDir, _ROTATED)
+    if os.path.exists(rotated):
+        os.remove(rotated)
+    try:
+        os.kill(pid, signal.SIGUSR1)
+    except OSError:
+        return None
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(rotated):
+        if time.monotonic() > deadline:
+            return None
+        time.sleep(0.05)
+    return Segment.read(rotated)
+
+
+def _getDaemonPid(journalDir):
+    try:
+        with open(getPidFile(journalDir)) as f:
+            return int(f.read().strip())
+    except (IOError, ValueError):
+        return None
+
+
+def _toLine(type_, value):
+    return json.dumps([type_, value]) + "\n"
+
+
+def _getParents(path):
+    """
+    Returns the directories above a path, up to the root.
+    """
+    parents = []
+    while True:
+        parent = os.path.dirname(path)
+        if parent == path:
+            return parents
+        parents.append(parent)
+        path = parent
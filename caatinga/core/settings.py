@@ -19,8 +19,11 @@
 
 import os
 import grp
+import caatinga.core.durability as durability
+import caatinga.core.functions as fn
+import caatinga.core.storage as storage
 from os.path import join
-from glob import iglob
+from caatinga.core.ignore import IgnoreMatcher
 from sys import argv
 
 __all__ = ["Settings"]
@@ -44,9 +47,36 @@ class Settings:
         ]
         self.backupLocation = ""
         self.hostName = os.uname()[HOST_NAME_INDEX]
-        self.ignoredDirectories = []
-        self.ignoredFiles = []
+        self.ignored = IgnoreMatcher()
+        self.oneFileSystem = False
+        self.includedMounts = set()
         self.maxFileSize = 0
+        self.backupWorkers = 1
+        self.adaptiveWorkers = False
+        self.minBackupWorkers = 1
+        self.maxBackupWrites = 0
+        self.backupProcesses = 1
+        self.durability = durability.DEFAULT_MODE
+        self.changeDetection = fn.DEFAULT_CHANGE_DETECTION
+        self.dedup = False
+        self.chunkThreshold = 0
+        self.chunkSize = 1024 * 1024
+        self.compression = "none"
+        self.compressionMinSize = 4 * 1024
+        self.compressionSkip = frozenset(storage.DEFAULT_COMPRESSION_SKIP)
+        self.journal = ""
+        self.maxReadRate = 0
+        self.maxWriteRate = 0
+        self.maxIops = 0
+        self.ioClass = ""
+        self.ioPriority = 4
+        self.nice = None
+        self.eventLog = ""
+        self.eventLogFormat = "json"
+        self.eventLogMode = "all"
+        self.eventLogSample = 100
+        self.eventLogMaxSize = 0
+        self.eventLogKeep = 5
         self.maxImages = 0
         self.keepDays = 0
         self.backupgid = os.getgid()
@@ -103,15 +133,77 @@ class Settings:
         elif option == "max_file_size":
             # Convert to bytes
             self.maxFileSize = int(value) * 1024 * 1024
+        elif option == "backup_workers":
+            self.backupWorkers = int(value)
+        elif option == "adaptive_workers":
+            self.adaptiveWorkers = value.lower() == "yes"
+        elif option == "min_backup_workers":
+            self.minBackupWorkers = int(value)
+        elif option == "max_backup_writes":
+            self.maxBackupWrites = int(value)
+        elif option == "backup_processes":
+            self.backupProcesses = int(value)
+        elif option == "durability":
+            self.durability = value.lower()
+        elif option == "change_detection":
+            self.changeDetection = fn.getChangeDetection(value)
+        elif option == "dedup":
+            self.dedup = value.lower() == "yes"
+        elif option == "chunk_threshold":
+            # Convert to bytes
+            self.chunkThreshold = int(value) * 1024 * 1024
+        elif option == "chunk_size":
+            # Convert to bytes
+            self.chunkSize = int(value) * 1024
+        elif option == "compression":
+            self.compression = value.lower()
+        elif option == "compression_min_size":
+            # Convert to bytes
+            self.compressionMinSize = int(value) * 1024
+        elif option == "compression_skip":
+            self.compressionSkip = self._getExtensions(value)
+        elif option == "journal":
+            self.journal = value
+        elif option == "max_read_rate":
+            # Convert to bytes per second
+            self.maxReadRate = int(float(value) * 1024 * 1024)
+        elif option == "max_write_rate":
+            # Convert to bytes per second
+            self.maxWriteRate = int(float(value) * 1024 * 1024)
+        elif option == "max_iops":
+            self.maxIops = int(value)
+        elif option == "io_class":
+            self.ioClass = value.lower()
+        elif option == "io_priority":
+            self.ioPriority = int(value)
+        elif option == "nice":
+            self.nice = int(value)
+        elif option == "event_log":
+            self.eventLog = value
+        elif option == "event_log_format":
+            self.eventLogFormat = value.lower()
+        elif option == "event_log_mode":
+            self.eventLogMode = value.lower()
+        elif option == "event_log_sample":
+            self.eventLogSample = int(value)
+        elif option == "event_log_max_size":
+            # Convert to bytes
+            self.eventLogMaxSize = int(value) * 1024 * 1024
+        elif option == "event_log_keep":
+            self.eventLogKeep = int(value)
         elif option == "max_images":
             self.maxImages = int(value)
         elif option == "keep_days":
             self.keepDays = int(value)
         elif option == "backup_location":
             self.backupLocation = value
-            self.ignoredDirectories.append(value)
+            self.ignored.add(value)
         elif option == "ignore":
-            self._setIgnoreItem(value)
+            self.ignored.add(value)
+        elif option == "one_file_system":
+            self.oneFileSystem = value.lower() == "yes"
+        elif option == "include_mount":
+            self.includedMounts.add(os.path.normpath(value))
         elif option == "backup_group":
             self.backupgid = self._extractGroupIdFromGroup(value)
         elif option == "reduce_backups":
@@ -128,12 +220,18 @@ class Settings:
             msg = "Warning: Unknown setting in configuration file '{0}'"
             print(msg.format(option))
 
-    def _setIgnoreItem(self, value):
-        for item in iglob(value):
-            if os.path.isdir(item):
-                self.ignoredDirectories.append(item)
-            elif os.path.isfile(item):
-                self.ignoredFiles.append(item)
+    def _getExtensions(self, value):
+        """
+        Parse a list of file extensions.  A list starting with a plus is
+        added to the default extensions.
+        """
+        extensions = set()
+        if value.startswith("+"):
+            extensions.update(storage.DEFAULT_COMPRESSION_SKIP)
+            value = value[1:]
+        for extension in value.replace(",", " ").split():
+            extensions.add(extension.lstrip(".").lower())
+        return frozenset(extensions)
 
     def _extractGroupIdFromGroup(self, group):
         return grp.getgrnam(group).gr_gid
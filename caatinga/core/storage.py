@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Chris Taylor
+#
+# This file is part of caatinga.
+#
+# Caatinga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Caatinga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import lzma
+import os
+import zlib
+import caatinga.core.chunks as chunks
+import caatinga.core.copier as copier
+import caatinga.core.durability as durability
+import caatinga.core.throttle as throttle
+
+__all__ = ["getCompressions", "openFile", "writeFile", "restoreFile"]
+
+ZLIB = "zlib"
+LZMA = "lzma"
+
+# Extensions of formats that are already compressed.
+DEFAULT_COMPRESSION_SKIP = (
+    "7z", "apk", "avi", "bz2", "deb", "docx", "flac", "gif", "gz", "jar",
+    "jpeg", "jpg", "lz4", "lzma", "mkv", "mov", "mp3", "mp4", "odt", "ogg",
+    "png", "rar", "rpm", "tgz", "webm", "webp", "xlsx", "xz", "zip", "zst")
+
+_BLOCK_SIZE = 1024 * 1024
+_ZERO_BLOCK = bytes(_BLOCK_SIZE)
+_MAGIC = {
+    ZLIB: b"CAATINGA-ZLIB 1\n",
+    LZMA: b"CAATINGA-LZMA 1\n"}
+_COMPRESSORS = {
+    ZLIB: lambda: zlib.compressobj(6),
+    LZMA: lambda: lzma.LZMACompressor()}
+_DECOMPRESSORS = {
+    ZLIB: zlib.decompressobj,
+    LZMA: lzma.LZMADecompressor}
+
+
+def getCompressions():
+    """
+    Returns the names of the supported compressions.
+    """
+    return sorted(_COMPRESSORS.keys())
+
+
+def openFile(fileName, encoding=None, backupHome=None):
+    """
+    Open a backed up file for reading in binary mode.  The encoding is how
+    its contents were stored, as recorded by the catalog of its backup.
+    Encoded files are decoded while they are read, so the original contents
+    are returned.  Chunked files are read from the chunk store of the backup
+    home.
+    """
+    if encoding == chunks.STORAGE:
+        store = chunks.ChunkStore(chunks.getChunkStoreHome(backupHome))
+        return io.BufferedReader(_IterReader(store.readFile(fileName)))
+    elif encoding in _DECOMPRESSORS:
+        return io.BufferedReader(
+            _IterReader(_decompress(fileName, encoding)))
+    return open(fileName, 'rb')
+
+
+def writeFile(src, dest, st, encoding=None, digest=None, xattrs=None):
+    """
+    Copy src to dest using the provided compression, or a plain copy when
+    no compression is given.  When a hashlib object is provided, it's
+    updated with the original contents.  The extended attributes already
+    read from src can be provided.  Returns the stat result of dest.
+    """
+    if encoding is None:
+        return copier.copyFile(src, dest, st, digest, xattrs)
+    compressor = _COMPRESSORS[encoding]()
+    srcFd = os.open(src, os.O_RDONLY)
+    try:
+        destFd = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            _writeAll(destFd, _MAGIC[encoding])
+            with os.fdopen(srcFd, 'rb', buffering=0, closefd=False) as f:
+                for block in iter(lambda: f.read(_BLOCK_SIZE), b""):
+                    throttle.read(len(block))
+                    digest and digest.update(block)
+                    _writeAll(destFd, compressor.compress(block))
+            _writeAll(destFd, compressor.flush())
+            copier.applyMetadata(srcFd, destFd, dest, st, xattrs)
+            durability.syncFile(destFd)
+            return os.fstat(destFd)
+        finally:
+            os.close(destFd)
+    finally:
+        os.close(srcFd)
+
+
+def restoreFile(src, dest, backupHome, st=None, encoding=None):
+    """
+    Restore a backed up file to dest, decoding its contents when the
+    catalog recorded an encoding for it.  Blocks of zeros in decoded
+    contents are left as holes, so sparse files stay sparse.  Returns the
+    stat result of the restored file.
+    """
+    st = st or os.stat(src)
+    if encoding is None:
+        return copier.copyFile(src, dest, st)
+    srcFd = os.open(src, os.O_RDONLY)
+    try:
+        destFd = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            size = 0
+            with openFile(src, encoding, backupHome) as f:
+                for block in iter(lambda: f.read(_BLOCK_SIZE), b""):
+                    _writeSparse(destFd, block)
+                    size += len(block)
+            # Sets the size when the file ends with a hole.
+            os.ftruncate(destFd, size)
+            copier.applyMetadata(srcFd, destFd, dest, st)
+            return os.fstat(destFd)
+        finally:
+            os.close(destFd)
+    finally:
+        os.close(srcFd)
+
+
+def _decompress(fileName, encoding):
+    """
+    Iterate over the decompressed contents of a compressed file.
+    """
+    decompressor = _DECOMPRESSORS[encoding]()
+    with open(fileName, 'rb') as f:
+        if f.read(len(_MAGIC[encoding])) != _MAGIC[encoding]:
+            raise IOError("{0} isn't compressed with {1}.".format(
+                fileName, encoding))
+        for block in iter(lambda: f.read(_BLOCK_SIZE), b""):
+            yield decompressor.decompress(block)
+    if not decompressor.eof:
+        raise IOError("Compressed file {0} is truncated.".format(fileName))
+
+
+def _writeSparse(fd, block):
+    """
+    Write a block, or skip over it leaving a hole when it's all zeros.
+    """
+    if len(block) == _BLOCK_SIZE and block == _ZERO_BLOCK:
+        os.lseek(fd, _BLOCK_SIZE, os.SEEK_CUR)
+    else:
+        _writeAll(fd, block)
+
+
+def _writeAll(fd, data):
+    view = memoryview(data)
+    written = 0
+    while written < len(view):
+        written += os.write(fd, view[written:])
+    throttle.write(written)
+
+
+class _IterReader(io.RawIOBase):
+    """
+    Raw stream over an iterator of byte blocks.
+    """
+
+    def __init__(self, blocks):
+        self._blocks = iter(blocks)
+        self._pending = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        while not self._pending:
+            try:
+                self._pending = memoryview(next(self._blocks))
+            except StopIteration:
+                return 0
+        size = min(len(buf), len(self._pending))
+        buf[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
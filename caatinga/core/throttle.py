@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Chris Taylor
+#
+# This file is part of caatinga.
+#
+# Caatinga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Caatinga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import platform
+import sys
+import threading
+import time
+
+__all__ = ["TokenBucket", "setLimits", "shareLimits", "read", "write",
+           "operations", "setPriority", "getIoClasses"]
+
+# Number of the ioprio_set system call, which Python doesn't expose.
+_IOPRIO_SET = {
+    "x86_64": 251,
+    "i386": 289,
+    "i686": 289,
+    "aarch64": 30,
+    "armv7l": 314,
+    "ppc64": 273,
+    "ppc64le": 273,
+    "riscv64": 30,
+    "s390x": 282,
+}
+_IOPRIO_WHO_PROCESS = 1
+_IOPRIO_CLASS_SHIFT = 13
+_IO_CLASSES = {"realtime": 1, "best-effort": 2, "idle": 3}
+
+# Limits applied to every backup worker of the process, or None when the
+# rate isn't limited.
+_readBucket = None
+_writeBucket = None
+_operationsBucket = None
+
+
+def getIoClasses():
+    """
+    Returns the names of the I/O scheduling classes.
+    """
+    return sorted(_IO_CLASSES)
+
+
+class TokenBucket:
+    """
+    Limits the rate of a resource shared by many threads.  Tokens are added
+    at the provided rate per second, up to a second's worth.  Consuming more
+    tokens than are available puts the bucket in debt, and the caller sleeps
+    until the debt is paid back, so large amounts can be consumed at once
+    without exceeding the rate on average.
+    """
+
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self._tokens = self.rate
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount):
+        """
+        Take the amount of tokens from the bucket, sleeping until the rate
+        allows it.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.rate, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            delay = -self._tokens / self.rate
+        if delay > 0:
+            time.sleep(delay)
+
+
+def setLimits(readRate=0, writeRate=0, iops=0):
+    """
+    Limit the bytes read and written each second and the number of I/O
+    operations each second by this process.  A rate of 0 isn't limited.
+    """
+    global _readBucket, _writeBucket, _operationsBucket
+    _readBucket = readRate and TokenBucket(readRate) or None
+    _writeBucket = writeRate and TokenBucket(writeRate) or None
+    _operationsBucket = iops and TokenBucket(iops) or None
+
+
+def shareLimits(processes):
+    """
+    Divide the limits of this process between the provided number of
+    processes.  Called in each child process after it's forked.
+    """
+    setLimits(*[bucket and bucket.rate / processes
+                for bucket in (_readBucket, _writeBucket, _operationsBucket)])
+
+
+def read(size):
+    """
+    Account for one read of size bytes.
+    """
+    _readBucket and _readBucket.consume(size)
+    _operationsBucket and _operationsBucket.consume(1)
+
+
+def write(size):
+    """
+    Account for one write of size bytes.
+    """
+    _writeBucket and _writeBucket.consume(size)
+    _operationsBucket and _operationsBucket.consume(1)
+
+
+def operations(count=1):
+    """
+    Account for I/O operations that don't transfer file contents, such as
+    reading a directory or stat'ing a file.
+    """
+    _operationsBucket and _operationsBucket.consume(count)
+
+
+def setPriority(ioClass="", ioPriority=4, nice=None):
+    """
+    Set the I/O scheduling class and priority and the nice value of this
+    process.  Threads and processes started afterwards inherit them, so
+    this is done at startup.  A warning is written when a value can't be
+    set, as only root can raise priorities.
+    """
+    if ioClass:
+        try:
+            _setIoPriority(_IO_CLASSES[ioClass], ioPriority)
+        except OSError as ex:
+            sys.stderr.write(
+                "Unable to set the I/O priority: {0}\n".format(ex.strerror))
+    if nice is not None:
+        try:
+            os.setpriority(os.PRIO_PROCESS, 0, nice)
+        except OSError as ex:
+            sys.stderr.write(
+                "Unable to set the nice value: {0}\n".format(ex.strerror))
+
+
+def _setIoPriority(ioClass, level):
+    number = _IOPRIO_SET.get(platform.machine())
+    if number is None or not sys.platform.startswith("linux"):
+        raise OSError(errno.ENOSYS, os.strerror(errno.ENOSYS))
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    if ioClass == _IO_CLASSES["idle"]:
+        # The idle class has no levels.
+        level = 0
+    value = (ioClass << _IOPRIO_CLASS_SHIFT) | level
+    if libc.syscall(number, _IOPRIO_WHO_PROCESS, 0, value) != 0:
+        code = ctypes.get_errno()
+        raise OSError(code, os.strerror(code))
@@ -18,6 +18,11 @@
 # along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import caatinga.core.durability as durability
+import caatinga.core.events as events
+import caatinga.core.functions as fn
+import caatinga.core.storage as storage
+import caatinga.core.throttle as throttle
 
 __all__ = ["SettingsValidator", "ValidationException"]
 
@@ -39,6 +44,18 @@ class SettingsValidator:
         self._hasBackupLocation(settings.backupLocation)
         self._doesBackupLocationExist(settings.backupLocation)
         self._doesRootDirectoryExist(settings.root)
+        self._hasValidWorkerCount(settings.backupWorkers)
+        self._hasValidMinWorkerCount(
+            settings.minBackupWorkers, settings.backupWorkers)
+        self._hasValidWriteCount(settings.maxBackupWrites)
+        self._hasValidProcessCount(settings.backupProcesses)
+        self._hasValidDurability(settings.durability)
+        self._hasValidChangeDetection(settings.changeDetection)
+        self._hasValidChunkSize(settings.chunkThreshold, settings.chunkSize)
+        self._hasValidCompression(settings.compression)
+        self._hasValidEventLog(settings)
+        self._hasValidLimits(settings)
+        self._hasValidPriority(settings)
         self._doesHooksDirectoryExits(settings.preBackupHooksDir)
         self._doesHooksDirectoryExits(settings.postBackupHooksDir)
         self._doesHooksDirectoryExits(settings.preRestoreHooksDir)
@@ -59,6 +76,93 @@ class SettingsValidator:
         if os.path.exists(root) is False:
             raise ValidationException("Root directory doesn't exist.")
 
+    def _hasValidWorkerCount(self, workers):
+        if workers < 1:
+            raise ValidationException(
+                "The number of backup workers must be at least 1.")
+
+    def _hasValidMinWorkerCount(self, minWorkers, workers):
+        if not 1 <= minWorkers <= workers:
+            raise ValidationException(
+                "The minimum number of backup workers must be between 1 " +
+                "and backup_workers.")
+
+    def _hasValidWriteCount(self, writes):
+        if writes < 0:
+            raise ValidationException(
+                "The maximum number of backup writes can't be negative.")
+
+    def _hasValidProcessCount(self, processes):
+        if processes < 1:
+            raise ValidationException(
+                "The number of backup processes must be at least 1.")
+
+    def _hasValidChangeDetection(self, changeDetection):
+        if not changeDetection:
+            raise ValidationException("No change_detection specified.")
+        for name in changeDetection:
+            if name not in fn.getChangeDetectors():
+                raise ValidationException(
+                    "Unknown change_detection '{0}'.  Valid values are: {1}"
+                    .format(name, ", ".join(fn.getChangeDetectors())))
+
+    def _hasValidChunkSize(self, threshold, chunkSize):
+        if threshold < 0:
+            raise ValidationException(
+                "The chunk threshold can't be negative.")
+        if chunkSize < 1024:
+            raise ValidationException(
+                "The chunk size must be at least 1 KB.")
+
+    def _hasValidDurability(self, mode):
+        if mode not in durability.getModes():
+            raise ValidationException(
+                "Unknown durability '{0}'.  Valid values are: {1}"
+                .format(mode, ", ".join(durability.getModes())))
+
+    def _hasValidCompression(self, compression):
+        if compression != "none" and \
+                compression not in storage.getCompressions():
+            raise ValidationException(
+                "Unknown compression '{0}'.  Valid values are: none, {1}"
+                .format(compression, ", ".join(storage.getCompressions())))
+
+    def _hasValidEventLog(self, settings):
+        if settings.eventLogFormat not in events.getFormats():
+            raise ValidationException(
+                "Unknown event_log_format '{0}'.  Valid values are: {1}"
+                .format(settings.eventLogFormat,
+                        ", ".join(events.getFormats())))
+        if settings.eventLogMode not in events.getModes():
+            raise ValidationException(
+                "Unknown event_log_mode '{0}'.  Valid values are: {1}"
+                .format(settings.eventLogMode, ", ".join(events.getModes())))
+        if settings.eventLogSample < 1:
+            raise ValidationException(
+                "The event log sample rate must be at least 1.")
+        if settings.eventLogMaxSize < 0 or settings.eventLogKeep < 0:
+            raise ValidationException(
+                "The event log rotation settings can't be negative.")
+
+    def _hasValidLimits(self, settings):
+        if min(settings.maxReadRate, settings.maxWriteRate,
+               settings.maxIops) < 0:
+            raise ValidationException(
+                "The read, write and I/O operation rates can't be negative.")
+
+    def _hasValidPriority(self, settings):
+        ioClasses = throttle.getIoClasses()
+        if settings.ioClass and settings.ioClass not in ioClasses:
+            raise ValidationException(
+                "Unknown io_class '{0}'.  Valid values are: {1}"
+                .format(settings.ioClass, ", ".join(ioClasses)))
+        if not 0 <= settings.ioPriority <= 7:
+            raise ValidationException(
+                "The I/O priority must be between 0 and 7.")
+        if settings.nice is not None and not -20 <= settings.nice <= 19:
+            raise ValidationException(
+                "The nice value must be between -20 and 19.")
+
     def _doesHooksDirectoryExits(self, directory):
         if len(directory) > 1 and os.path.exists(directory) is False:
             raise ValidationException("Hook directory does not exist.")
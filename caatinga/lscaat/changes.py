@@ -18,6 +18,7 @@
 # along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import caatinga.core.catalog as catalog
 import caatinga.core.functions as fn
 from os.path import join, basename
 
@@ -35,15 +36,37 @@ def changes(args, settings):
     backupWd = fn.removeAltRoot(settings.root, cwd)
     backedUpFiles = fn.expandGlob(home, backup, backupWd, "*")
     backupDir = join(home, backup) + backupWd
-    ignoredItems = settings.ignoredFiles + settings.ignoredDirectories
     allFiles = set(os.listdir(cwd)).union(map(basename, backedUpFiles))
+    catalogItems = _getCatalogItems(home, backup, backupWd)
 
     for item in allFiles:
-        status = _getStatus(join(cwd, item), join(backupDir, item), ignoredItems)
+        status = _getStatus(
+            join(cwd, item),
+            join(backupDir, item),
+            settings.ignored,
+            catalogItems.get(item),
+            settings.changeDetection,
+            home)
         if status:
             _outputItem(item, status)
 
 
+def _getCatalogItems(home, backup, backupWd):
+    """
+    Returns the catalog rows of the items found in the working directory of
+    the backup keyed by name.  Nothing is returned if the backup doesn't
+    have a catalog.
+    """
+    catalogFile = catalog.getCatalogFile(home, backup)
+    if not os.path.exists(catalogFile):
+        return {}
+    reader = catalog.CatalogReader(catalogFile)
+    try:
+        return reader.listDirectory(backupWd)
+    finally:
+        reader.close()
+
+
 def _validateArgs(wordArgs):
     """
     Insure the word args that were provided are valid.
@@ -52,10 +75,14 @@ def _validateArgs(wordArgs):
         raise Exception("Cannot show changes from 'all' backups.")
 
 
-def _getStatus(localFile, backedUpFile, ignoredItems):
+def _getStatus(localFile, backedUpFile, ignoredItems, catalogRow=None,
+               changeDetection=fn.DEFAULT_CHANGE_DETECTION, backupHome=None):
     """
     Return the status of the item provided compared to the version that is
-    found in the backup.  Status can be "New", "Deleted" or "Modified".
+    found in the backup.  Status can be "New", "Deleted" or "Modified".  When
+    the item's catalog row is provided, it's compared against the values
+    recorded in the catalog instead of the backed up item, and its contents
+    are read using the backup home and the encoding recorded by the catalog.
     """
     if localFile in ignoredItems:
         return None
@@ -63,12 +90,38 @@ def _getStatus(localFile, backedUpFile, ignoredItems):
         return "New"
     elif os.path.exists(localFile) is False and os.path.exists(backedUpFile):
         return "Deleted"
-    elif fn.isModified(localFile, backedUpFile):
+    elif _isModified(
+            localFile, backedUpFile, catalogRow, changeDetection, backupHome):
         return "Modified"
     else:
         return None
 
 
+def _isModified(localFile, backedUpFile, catalogRow, changeDetection,
+                backupHome=None):
+    """
+    Returns True if the local item was modified.  Directories are only
+    compared by their modified time, and comparators that only apply to the
+    source can't be used without a catalog row.
+    """
+    if os.path.isdir(localFile):
+        changeDetection = ["mtime_ns"]
+    if catalogRow:
+        return fn.isModified(
+            localFile,
+            backedUpFile,
+            None,
+            catalog.getStat(catalogRow),
+            changeDetection,
+            backupHome,
+            catalog.getStorage(catalogRow))
+    return fn.isModified(
+        localFile,
+        backedUpFile,
+        changeDetection=[c for c in changeDetection
+                         if c not in fn.SOURCE_ONLY_CHANGE_DETECTION])
+
+
 def _outputItem(item, status):
     """
     Output the formatted information to the console.
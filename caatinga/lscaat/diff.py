@@ -18,8 +18,11 @@
 # along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import io
 import sys
+import caatinga.core.catalog as catalog
 import caatinga.core.functions as fn
+import caatinga.core.storage as storage
 from os.path import join
 from difflib import Differ
 
@@ -39,7 +42,8 @@ def diff(args, settings):
     items = fn.expandGlob(home, backup, backupWd, wordArgs["glob"])
     _validateItems(items)
     localFile = _getLines(join(cwd, wordArgs["glob"]))
-    backupFile = _getLines(items[0])
+    backupFile = _getLines(
+        items[0], home, _getEncoding(home, backup, items[0]))
     diff = _getDiff()
     sys.stdout.writelines(diff(backupFile, localFile))
 
@@ -76,12 +80,36 @@ def _raiseMultipleFileException():
     raise Exception("Cannot perform diff on more than one file.")
 
 
-def _getLines(fileName):
+def _getEncoding(home, backup, backupFile):
     """
-    Read and return all the lines from the provided file.
+    Returns the encoding the catalog of the backup recorded for the file, or
+    None if it's a plain copy.
     """
-    with open(fileName, 'U') as f:
-        return f.readlines()
+    catalogFile = catalog.getCatalogFile(home, backup)
+    if not os.path.exists(catalogFile):
+        return None
+    image = os.path.normpath(join(home, backup))
+    path = os.path.normpath(backupFile)[len(image):]
+    reader = catalog.CatalogReader(catalogFile)
+    try:
+        row = reader.lookup(path)
+    finally:
+        reader.close()
+    return row and catalog.getStorage(row)
+
+
+def _getLines(fileName, backupHome=None, encoding=None):
+    """
+    Read and return all the lines from the provided file.  When the file
+    comes from a backup, its contents are decoded using the backup home and
+    the encoding recorded by its catalog.
+    """
+    if backupHome:
+        f = storage.openFile(fileName, encoding, backupHome)
+    else:
+        f = open(fileName, 'rb')
+    with io.TextIOWrapper(f, errors="replace") as lines:
+        return lines.readlines()
 
 
 def _getDiff():
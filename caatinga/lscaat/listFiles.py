@@ -18,7 +18,9 @@
 # along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import caatinga.core.catalog as catalog
 import caatinga.core.functions as fn
+from fnmatch import fnmatch
 
 
 def listFiles(args, settings):
@@ -30,10 +32,40 @@ def listFiles(args, settings):
     backups = fn.getBackupsForArgs(wordArgs, fn.getBackups(home))
     backupWd = fn.removeAltRoot(settings.root, os.getcwd())
     for id_ in backups.keys():
-        items = fn.expandGlob(home, backups[id_], backupWd, wordArgs["glob"])
-        for item in items:
-            if os.path.exists(item):
-                _outputItemInfo(id_, fn.getInfo(item))
+        catalogFile = catalog.getCatalogFile(home, backups[id_])
+        if os.path.exists(catalogFile) and os.sep not in wordArgs["glob"]:
+            infos = _getCatalogInfo(catalogFile, backupWd, wordArgs["glob"])
+        else:
+            infos = _getBackupInfo(home, backups[id_], backupWd, wordArgs)
+        for info in infos:
+            _outputItemInfo(id_, info)
+
+
+def _getCatalogInfo(catalogFile, backupWd, pattern):
+    """
+    Returns the info of the items matching the glob pattern using the
+    catalog of a backup, so the backup image doesn't need to be read.  Like
+    glob, hidden items only match patterns starting with a dot.
+    """
+    reader = catalog.CatalogReader(catalogFile)
+    try:
+        items = reader.listDirectory(backupWd)
+    finally:
+        reader.close()
+    showHidden = pattern.startswith(".")
+    return [fn.getCatalogInfo(items[name])
+            for name in sorted(items.keys())
+            if fnmatch(name, pattern) and
+            (showHidden or not name.startswith("."))]
+
+
+def _getBackupInfo(home, backup, backupWd, wordArgs):
+    """
+    Returns the info of the items matching the glob pattern by reading the
+    backup image.
+    """
+    items = fn.expandGlob(home, backup, backupWd, wordArgs["glob"])
+    return [fn.getInfo(item) for item in items if os.path.exists(item)]
 
 
 def _outputItemInfo(index, info):
@@ -18,6 +18,7 @@
 # along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import caatinga.core.catalog as catalog
 import caatinga.core.functions as fn
 from shutil import rmtree
 
@@ -32,9 +33,14 @@ def remove(args, settings):
     backups = fn.getBackupsForArgs(wordArgs, fn.getBackups(home))
     backupWd = fn.removeAltRoot(settings.root, os.getcwd())
     for id_ in backups.keys():
+        backupDir = os.path.join(home, backups[id_])
         items = fn.expandGlob(home, backups[id_], backupWd, wordArgs["glob"])
         for item in items:
             _delete(item)
+            _removeFromCatalog(
+                home,
+                backups[id_],
+                "/" + item[len(backupDir):].lstrip(os.sep))
 
 
 def _validateArgs(wordArgs):
@@ -45,6 +51,16 @@ def _validateArgs(wordArgs):
         raise Exception("No from backup id provided.")
 
 
+def _removeFromCatalog(home, backup, path):
+    """
+    Remove the deleted item from the catalog of the backup, so the catalog
+    keeps describing what is in the backup.
+    """
+    catalogFile = catalog.getCatalogFile(home, backup)
+    if os.path.exists(catalogFile):
+        catalog.removeEntries(catalogFile, path)
+
+
 def _delete(item):
     """
     Delete the provided item.
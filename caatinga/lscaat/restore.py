@@ -19,12 +19,18 @@
 
 import os
 import sys
+import caatinga.core.catalog as catalog
 import caatinga.core.functions as fn
+from caatinga.caat.workers import openWorkers
 
 
 def restore(args, settings):
     """
-    Main function for the restore option.
+    Main function for the restore option.  Files are copied by the
+    backup_workers threads, decoding them using the encodings recorded in
+    the catalog.  Once they are all restored, files that were hard links of
+    each other are linked again and the extended attributes recorded in the
+    catalog are set.
     """
     wordArgs = fn.parseWordArgs(args)
     _validateArgs(wordArgs)
@@ -35,8 +41,13 @@ def restore(args, settings):
     backupWd = fn.removeAltRoot(settings.root, cwd)
     items = fn.expandGlob(home, backup, backupWd, wordArgs["glob"])
     _validateItems(items, wordArgs)
-    for item in items:
-        _restoreItem(item, cwd, wordArgs["as"])
+    encodings = _getEncodings(home, backup, backupWd)
+    with openWorkers(settings) as workers:
+        restored = [_restoreItem(
+            item, cwd, wordArgs["as"], home, workers, encodings)
+            for item in items]
+    for item, restoreAs in zip(items, restored):
+        restoreAs and _restoreFromCatalog(item, restoreAs, home, backup)
 
 
 def _validateArgs(wordArgs):
@@ -58,21 +69,108 @@ def _validateItems(items, wordArgs):
         raise Exception("Can't restore multiple items when using 'as' alias.")
 
 
-def _restoreItem(item, cwd, as_):
+def _getEncodings(home, backup, backupWd):
+    """
+    Returns the encodings of the files under the working directory of the
+    backup, keyed by the name of the file in the backup.  Backups without a
+    catalog only have plain copies.
+    """
+    catalogFile = catalog.getCatalogFile(home, backup)
+    if not os.path.exists(catalogFile):
+        return {}
+    image = os.path.join(home, backup)
+    reader = catalog.CatalogReader(catalogFile)
+    try:
+        return dict((os.path.normpath(image + path), encoding)
+                    for path, encoding in reader.getStorages(backupWd).items())
+    finally:
+        reader.close()
+
+
+def _restoreItem(item, cwd, as_, home, workers=None, encodings=None):
     """
     Restores the provided item to the current working directory.  If the 'as'
-    is not provided, the original file name is preserved.
+    is not provided, the original file name is preserved.  Encoded files are
+    decoded, and files stored as chunks are reassembled from the backup home.
+    Returns the name the item was restored as, or None if it wasn't restored.
     """
     if as_:
         restoreAs = os.path.join(cwd, as_)
     else:
         restoreAs = os.path.join(cwd, os.path.basename(item))
 
-    if os.path.exists(restoreAs):
-        if _confirmOverwrite(restoreAs):
-            fn.copy(item, restoreAs)
-    else:
-        fn.copy(item, restoreAs)
+    if os.path.exists(restoreAs) and not _confirmOverwrite(restoreAs):
+        return None
+    fn.copy(item, restoreAs, home, workers, encodings)
+    return restoreAs
+
+
+def _restoreFromCatalog(item, restoreAs, home, backup):
+    """
+    Restore what the catalog of the backup records about the restored
+    items beyond their copies: the files that were hard links of each other
+    in the source, and the extended attributes, which are set in bulk.
+    """
+    catalogFile = catalog.getCatalogFile(home, backup)
+    if not os.path.exists(catalogFile):
+        return
+    image = os.path.join(home, backup)
+    path = os.path.normpath(item)[len(image):] or "/"
+    reader = catalog.CatalogReader(catalogFile)
+    try:
+        groups = reader.getHardLinks(path) if os.path.isdir(restoreAs) \
+            else []
+        xattrs = reader.getXattrs(path)
+    finally:
+        reader.close()
+    _restoreHardLinks(groups, path, restoreAs, image)
+    _restoreXattrs(xattrs, path, restoreAs)
+
+
+def _restoreHardLinks(groups, directory, restoreAs, image):
+    """
+    Link the restored files of a directory that were hard links of each
+    other in the source.  They are restored as copies first, which are
+    replaced by links to the first one.
+    """
+    for paths in groups:
+        restored = [_getRestoredPath(restoreAs, directory, p) for p in paths]
+        for path, dest in zip(paths[1:], restored[1:]):
+            if os.path.isfile(restored[0]) and os.path.isfile(dest):
+                _linkRestoredFile(restored[0], dest, image + path)
+
+
+def _restoreXattrs(xattrs, path, restoreAs):
+    """
+    Set the extended attributes of the restored items to the ones recorded
+    in the catalog.  Copies get the attributes of the files in the backup,
+    which may be shared with identical files when dedup is used.
+    """
+    for itemPath, itemXattrs in xattrs.items():
+        restored = _getRestoredPath(restoreAs, path, itemPath)
+        if os.path.exists(restored) and not os.path.islink(restored):
+            fn.setXattrs(restored, itemXattrs)
+
+
+def _getRestoredPath(restoreAs, path, itemPath):
+    """
+    Returns where an item of the backup under the restored path was
+    restored.
+    """
+    return os.path.normpath(
+        os.path.join(restoreAs, os.path.relpath(itemPath, path)))
+
+
+def _linkRestoredFile(first, dest, backupItem):
+    """
+    Replace a restored file by a link to the first one, then restore the
+    times of its directory, which changed when the file was replaced.
+    """
+    temp = dest + ".caatinga-link"
+    os.link(first, temp)
+    os.rename(temp, dest)
+    st = os.stat(os.path.dirname(backupItem))
+    os.utime(os.path.dirname(dest), ns=(st.st_atime_ns, st.st_mtime_ns))
 
 
 def _confirmOverwrite(item):
@@ -95,6 +95,36 @@ class ArgsTestCase(unittest.TestCase):
             a.hostName,
             "Cheese")
 
+    def test_ShortJobsOptionGetsSet(self):
+        a = self.parser.parse_args(["-j", "4"])
+        self.assertEqual(
+            a.jobs,
+            4)
+
+    def test_LongJobsOptionGetsSet(self):
+        a = self.parser.parse_args(["--jobs=4"])
+        self.assertEqual(
+            a.jobs,
+            4)
+
+    def test_ProcessesOptionGetsSet(self):
+        a = self.parser.parse_args(["--processes=3"])
+        self.assertEqual(
+            a.processes,
+            3)
+
+    def test_OneFileSystemOptionGetsSet(self):
+        a = self.parser.parse_args(["-x"])
+        self.assertEqual(
+            a.oneFileSystem,
+            True)
+
+    def test_StatsOptionGetsSet(self):
+        a = self.parser.parse_args(["--stats"])
+        self.assertEqual(
+            a.stats,
+            True)
+
     def test_ShortRootOptionGetsSet(self):
         a = self.parser.parse_args(["-r", "/mnt/foo"])
         self.assertEqual(
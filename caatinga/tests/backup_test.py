@@ -18,19 +18,38 @@
 # along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import sqlite3
 import unittest
 import caatinga.caat.backup as backup
+import caatinga.core.catalog as catalog
+import caatinga.core.chunks as chunks
+import caatinga.core.events as events
+import caatinga.core.journal as journal
+import caatinga.core.storage as storage
+from caatinga.caat.stats import BackupStats
+from caatinga.core.settings import Settings
 from os.path import join
 from shutil import rmtree
 from testutils import touch
 
 
+class _InterruptedEventLog(events.NullEventLog):
+    """
+    Event log interrupting the backup when the first file is copied.
+    """
+
+    def log(self, level, path, message=None):
+        if level == events.COPY:
+            raise KeyboardInterrupt()
+
+
 class BackupTestCase(unittest.TestCase):
     """
     Test case for testing the backup functions of caat.
     """
 
     _backupHome = "backup_test"
+    _events = events.NullEventLog()
 
     def setUp(self):
         os.mkdir(self._backupHome)
@@ -110,9 +129,709 @@ class BackupTestCase(unittest.TestCase):
         newFile = join(self._backupHome, "newFile")
         touch(previousFile)
         touch(newFile)
+        os.utime(previousFile, (1340664089, 1320861443))
+        os.utime(newFile, (1340664089, 1320861443))
         self.assertFalse(backup.isFileModifiedOrNew(previousFile, newFile))
         os.remove(previousFile)
         os.remove(newFile)
 
+    def test_isFileModifiedOrNew_usesProvidedStat(self):
+        previousFile = join(self._backupHome, "oldFile")
+        newFile = join(self._backupHome, "newFile")
+        touch(previousFile)
+        touch(newFile)
+        os.utime(previousFile, (1340664089, 1320861443))
+        os.utime(newFile, (1340664089, 1320861443))
+        st = os.stat(newFile)
+        os.utime(newFile, (1340664089, 1320861444))
+        self.assertFalse(backup.isFileModifiedOrNew(previousFile, newFile, st))
+
+    def test_isFileModifiedOrNew_sameSecond(self):
+        previousFile = join(self._backupHome, "oldFile")
+        newFile = join(self._backupHome, "newFile")
+        touch(previousFile)
+        touch(newFile)
+        os.utime(previousFile, ns=(1340664089000000000, 1320861443000000000))
+        os.utime(newFile, ns=(1340664089000000000, 1320861443500000000))
+        self.assertTrue(backup.isFileModifiedOrNew(previousFile, newFile))
+
+    def test_isFileModifiedOrNew_ignoresSourceOnlyComparators(self):
+        previousFile = join(self._backupHome, "oldFile")
+        newFile = join(self._backupHome, "newFile")
+        touch(previousFile)
+        touch(newFile)
+        os.utime(previousFile, (1340664089, 1320861443))
+        os.utime(newFile, (1340664089, 1320861443))
+        self.assertFalse(backup.isFileModifiedOrNew(
+            previousFile, newFile, None, ("mtime_ns", "size", "inode")))
+
+    def test_backupDirectory_copiesThenLinks(self):
+        source = self._makeSourceTree()
+        first = join(self._backupHome, "first")
+        second = join(self._backupHome, "second")
+        os.mkdir(first)
+        os.mkdir(second)
+        settings = self._getSettings(source)
+        backup.backupDirectory(first, "", source, settings, self._events)
+        backup.backupDirectory(second, first, source, settings, self._events)
+        deepFile = "/a/b/c/d/cheese"
+        self.assertTrue(os.path.exists(first + deepFile))
+        self.assertTrue(os.path.lexists(join(second, "link")))
+        self.assertFalse(os.path.exists(join(second, "ignored")))
+        self.assertEqual(
+            os.stat(first + deepFile).st_ino,
+            os.stat(second + deepFile).st_ino)
+        self.assertEqual(
+            os.stat(join(source, "a")).st_mtime_ns,
+            os.stat(join(second, "a")).st_mtime_ns)
+
+    def test_backupDirectory_raisesInterruptOfPipeline(self):
+        source = self._makeSourceTree()
+        first = join(self._backupHome, "first")
+        os.mkdir(first)
+        settings = self._getSettings(source)
+        self.assertRaises(
+            KeyboardInterrupt, backup.backupDirectory, first, "", source,
+            settings, _InterruptedEventLog())
+
+    def test_backupDirectory_withWorkers(self):
+        source = self._makeSourceTree()
+        first = join(self._backupHome, "first")
+        os.mkdir(first)
+        settings = self._getSettings(source)
+        settings.backupWorkers = 4
+        backup.backupDirectory(first, "", source, settings, self._events)
+        self.assertTrue(os.path.exists(first + "/a/b/bacon"))
+        self.assertEqual(
+            os.stat(join(source, "a/b")).st_mtime_ns,
+            os.stat(join(first, "a/b")).st_mtime_ns)
+
+    def test_backupDirectory_linksRelativeToDirectories(self):
+        source = self._makeSourceTree()
+        first = join(self._backupHome, "first")
+        second = join(self._backupHome, "second")
+        os.mkdir(first)
+        os.mkdir(second)
+        settings = self._getSettings(source)
+        settings.backupWorkers = 4
+        backup.backupDirectory(first, "", source, settings, self._events)
+        openFiles = len(os.listdir("/proc/self/fd"))
+        catalogFile = join(self._backupHome, "second.catalog")
+        writer = catalog.CatalogWriter(catalogFile)
+        backup.backupDirectory(
+            second, first, source, settings, self._events, writer)
+        writer.close()
+        self.assertEqual(
+            os.stat(first + "/a/b/c/d/cheese").st_ino,
+            os.stat(second + "/a/b/c/d/cheese").st_ino)
+        # Every directory that was opened is closed again.
+        self.assertEqual(len(os.listdir("/proc/self/fd")), openFiles)
+
+    def test_backupDirectory_inShards(self):
+        source = self._makeSourceTree()
+        first = join(self._backupHome, "first")
+        os.mkdir(first)
+        settings = self._getSettings(source)
+        settings.backupProcesses = 2
+        backup.backupDirectory(first, "", source, settings, self._events)
+        self.assertTrue(os.path.exists(first + "/a/b/c/d/cheese"))
+        self.assertTrue(os.path.lexists(join(first, "link")))
+        self.assertFalse(os.path.exists(join(first, "ignored")))
+        self.assertEqual(
+            os.stat(join(source, "a")).st_mtime_ns,
+            os.stat(join(first, "a")).st_mtime_ns)
+
+    def test_backupDirectory_walksEachDevice(self):
+        source = self._makeSourceTree()
+        first = join(self._backupHome, "first")
+        os.mkdir(first)
+        settings = self._getSettings(source)
+        settings.maxBackupWrites = 1
+        run = backup._BackupRun(
+            first, "", settings, self._events, None, BackupStats())
+        # Pretend a is on another device, so its subdirectories are handed
+        # back to the pipeline of the source's device.
+        st = os.lstat(join(source, "a"))
+        aStat = os.stat_result(
+            st[:2] + (st.st_dev + 1,) + st[3:],
+            {"st_atime_ns": st.st_atime_ns, "st_mtime_ns": st.st_mtime_ns})
+        with backup._DevicePipelines(run) as run.devices:
+            run.devices.handOff(
+                join(source, "a"), aStat, backup.ignore.IgnoreRules())
+        self.assertEqual(len(run.devices._threads), 2)
+        self.assertTrue(os.path.exists(first + "/a/b/c/d/cheese"))
+        self.assertEqual(
+            os.stat(join(source, "a/b")).st_mtime_ns,
+            os.stat(join(first, "a/b")).st_mtime_ns)
+        self.assertEqual(
+            os.stat(join(source, "a")).st_mtime_ns,
+            os.stat(join(first, "a")).st_mtime_ns)
+
+    def test_isExcludedMount(self):
+        settings = Settings()
+        settings.includedMounts.add("/home")
+        st = os.lstat(self._backupHome)
+        otherStat = os.stat_result(st[:2] + (st.st_dev + 1,) + st[3:])
+        self.assertFalse(
+            backup._isExcludedMount(settings, "/mnt", otherStat, st))
+        settings.oneFileSystem = True
+        self.assertTrue(
+            backup._isExcludedMount(settings, "/mnt", otherStat, st))
+        self.assertFalse(backup._isExcludedMount(settings, "/mnt", st, st))
+        self.assertFalse(
+            backup._isExcludedMount(settings, "/home/", otherStat, st))
+
+    def test_backupMountPoint(self):
+        source = self._makeSourceTree()
+        first = join(self._backupHome, "first")
+        os.mkdir(first)
+        run = backup._BackupRun(
+            first, "", self._getSettings(source), self._events, None,
+            BackupStats())
+        st = os.lstat(join(source, "a"))
+        backup._backupMountPoint(run, join(source, "a"), st)
+        self.assertEqual(os.listdir(join(first, "a")), [])
+        self.assertEqual(
+            os.stat(join(first, "a")).st_mtime_ns, st.st_mtime_ns)
+        self.assertEqual(run.stats.getCounters()["ignored"], 1)
+
+    def test_backupDirectory_countsItems(self):
+        source = self._makeSourceTree()
+        first = join(self._backupHome, "first")
+        second = join(self._backupHome, "second")
+        os.mkdir(first)
+        os.mkdir(second)
+        with open(join(source, "a/b/bacon"), 'w') as f:
+            f.write("crispy")
+        settings = self._getSettings(source)
+        firstStats = BackupStats()
+        backup.backupDirectory(
+            first, "", source, settings, self._events, stats=firstStats)
+        settings.backupProcesses = 2
+        secondStats = BackupStats()
+        backup.backupDirectory(
+            second, first, source, settings, self._events, stats=secondStats)
+        counters = firstStats.getCounters()
+        self.assertEqual(counters["directories_scanned"], 5)
+        self.assertEqual(counters["files_scanned"], 2)
+        self.assertEqual(counters["files_copied"], 2)
+        self.assertEqual(counters["bytes_copied"], 6)
+        self.assertEqual(counters["links"], 1)
+        self.assertEqual(counters["ignored"], 1)
+        counters = secondStats.getCounters()
+        self.assertEqual(counters["files_linked"], 2)
+        self.assertEqual(counters["files_copied"], 0)
+        self.assertEqual(counters["directories_scanned"], 5)
+
+    def test_backupDirectory_logsEventsOfShards(self):
+        source = self._makeSourceTree()
+        first = join(self._backupHome, "first")
+        os.mkdir(first)
+        settings = self._getSettings(source)
+        settings.backupProcesses = 2
+        settings.eventLog = join(self._backupHome, "events.log")
+        settings.eventLogFormat = events.TEXT
+        with events.openEventLog(settings, False) as eventLog:
+            backup.backupDirectory(first, "", source, settings, eventLog)
+        with open(settings.eventLog) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(
+            sorted(lines),
+            ["Copying: " + join(source, "a/b/bacon"),
+             "Copying: " + join(source, "a/b/c/d/cheese"),
+             "Ignore: " + join(source, "ignored")])
+
+    def test_backupDirectory_writesCatalog(self):
+        source = self._makeSourceTree()
+        first = join(self._backupHome, "first")
+        os.mkdir(first)
+        settings = self._getSettings(source)
+        settings.backupProcesses = 2
+        catalogFile = join(self._backupHome, "first.catalog")
+        writer = catalog.CatalogWriter(catalogFile)
+        backup.backupDirectory(
+            first, "", source, settings, self._events, writer)
+        writer.close()
+        reader = catalog.CatalogReader(catalogFile)
+        cheese = reader.lookup("/a/b/c/d/cheese")
+        link = reader.lookup("/link")
+        self.assertEqual(
+            cheese["backup_ino"],
+            os.stat(first + "/a/b/c/d/cheese").st_ino)
+        self.assertEqual(link["target"], "a/b/bacon")
+        self.assertTrue(catalog.isDirectory(reader.lookup("/a/b/c")))
+        self.assertEqual(reader.lookup("/ignored"), None)
+        reader.close()
+
+    def test_backupDirectory_keepsHardLinks(self):
+        source = self._makeSourceTree()
+        os.link(join(source, "a/b/bacon"), join(source, "a/b/c/ham"))
+        first = join(self._backupHome, "first")
+        os.mkdir(first)
+        settings = self._getSettings(source)
+        settings.backupWorkers = 4
+        catalogFile = join(self._backupHome, "first.catalog")
+        writer = catalog.CatalogWriter(catalogFile)
+        stats = BackupStats()
+        backup.backupDirectory(
+            first, "", source, settings, self._events, writer, stats=stats)
+        writer.close()
+        self.assertEqual(
+            os.stat(join(first, "a/b/bacon")).st_ino,
+            os.stat(join(first, "a/b/c/ham")).st_ino)
+        self.assertEqual(stats.getCounters()["hard_links"], 1)
+        reader = catalog.CatalogReader(catalogFile)
+        self.assertEqual(
+            reader.getHardLinks(), [["/a/b/bacon", "/a/b/c/ham"]])
+        reader.close()
+
+    def test_backupDirectory_recordsXattrs(self):
+        source = self._makeSourceTree()
+        bacon = join(source, "a/b/bacon")
+        cheese = join(source, "a/b/c/d/cheese")
+        os.setxattr(bacon, "user.taste", b"smoky")
+        os.setxattr(join(source, "a"), "user.taste", b"salty")
+        first = join(self._backupHome, "first")
+        second = join(self._backupHome, "second")
+        os.mkdir(first)
+        os.mkdir(second)
+        settings = self._getSettings(source)
+        writer = catalog.CatalogWriter(join(self._backupHome, "first.catalog"))
+        backup.backupDirectory(
+            first, "", source, settings, self._events, writer)
+        writer.close()
+        # Only the ctime of the file changes.
+        os.setxattr(cheese, "user.taste", b"sharp")
+        catalogFile = join(self._backupHome, "second.catalog")
+        writer = catalog.CatalogWriter(catalogFile)
+        backup.backupDirectory(
+            second, first, source, settings, self._events, writer)
+        writer.close()
+        reader = catalog.CatalogReader(catalogFile)
+        self.assertEqual(
+            reader.getXattrs("/a"),
+            {"/a": {"user.taste": b"salty"},
+             "/a/b": {},
+             "/a/b/bacon": {"user.taste": b"smoky"},
+             "/a/b/c": {},
+             "/a/b/c/d": {},
+             "/a/b/c/d/cheese": {"user.taste": b"sharp"}})
+        reader.close()
+        # Only the file whose attributes changed is copied again.
+        self.assertEqual(
+            os.stat(join(first, "a/b/bacon")).st_ino,
+            os.stat(join(second, "a/b/bacon")).st_ino)
+        self.assertNotEqual(
+            os.stat(join(first, "a/b/c/d/cheese")).st_ino,
+            os.stat(join(second, "a/b/c/d/cheese")).st_ino)
+        self.assertEqual(
+            os.getxattr(join(second, "a/b/c/d/cheese"), "user.taste"),
+            b"sharp")
+
+    def test_backupDirectory_takesDirectoryXattrsFromCatalog(self):
+        source = self._makeSourceTree()
+        first = join(self._backupHome, "first")
+        second = join(self._backupHome, "second")
+        os.mkdir(first)
+        os.mkdir(second)
+        settings = self._getSettings(source)
+        writer = catalog.CatalogWriter(first + ".catalog")
+        backup.backupDirectory(
+            first, "", source, settings, self._events, writer)
+        writer.close()
+        # The recorded attributes are used while the ctime is the same.
+        connection = sqlite3.connect(first + ".catalog")
+        with connection:
+            connection.execute(
+                "UPDATE entries SET xattrs = ? " +
+                "WHERE parent = '/' AND name = 'a'",
+                (catalog._encodeXattrs({"user.taste": b"salty"}),))
+        connection.close()
+        os.setxattr(join(source, "a/b/c"), "user.taste", b"sweet")
+        writer = catalog.CatalogWriter(second + ".catalog")
+        backup.backupDirectory(
+            second, first, source, settings, self._events, writer)
+        writer.close()
+        reader = catalog.CatalogReader(second + ".catalog")
+        xattrs = reader.getXattrs("/a")
+        reader.close()
+        self.assertEqual(xattrs["/a"], {"user.taste": b"salty"})
+        self.assertEqual(xattrs["/a/b/c"], {"user.taste": b"sweet"})
+        self.assertEqual(
+            os.getxattr(join(second, "a/b/c"), "user.taste"), b"sweet")
+
+    def test_backupDirectory_comparesAgainstPreviousCatalog(self):
+        source = self._makeSourceTree()
+        first = join(self._backupHome, "first")
+        second = join(self._backupHome, "second")
+        os.mkdir(first)
+        os.mkdir(second)
+        settings = self._getSettings(source)
+        writer = catalog.CatalogWriter(join(self._backupHome, "first.catalog"))
+        backup.backupDirectory(
+            first, "", source, settings, self._events, writer)
+        writer.close()
+        # Only the catalog is consulted, so changing the previous image
+        # doesn't cause the file to be copied.
+        os.utime(first + "/a/b/bacon", (1340664089, 1320861443))
+        os.remove(first + "/a/b/c/d/cheese")
+        backup.backupDirectory(second, first, source, settings, self._events)
+        self.assertEqual(
+            os.stat(first + "/a/b/bacon").st_ino,
+            os.stat(second + "/a/b/bacon").st_ino)
+        self.assertTrue(os.path.exists(second + "/a/b/c/d/cheese"))
+
+    def test_backupDirectory_chunksLargeFiles(self):
+        source = self._makeSourceTree()
+        with open(join(source, "a/big"), 'wb') as f:
+            f.write(os.urandom(3000))
+        first = join(self._backupHome, "first")
+        second = join(self._backupHome, "second")
+        os.mkdir(first)
+        os.mkdir(second)
+        settings = self._getSettings(source)
+        settings.chunkThreshold = 2048
+        settings.chunkSize = 1024
+        for image, previous in ((first, ""), (second, first)):
+            writer = catalog.CatalogWriter(image + ".catalog")
+            backup.backupDirectory(
+                image, previous, source, settings, self._events, writer)
+            writer.close()
+        self.assertTrue(chunks.isChunked(second + "/a/big"))
+        self.assertFalse(chunks.isChunked(second + "/a/b/bacon"))
+        self.assertEqual(
+            os.stat(first + "/a/big").st_ino,
+            os.stat(second + "/a/big").st_ino)
+        reader = catalog.CatalogReader(second + ".catalog")
+        self.assertEqual(
+            catalog.getStorage(reader.lookup("/a/big")), chunks.STORAGE)
+        reader.close()
+
+    def test_backupDirectory_comparesChecksumOfChunkedFiles(self):
+        source = self._makeSourceTree()
+        with open(join(source, "a/big"), 'wb') as f:
+            f.write(os.urandom(3000))
+        first = join(self._backupHome, "first")
+        second = join(self._backupHome, "second")
+        os.mkdir(first)
+        os.mkdir(second)
+        settings = self._getSettings(source)
+        settings.chunkThreshold = 2048
+        settings.chunkSize = 1024
+        settings.changeDetection = ("checksum",)
+        for image, previous in ((first, ""), (second, first)):
+            writer = catalog.CatalogWriter(image + ".catalog")
+            backup.backupDirectory(
+                image, previous, source, settings, self._events, writer)
+            writer.close()
+        self.assertEqual(
+            os.stat(first + "/a/big").st_ino,
+            os.stat(second + "/a/big").st_ino)
+
+    def test_backupDirectory_compressesFiles(self):
+        source = self._makeSourceTree()
+        with open(join(source, "a/notes.txt"), 'w') as f:
+            f.write("cheese\n" * 1000)
+        with open(join(source, "a/notes.gz"), 'w') as f:
+            f.write("cheese\n" * 1000)
+        first = join(self._backupHome, "first")
+        os.mkdir(first)
+        settings = self._getSettings(source)
+        settings.compression = "zlib"
+        writer = catalog.CatalogWriter(first + ".catalog")
+        backup.backupDirectory(
+            first, "", source, settings, self._events, writer)
+        writer.close()
+        self.assertLess(os.stat(first + "/a/notes.txt").st_size, 7000)
+        self.assertEqual(os.stat(first + "/a/notes.gz").st_size, 7000)
+        reader = catalog.CatalogReader(first + ".catalog")
+        self.assertEqual(
+            catalog.getStorage(reader.lookup("/a/notes.txt")), "zlib")
+        self.assertEqual(
+            catalog.getStorage(reader.lookup("/a/notes.gz")), None)
+        self.assertEqual(
+            catalog.getStorage(reader.lookup("/a/b/bacon")), None)
+        reader.close()
+
+    def test_backupDirectory_comparesChecksumOfFilesWithHeaders(self):
+        source = self._makeSourceTree()
+        headers = [storage._MAGIC[storage.ZLIB],
+                   storage._MAGIC[storage.LZMA], chunks.MAGIC]
+        for i, header in enumerate(headers):
+            with open(join(source, "a/header{0}".format(i)), 'wb') as f:
+                f.write(header + b"cheese\n")
+        first = join(self._backupHome, "first")
+        second = join(self._backupHome, "second")
+        os.mkdir(first)
+        os.mkdir(second)
+        settings = self._getSettings(source)
+        settings.changeDetection = ("checksum",)
+        for image, previous in ((first, ""), (second, first)):
+            writer = catalog.CatalogWriter(image + ".catalog")
+            backup.backupDirectory(
+                image, previous, source, settings, self._events, writer)
+            writer.close()
+        for i in range(len(headers)):
+            item = "/a/header{0}".format(i)
+            self.assertEqual(
+                os.stat(first + item).st_ino, os.stat(second + item).st_ino)
+
+    def test_backupDirectory_honorsIgnoreFiles(self):
+        source = self._makeSourceTree()
+        os.makedirs(join(source, "a/node_modules/x"))
+        os.makedirs(join(source, "a/b/node_modules"))
+        os.makedirs(join(source, "cache"))
+        touch(join(source, "a/b/debug.log"))
+        with open(join(source, ".caatignore"), 'w') as f:
+            f.write("node_modules/\n*.log\n")
+        with open(join(source, "a/b/.caatignore"), 'w') as f:
+            f.write("!node_modules\n")
+        with open(join(source, "cache/CACHEDIR.TAG"), 'w') as f:
+            f.write("Signature: 8a477f597d28d172789f06886806bc55\n")
+        first = join(self._backupHome, "first")
+        os.mkdir(first)
+        backup.backupDirectory(
+            first, "", source, self._getSettings(source), self._events)
+        self.assertTrue(os.path.exists(join(first, ".caatignore")))
+        self.assertFalse(os.path.exists(join(first, "a/node_modules")))
+        self.assertTrue(os.path.exists(join(first, "a/b/node_modules")))
+        self.assertFalse(os.path.exists(join(first, "a/b/debug.log")))
+        self.assertFalse(os.path.exists(join(first, "cache")))
+
+    def test_backupDirectory_clonesCleanDirectories(self):
+        source = self._makeSourceTree()
+        touch(join(source, "a/b/c/ham"))
+        first = join(self._backupHome, "first")
+        second = join(self._backupHome, "second")
+        os.mkdir(first)
+        os.mkdir(second)
+        settings = self._getSettings(source)
+        writer = catalog.CatalogWriter(first + ".catalog")
+        backup.backupDirectory(
+            first, "", source, settings, self._events, writer,
+            journal.Segment("cheese", 0, True, [], []))
+        writer.close()
+        os.utime(join(source, "a/b/bacon"), (1340664089, 1320861443))
+        os.utime(join(source, "a/b/c/ham"), (1340664089, 1320861443))
+        # Only a/b is listed in the journal, so the change to ham isn't seen.
+        segment = journal.Segment(
+            "cheese", 1, True, [join(source, "a/b")], [])
+        writer = catalog.CatalogWriter(second + ".catalog")
+        backup.backupDirectory(
+            second, first, source, settings, self._events, writer, segment)
+        writer.close()
+        self.assertNotEqual(
+            os.stat(first + "/a/b/bacon").st_ino,
+            os.stat(second + "/a/b/bacon").st_ino)
+        for item in ["/a/b/c/ham", "/a/b/c/d/cheese"]:
+            self.assertEqual(
+                os.stat(first + item).st_ino,
+                os.stat(second + item).st_ino)
+        self.assertEqual(os.readlink(second + "/link"), "a/b/bacon")
+        self.assertEqual(
+            os.stat(first + "/a/b/c").st_mtime_ns,
+            os.stat(second + "/a/b/c").st_mtime_ns)
+        reader = catalog.CatalogReader(second + ".catalog")
+        self.assertEqual(
+            reader.lookup("/a/b/c/d/cheese")["backup_ino"],
+            os.stat(second + "/a/b/c/d/cheese").st_ino)
+        self.assertEqual(reader.getInfo("journal_sequence"), "1")
+        reader.close()
+
+    def test_backupDirectory_backsUpHardLinksOfCleanDirectories(self):
+        source = self._makeSourceTree()
+        os.link(join(source, "a/b/bacon"), join(source, "a/b/c/d/ham"))
+        first = join(self._backupHome, "first")
+        second = join(self._backupHome, "second")
+        os.mkdir(first)
+        os.mkdir(second)
+        settings = self._getSettings(source)
+        writer = catalog.CatalogWriter(first + ".catalog")
+        backup.backupDirectory(
+            first, "", source, settings, self._events, writer,
+            journal.Segment("cheese", 0, True, [], []))
+        writer.close()
+        # Only a/b is listed in the journal, though ham changes with bacon.
+        with open(join(source, "a/b/bacon"), 'w') as f:
+            f.write("crispy")
+        segment = journal.Segment(
+            "cheese", 1, True, [join(source, "a/b")], [])
+        writer = catalog.CatalogWriter(second + ".catalog")
+        backup.backupDirectory(
+            second, first, source, settings, self._events, writer, segment)
+        writer.close()
+        with open(second + "/a/b/c/d/ham") as f:
+            self.assertEqual(f.read(), "crispy")
+        self.assertEqual(
+            os.stat(second + "/a/b/bacon").st_ino,
+            os.stat(second + "/a/b/c/d/ham").st_ino)
+        self.assertEqual(
+            os.stat(first + "/a/b/c/d/cheese").st_ino,
+            os.stat(second + "/a/b/c/d/cheese").st_ino)
+
+    def test_backupDirectory_scansRemountedCleanDirectories(self):
+        source = self._makeSourceTree()
+        first = join(self._backupHome, "first")
+        second = join(self._backupHome, "second")
+        os.mkdir(first)
+        os.mkdir(second)
+        settings = self._getSettings(source)
+        writer = catalog.CatalogWriter(first + ".catalog")
+        backup.backupDirectory(
+            first, "", source, settings, self._events, writer,
+            journal.Segment("cheese", 0, True, [], []))
+        writer.close()
+        # Record a/b/c/d as being on another file system, like a mount point
+        # that was unmounted since, showing the files below it.
+        connection = sqlite3.connect(first + ".catalog")
+        with connection:
+            connection.execute(
+                "UPDATE entries SET src_dev = src_dev + 1 " +
+                "WHERE parent = '/a/b/c' AND name = 'd'")
+        connection.close()
+        touch(join(source, "a/b/c/d/ham"))
+        segment = journal.Segment("cheese", 1, True, [], [])
+        writer = catalog.CatalogWriter(second + ".catalog")
+        backup.backupDirectory(
+            second, first, source, settings, self._events, writer, segment)
+        writer.close()
+        self.assertTrue(os.path.exists(second + "/a/b/c/d/ham"))
+        self.assertEqual(
+            os.stat(first + "/a/b/c/d/cheese").st_ino,
+            os.stat(second + "/a/b/c/d/cheese").st_ino)
+        self.assertEqual(
+            os.stat(first + "/a/b/bacon").st_ino,
+            os.stat(second + "/a/b/bacon").st_ino)
+
+    def test_backupDirectory_scansWhenJournalHasGap(self):
+        source = self._makeSourceTree()
+        first = join(self._backupHome, "first")
+        second = join(self._backupHome, "second")
+        os.mkdir(first)
+        os.mkdir(second)
+        settings = self._getSettings(source)
+        writer = catalog.CatalogWriter(first + ".catalog")
+        backup.backupDirectory(
+            first, "", source, settings, self._events, writer,
+            journal.Segment("cheese", 0, True, [], []))
+        writer.close()
+        os.utime(join(source, "a/b/c/d/cheese"), (1340664089, 1320861443))
+        backup.backupDirectory(
+            second, first, source, settings, self._events, None,
+            journal.Segment("cheese", 2, True, [], []))
+        self.assertNotEqual(
+            os.stat(first + "/a/b/c/d/cheese").st_ino,
+            os.stat(second + "/a/b/c/d/cheese").st_ino)
+
+    def test_backupDirectory_resumesPartialBackup(self):
+        source = self._makeSourceTree()
+        part = join(self._backupHome, "part")
+        os.mkdir(part)
+        with open(join(source, "a/b/bacon"), 'w') as f:
+            f.write("crispy")
+        settings = self._getSettings(source)
+        catalogFile = join(self._backupHome, "part.catalog")
+        writer = catalog.CatalogWriter(catalogFile)
+        backup.backupDirectory(
+            part, "", source, settings, self._events, writer)
+        writer.close()
+        reader = catalog.CatalogReader(catalogFile)
+        self.assertTrue({"/", "/a/b/c"} <= reader.getCompleted())
+        # Interrupt the backup while /a/b was still being copied.
+        connection = sqlite3.connect(catalogFile)
+        with connection:
+            connection.execute(
+                "DELETE FROM progress WHERE path IN ('/', '/a', '/a/b')")
+        connection.close()
+        with open(part + "/a/b/bacon", 'w') as f:
+            f.write("cri")
+        touch(join(source, "a/new"))
+        cheeseIno = os.stat(part + "/a/b/c/d/cheese").st_ino
+        linkIno = os.lstat(part + "/link").st_ino
+        stats = BackupStats()
+        writer = catalog.CatalogWriter(catalogFile)
+        backup.backupDirectory(
+            part, "", source, settings, self._events, writer, stats=stats,
+            resume=True)
+        writer.close()
+        with open(part + "/a/b/bacon") as f:
+            self.assertEqual(f.read(), "crispy")
+        self.assertEqual(os.stat(part + "/a/b/c/d/cheese").st_ino, cheeseIno)
+        self.assertEqual(os.lstat(part + "/link").st_ino, linkIno)
+        self.assertNotEqual(reader.lookup("/a/new"), None)
+        self.assertEqual(
+            reader.lookup("/a/b/bacon")["backup_ino"],
+            os.stat(part + "/a/b/bacon").st_ino)
+        self.assertEqual(stats.getCounters()["resumed"], 2)
+        self.assertEqual(stats.getCounters()["files_copied"], 2)
+        reader.close()
+
+    def test_backupDirectory_removesStaleItemsWhenResuming(self):
+        source = self._makeSourceTree()
+        part = join(self._backupHome, "part")
+        os.mkdir(part)
+        settings = self._getSettings(source)
+        catalogFile = join(self._backupHome, "part.catalog")
+        writer = catalog.CatalogWriter(catalogFile)
+        backup.backupDirectory(
+            part, "", source, settings, self._events, writer)
+        writer.close()
+        # Interrupt the backup while /a/b was still being copied.
+        connection = sqlite3.connect(catalogFile)
+        with connection:
+            connection.execute(
+                "DELETE FROM progress WHERE path IN ('/', '/a', '/a/b')")
+        connection.close()
+        rmtree(join(source, "a/b/c"))
+        os.remove(join(source, "a/b/bacon"))
+        # Written by the interrupted run without being recorded.
+        touch(part + "/a/b/ham")
+        writer = catalog.CatalogWriter(catalogFile)
+        backup.backupDirectory(
+            part, "", source, settings, self._events, writer, resume=True)
+        writer.close()
+        self.assertEqual(os.listdir(part + "/a/b"), [])
+        reader = catalog.CatalogReader(catalogFile)
+        for path in ["/a/b/bacon", "/a/b/c", "/a/b/c/d/cheese"]:
+            self.assertIsNone(reader.lookup(path))
+        self.assertIsNotNone(reader.lookup("/a/b"))
+        reader.close()
+
+    def test_getResumableBackup(self):
+        source = self._makeSourceTree()
+        part = join(self._backupHome, "2015-05-21-120000.part")
+        os.mkdir(part)
+        settings = self._getSettings(source)
+        writer = catalog.CatalogWriter(
+            catalog.getCatalogFile(self._backupHome, "2015-05-21-120000.part"))
+        backup.backupDirectory(
+            part, "", source, settings, self._events, writer)
+        writer.close()
+        self.assertEqual(
+            backup.getResumableBackup(self._backupHome, "", settings),
+            "2015-05-21-120000.part")
+        self.assertEqual(
+            backup.getResumableBackup(self._backupHome, "/other", settings),
+            None)
+        settings.ignored.add(join(source, "a"))
+        self.assertEqual(
+            backup.getResumableBackup(self._backupHome, "", settings),
+            None)
+
+    def _makeSourceTree(self):
+        source = join(self._backupHome, "source")
+        os.makedirs(join(source, "a/b/c/d"))
+        os.mkdir(join(source, "ignored"))
+        touch(join(source, "a/b/c/d/cheese"))
+        touch(join(source, "a/b/bacon"))
+        os.symlink("a/b/bacon", join(source, "link"))
+        return os.path.abspath(source)
+
+    def _getSettings(self, root):
+        settings = Settings()
+        settings.root = root
+        settings.ignored.add(join(root, "ignored"))
+        return settings
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Chris Taylor
+#
+# This file is part of caatinga.
+#
+# Caatinga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Caatinga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
+
+import errno
+import os
+import unittest
+import caatinga.caat.backup as backup
+import caatinga.caat_main as caat_main
+import caatinga.core.catalog as catalog
+import caatinga.core.events as events
+from caatinga.caat.stats import BackupStats
+from caatinga.core.settings import Settings
+from os.path import join
+from shutil import rmtree
+from testutils import touch
+
+
+class _FailingEventLog(events.NullEventLog):
+    """
+    Event log that fails the backup once a number of files were copied,
+    like a backup device returning I/O errors.
+    """
+
+    def __init__(self, copies):
+        self._copies = copies
+
+    def log(self, level, path, message=None):
+        if level == events.COPY:
+            if self._copies == 0:
+                raise OSError(errno.EIO, "Input/output error", path)
+            self._copies -= 1
+
+
+class CaatMainTestCase(unittest.TestCase):
+    """
+    Test case for running backups with caat.
+    """
+
+    _backupHome = "caat_main_test"
+
+    def setUp(self):
+        os.mkdir(self._backupHome)
+        self.bkHome = os.path.abspath(join(self._backupHome, "host"))
+        os.mkdir(self.bkHome)
+        self.lockFile = join(self._backupHome, "caat.pid")
+        self.source = os.path.abspath(join(self._backupHome, "source"))
+        os.makedirs(join(self.source, "a/b"))
+        for name in ["bacon", "cheese", "ham", "spam"]:
+            touch(join(self.source, "a", name))
+        touch(join(self.source, "a/b/eggs"))
+        self.settings = Settings()
+        self.settings.root = self.source
+        self.settings.backupgid = os.getgid()
+
+    def tearDown(self):
+        rmtree(self._backupHome)
+
+    def test_executeBackup_resumesFailedBackup(self):
+        self.assertRaises(
+            OSError, caat_main.executeBackup, self.bkHome, "",
+            self.settings, _FailingEventLog(3), self.lockFile)
+        resumable = backup.getResumableBackup(self.bkHome, "", self.settings)
+        self.assertIsNotNone(resumable)
+        stats = BackupStats()
+        backupRoot = caat_main.executeBackup(
+            self.bkHome, "", self.settings, events.NullEventLog(),
+            self.lockFile, stats, resumable)
+        self.assertEqual(stats.getCounters()["resumed"], 3)
+        self.assertEqual(stats.getCounters()["files_copied"], 2)
+        self.assertTrue(os.path.exists(backupRoot + "/a/b/eggs"))
+
+    def test_executeBackup_keepsExistingBackup(self):
+        self.assertRaises(
+            OSError, caat_main.executeBackup, self.bkHome, "",
+            self.settings, _FailingEventLog(3), self.lockFile)
+        resumable = backup.getResumableBackup(self.bkHome, "", self.settings)
+        backupName = resumable.replace(".part", "")
+        os.mkdir(join(self.bkHome, backupName))
+        existing = catalog.getCatalogFile(self.bkHome, backupName)
+        with open(existing, 'w') as f:
+            f.write("cheddar")
+        self.assertRaises(
+            Exception, caat_main.executeBackup, self.bkHome, "",
+            self.settings, events.NullEventLog(), self.lockFile, None,
+            resumable)
+        with open(existing) as f:
+            self.assertEqual(f.read(), "cheddar")
+        self.assertTrue(os.path.isdir(join(self.bkHome, resumable)))
+        self.assertTrue(os.path.exists(
+            catalog.getCatalogFile(self.bkHome, resumable)))
+
+if __name__ == '__main__':
+    unittest.main()
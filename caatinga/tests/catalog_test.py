@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Chris Taylor
+#
+# This file is part of caatinga.
+#
+# Caatinga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Caatinga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import unittest
+import caatinga.core.catalog as catalog
+from os.path import join, exists
+from shutil import rmtree
+from testutils import touch
+
+
+class CatalogTestCase(unittest.TestCase):
+    """
+    Test case for testing the backup catalog.
+    """
+
+    _backupHome = "catalog_test"
+
+    def setUp(self):
+        os.mkdir(self._backupHome)
+        touch(join(self._backupHome, "cheese"))
+        self.st = os.stat(join(self._backupHome, "cheese"))
+        self.catalogFile = catalog.getCatalogFile(self._backupHome, "backup")
+        writer = catalog.CatalogWriter(self.catalogFile)
+        writer.add("/", catalog.DIRECTORY, self.st)
+        writer.add("/foo", catalog.DIRECTORY, self.st)
+        writer.add("/foo/bar", catalog.FILE, self.st, 42)
+        writer.add("/foo/baz", catalog.LINK, self.st, target="bar")
+        writer.add("/foo/sub", catalog.DIRECTORY, self.st)
+        writer.add("/foo/sub/deep", catalog.FILE, self.st, 43)
+        writer.add("/food", catalog.FILE, self.st, 44)
+        writer.close()
+        self.reader = catalog.CatalogReader(self.catalogFile)
+
+    def tearDown(self):
+        self.reader.close()
+        rmtree(self._backupHome)
+
+    def test_getCatalogFile(self):
+        self.assertEqual(
+            catalog.getCatalogFile("/mnt/Backups.backupdb/foo", "backup"),
+            "/mnt/Backups.backupdb/foo/backup.catalog")
+
+    def test_lookup(self):
+        row = self.reader.lookup("/foo/bar")
+        self.assertEqual(row["backup_ino"], 42)
+        self.assertEqual(row["mtime_ns"], self.st.st_mtime_ns)
+        self.assertEqual(row["src_ino"], self.st.st_ino)
+        self.assertTrue(catalog.isFile(row))
+        self.assertEqual(catalog.getPath(row), "/foo/bar")
+
+    def test_lookupRoot(self):
+        row = self.reader.lookup("/")
+        self.assertTrue(catalog.isDirectory(row))
+        self.assertEqual(catalog.getPath(row), "/")
+
+    def test_lookupMissingItem(self):
+        self.assertEqual(self.reader.lookup("/foo/nothing"), None)
+
+    def test_listDirectory(self):
+        items = self.reader.listDirectory("/foo")
+        self.assertEqual(sorted(items.keys()), ["bar", "baz", "sub"])
+        self.assertEqual(items["baz"]["target"], "bar")
+
+    def test_iterEntries(self):
+        paths = [catalog.getPath(r) for r in self.reader.iterEntries("/foo")]
+        self.assertEqual(
+            paths,
+            ["/foo/bar", "/foo/baz", "/foo/sub", "/foo/sub/deep"])
+
+    def test_removeEntries(self):
+        catalog.removeEntries(self.catalogFile, "/foo")
+        self.assertEqual(self.reader.lookup("/foo"), None)
+        self.assertEqual(self.reader.lookup("/foo/sub/deep"), None)
+        self.assertNotEqual(self.reader.lookup("/food"), None)
+
+    def test_mergeParts(self):
+        writer = catalog.CatalogWriter(self.catalogFile)
+        part = writer.forProcess(1234)
+        part.add("/foo/part", catalog.FILE, self.st, 45)
+        part.close()
+        writer.mergeParts()
+        writer.close()
+        self.assertEqual(self.reader.lookup("/foo/part")["backup_ino"], 45)
+        self.assertFalse(exists(self.catalogFile + ".1234"))
+
+    def test_mergePartsWithProgress(self):
+        writer = catalog.CatalogWriter(self.catalogFile)
+        part = writer.forProcess(1234)
+        part.markComplete("/foo/sub")
+        # An interrupted process leaves its write ahead log behind.
+        part.commit()
+        writer.mergeParts()
+        self.assertEqual(self.reader.getCompleted(), {"/foo/sub"})
+        self.assertEqual(
+            [p for p in os.listdir(self._backupHome) if "1234" in p], [])
+        writer.close()
+
+    def test_progressIsWrittenWithItems(self):
+        writer = catalog.CatalogWriter(self.catalogFile)
+        writer.add("/foo/new", catalog.FILE, self.st, 46)
+        writer.markComplete("/foo")
+        self.assertEqual(self.reader.getCompleted(), set())
+        writer.commit()
+        self.assertEqual(self.reader.getCompleted(), {"/foo"})
+        self.assertEqual(self.reader.lookup("/foo/new")["backup_ino"], 46)
+        writer.clearProgress()
+        writer.close()
+        self.assertEqual(self.reader.getCompleted(), set())
+
+    def test_getHardLinks(self):
+        os.link(join(self._backupHome, "cheese"),
+                join(self._backupHome, "cheddar"))
+        st = os.stat(join(self._backupHome, "cheese"))
+        writer = catalog.CatalogWriter(self.catalogFile)
+        writer.add("/foo/cheese", catalog.FILE, st, 45)
+        writer.add("/foo/sub/cheddar", catalog.FILE, st, 45)
+        writer.add("/cheddar", catalog.FILE, st, 45)
+        writer.close()
+        self.assertEqual(
+            self.reader.getHardLinks("/foo"),
+            [["/foo/cheese", "/foo/sub/cheddar"]])
+        self.assertEqual(self.reader.lookup("/cheddar")["nlink"], 2)
+        self.assertEqual(self.reader.lookup("/cheddar")["src_dev"], st.st_dev)
+
+    def test_getXattrs(self):
+        writer = catalog.CatalogWriter(self.catalogFile)
+        writer.add("/foo", catalog.DIRECTORY, self.st,
+                   xattrs={"user.cheese": b"brie"})
+        writer.add("/foo/bar", catalog.FILE, self.st, 42,
+                   xattrs={"user.a": b"\0\1", "security.selinux": b"x"})
+        writer.add("/foo/sub/deep", catalog.FILE, self.st, 43, xattrs={})
+        writer.add("/food", catalog.FILE, self.st, 44, xattrs={"user.b": b""})
+        writer.close()
+        self.assertEqual(
+            self.reader.getXattrs("/foo"),
+            {"/foo": {"user.cheese": b"brie"},
+             "/foo/bar": {"user.a": b"\0\1", "security.selinux": b"x"},
+             "/foo/sub/deep": {}})
+        self.assertEqual(self.reader.getXattrs("/foo/bar"),
+                         {"/foo/bar": {"user.a": b"\0\1",
+                                       "security.selinux": b"x"}})
+        self.assertEqual(catalog.getXattrs(self.reader.lookup("/foo/sub")),
+                         None)
+
+    def test_renameAndRemoveCatalog(self):
+        catalog.renameCatalog(self._backupHome, "backup", "backup.delete")
+        renamed = catalog.getCatalogFile(self._backupHome, "backup.delete")
+        self.assertTrue(exists(renamed))
+        catalog.removeCatalog(self._backupHome, "backup.delete")
+        self.assertFalse(exists(renamed))
+
+    def test_renameAndRemoveCatalog_includesStats(self):
+        with open(catalog.getStatsFile(self._backupHome, "backup"), 'w'):
+            pass
+        catalog.renameCatalog(self._backupHome, "backup", "backup.delete")
+        renamed = catalog.getStatsFile(self._backupHome, "backup.delete")
+        self.assertTrue(exists(renamed))
+        catalog.removeCatalog(self._backupHome, "backup.delete")
+        self.assertFalse(exists(renamed))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Chris Taylor
+#
+# This file is part of caatinga.
+#
+# Caatinga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Caatinga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import threading
+import unittest
+import caatinga.caat.maintenance as maint
+import caatinga.core.catalog as catalog
+import caatinga.core.chunks as chunks
+import caatinga.core.storage as storage
+from os.path import join
+from shutil import rmtree
+
+CHUNK_SIZE = 1024
+
+
+class ChunkStoreTestCase(unittest.TestCase):
+    """
+    Test case for storing large files as chunks.
+    """
+
+    _backupHome = "chunks_test"
+
+    def setUp(self):
+        os.mkdir(self._backupHome)
+        os.mkdir(join(self._backupHome, "2015-01-01-000000"))
+        self.store = chunks.ChunkStore(
+            chunks.getChunkStoreHome(self._backupHome), CHUNK_SIZE, 1)
+
+    def tearDown(self):
+        rmtree(self._backupHome)
+
+    def _write(self, name, content, mtime=1320861443):
+        fileName = join(self._backupHome, name)
+        with open(fileName, 'wb') as f:
+            f.write(content)
+        os.utime(fileName, (mtime, mtime))
+        return fileName, os.stat(fileName)
+
+    def _backup(self, name, content):
+        src, st = self._write(name, content)
+        dest = join(self._backupHome, "2015-01-01-000000", name)
+        self.store.writeFile(src, dest, st)
+        return dest
+
+    def _countChunks(self):
+        return sum(len(files) for _, _, files
+                   in os.walk(self.store.home))
+
+    def test_writeFileCreatesManifest(self):
+        dest = self._backup("disk", os.urandom(CHUNK_SIZE * 2 + 10))
+        size, digests = chunks.readManifest(dest)
+        self.assertEqual(size, CHUNK_SIZE * 2 + 10)
+        self.assertEqual(len(digests), 3)
+        self.assertTrue(chunks.isChunked(dest))
+
+    def test_writeFileKeepsMetadata(self):
+        dest = self._backup("disk", b"cheese")
+        self.assertEqual(os.stat(dest).st_mtime, 1320861443)
+
+    def test_unchangedChunksAreShared(self):
+        data = bytearray(os.urandom(CHUNK_SIZE * 4))
+        self._backup("disk", bytes(data))
+        data[CHUNK_SIZE + 1] ^= 0xFF
+        self._backup("disk2", bytes(data))
+        self.assertEqual(self._countChunks(), 5)
+
+    def test_storeSameChunksFromThreads(self):
+        content = b"\0" * CHUNK_SIZE * 64
+        errors = []
+
+        def store():
+            try:
+                for offset in range(0, len(content), CHUNK_SIZE):
+                    self.store._store(content[offset:offset + CHUNK_SIZE])
+            except OSError as ex:
+                errors.append(ex)
+
+        threads = [threading.Thread(target=store) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        digest = self.store._store(content[:CHUNK_SIZE])
+        with open(self.store.getChunkFile(digest), 'rb') as f:
+            self.assertEqual(f.read(), content[:CHUNK_SIZE])
+        bucket = os.path.dirname(self.store.getChunkFile(digest))
+        self.assertEqual(os.listdir(bucket), [digest])
+
+    def test_restoreFileReassemblesContents(self):
+        data = os.urandom(CHUNK_SIZE * 3 + 1)
+        dest = self._backup("disk", data)
+        restored = join(self._backupHome, "restored")
+        storage.restoreFile(
+            dest, restored, self._backupHome, encoding=chunks.STORAGE)
+        with open(restored, 'rb') as f:
+            self.assertEqual(f.read(), data)
+        self.assertEqual(os.stat(restored).st_mtime, 1320861443)
+
+    def test_openFileReadsPlainFiles(self):
+        src, _ = self._write("plain", b"bacon")
+        with storage.openFile(src, None, self._backupHome) as f:
+            self.assertEqual(f.read(), b"bacon")
+
+    def test_openFileReadsPlainFileThatLooksChunked(self):
+        src, _ = self._write("plain", chunks.MAGIC + b"size 5\n")
+        with storage.openFile(src, None, self._backupHome) as f:
+            self.assertEqual(f.read(), chunks.MAGIC + b"size 5\n")
+
+    def test_deleteUnreferencedChunks(self):
+        dest = self._backup("disk", os.urandom(CHUNK_SIZE * 2))
+        self._backup("gone", os.urandom(CHUNK_SIZE))
+        writer = catalog.CatalogWriter(
+            catalog.getCatalogFile(self._backupHome, "2015-01-01-000000"))
+        writer.add("/disk", catalog.FILE, os.stat(dest),
+                   os.stat(dest).st_ino, storage=chunks.STORAGE)
+        writer.close()
+        maint.deleteUnreferencedChunks(self._backupHome, lambda x: None)
+        self.assertEqual(self._countChunks(), 2)
+
+    def test_deleteUnreferencedChunksNeedsCatalogs(self):
+        self._backup("disk", os.urandom(CHUNK_SIZE))
+        maint.deleteUnreferencedChunks(self._backupHome, lambda x: None)
+        self.assertEqual(self._countChunks(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Chris Taylor
+#
+# This file is part of caatinga.
+#
+# Caatinga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Caatinga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import os
+import unittest
+import caatinga.core.copier as copier
+from os.path import join
+from shutil import rmtree
+
+
+class CopierTestCase(unittest.TestCase):
+    """
+    Test case for testing the file copy engine.
+    """
+
+    _backupHome = "copier_test"
+
+    def setUp(self):
+        os.mkdir(self._backupHome)
+        self.src = join(self._backupHome, "src")
+        self.dest = join(self._backupHome, "dest")
+        self.content = os.urandom(3 * 1024 * 1024 + 17)
+        with open(self.src, 'wb') as f:
+            f.write(self.content)
+        os.chmod(self.src, 0o640)
+        os.utime(self.src, ns=(1340664089123456789, 1320861443987654321))
+
+    def tearDown(self):
+        rmtree(self._backupHome)
+
+    def _getContent(self, fileName):
+        with open(fileName, 'rb') as f:
+            return f.read()
+
+    def test_copyFile_copiesContent(self):
+        copier.copyFile(self.src, self.dest)
+        self.assertEqual(self._getContent(self.dest), self.content)
+
+    def test_copyFile_copiesMetadata(self):
+        st = copier.copyFile(self.src, self.dest)
+        self.assertEqual(st.st_mode & 0o7777, 0o640)
+        self.assertEqual(st.st_mtime_ns, 1320861443987654321)
+        self.assertEqual(st.st_size, len(self.content))
+
+    def test_copyFile_replacesExistingFile(self):
+        with open(self.dest, 'wb') as f:
+            f.write(b"x" * (len(self.content) * 2))
+        copier.copyFile(self.src, self.dest)
+        self.assertEqual(self._getContent(self.dest), self.content)
+
+    def test_copyFile_digestsContent(self):
+        digest = hashlib.sha256()
+        copier.copyFile(self.src, self.dest, digest=digest)
+        self.assertEqual(self._getContent(self.dest), self.content)
+        self.assertEqual(
+            digest.hexdigest(), hashlib.sha256(self.content).hexdigest())
+
+    def test_copyFile_appliesProvidedXattrs(self):
+        try:
+            os.setxattr(self.src, "user.taste", b"smoky")
+        except OSError:
+            self.skipTest("File system doesn't support extended attributes.")
+        copier.copyFile(self.src, self.dest, xattrs={"user.taste": b"salty"})
+        self.assertEqual(os.getxattr(self.dest, "user.taste"), b"salty")
+
+    def test_copyWithBuffer(self):
+        srcFd = os.open(self.src, os.O_RDONLY)
+        destFd = os.open(self.dest, os.O_WRONLY | os.O_CREAT, 0o600)
+        try:
+            copier._copyWithBuffer(srcFd, destFd)
+        finally:
+            os.close(srcFd)
+            os.close(destFd)
+        self.assertEqual(self._getContent(self.dest), self.content)
+
+    def test_copyData_copiesLength(self):
+        srcFd = os.open(self.src, os.O_RDONLY)
+        destFd = os.open(self.dest, os.O_WRONLY | os.O_CREAT, 0o600)
+        try:
+            copier.copyData(srcFd, destFd, 1024 * 1024 + 5)
+        finally:
+            os.close(srcFd)
+            os.close(destFd)
+        self.assertEqual(
+            self._getContent(self.dest), self.content[:1024 * 1024 + 5])
+
+    def test_copyWithKernel_triesNextMethodWhenNothingIsCopied(self):
+        self.assertEqual(copier._copyWithKernel(lambda count: 0, 100), 100)
+
+    def test_copyWithKernel_stopsAtEndOfFile(self):
+        sizes = iter([60, 0])
+        self.assertEqual(
+            copier._copyWithKernel(lambda count: next(sizes), 100), 0)
+
+    def test_copyFile_copiesFileOfPseudoFileSystem(self):
+        src = "/proc/self/mountinfo"
+        if not os.path.exists(src):
+            self.skipTest("No procfs.")
+        copier.copyFile(src, self.dest)
+        self.assertNotEqual(self._getContent(self.dest), b"")
+
+    def test_copyFile_keepsHoles(self):
+        size = 64 * 1024 * 1024
+        with open(self.src, 'wb') as f:
+            f.truncate(size)
+            f.seek(size // 2)
+            f.write(self.content)
+        if not copier.isSparse(os.stat(self.src)):
+            self.skipTest("File system doesn't support sparse files.")
+        st = copier.copyFile(self.src, self.dest)
+        self.assertEqual(st.st_size, size)
+        self.assertLess(st.st_blocks * 512, size // 4)
+        content = self._getContent(self.dest)
+        self.assertEqual(content[size // 2:size // 2 + 10], self.content[:10])
+        self.assertEqual(content.count(b"\0", 0, size // 2), size // 2)
+
+    def test_copyFile_digestsHoles(self):
+        size = 16 * 1024 * 1024
+        with open(self.src, 'wb') as f:
+            f.truncate(size)
+            f.seek(size // 2)
+            f.write(self.content)
+        digest = hashlib.sha256()
+        copier.copyFile(self.src, self.dest, digest=digest)
+        self.assertEqual(
+            digest.hexdigest(),
+            hashlib.sha256(self._getContent(self.src)).hexdigest())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Chris Taylor
+#
+# This file is part of caatinga.
+#
+# Caatinga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Caatinga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import unittest
+import caatinga.core.dirfd as dirfd
+from os.path import join
+from shutil import rmtree
+from testutils import touch
+
+
+class DirfdTestCase(unittest.TestCase):
+    """
+    Test suite for accessing items relative to open directories.
+    """
+
+    _testDir = "dirfd_test"
+
+    def setUp(self):
+        os.makedirs(join(self._testDir, "cheese"))
+        touch(join(self._testDir, "bacon"))
+        os.symlink("bacon", join(self._testDir, "link"))
+        os.symlink("nothing", join(self._testDir, "broken"))
+
+    def tearDown(self):
+        rmtree(self._testDir)
+
+    def test_scanDirectory(self):
+        entries = dict((e.name, e) for e in dirfd.scanDirectory(self._testDir))
+        self.assertEqual(
+            sorted(entries), ["bacon", "broken", "cheese", "link"])
+        bacon = entries["bacon"]
+        self.assertEqual(bacon.path, join(self._testDir, "bacon"))
+        self.assertEqual(
+            bacon.stat().st_ino, os.lstat(join(self._testDir, "bacon")).st_ino)
+        self.assertTrue(bacon.is_file(follow_symlinks=False))
+        self.assertTrue(entries["cheese"].is_dir(follow_symlinks=False))
+        self.assertTrue(entries["link"].is_symlink())
+        self.assertTrue(entries["link"].is_file())
+        self.assertFalse(entries["link"].is_file(follow_symlinks=False))
+        self.assertFalse(entries["broken"].is_file())
+
+    def test_directoryFdIsClosedWhenReleased(self):
+        directory = dirfd.DirectoryFd(self._testDir)
+        fd = directory.fd
+        self.assertEqual(directory.item("bacon"), ("bacon", fd))
+        directory.acquire()
+        directory.release()
+        os.fstat(fd)
+        directory.release()
+        self.assertRaises(OSError, os.fstat, fd)
+        self.assertEqual(
+            directory.item("bacon"), (join(self._testDir, "bacon"), None))
+
+    def test_directoryFdUsesPathWhenTooManyAreOpen(self):
+        directories = [dirfd.DirectoryFd(self._testDir)
+                       for _ in range(dirfd._MAX_OPEN_DIRECTORIES)]
+        extra = dirfd.DirectoryFd(self._testDir)
+        self.assertEqual(extra.fd, None)
+        self.assertEqual(
+            extra.item("bacon"), (join(self._testDir, "bacon"), None))
+        for directory in directories:
+            directory.release()
+        extra.release()
+        directory = dirfd.DirectoryFd(self._testDir)
+        self.assertNotEqual(directory.fd, None)
+        directory.release()
+
+    def test_directoryFdUsesPathWhenMissing(self):
+        missing = join(self._testDir, "missing")
+        directory = dirfd.DirectoryFd(missing)
+        self.assertEqual(
+            directory.item("bacon"), (join(missing, "bacon"), None))
+        directory.release()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Chris Taylor
+#
+# This file is part of caatinga.
+#
+# Caatinga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Caatinga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import unittest
+import caatinga.core.copier as copier
+import caatinga.core.durability as durability
+from os.path import join
+from shutil import rmtree
+
+
+class DurabilityTestCase(unittest.TestCase):
+    """
+    Test suite for syncing backups to the backup device.
+    """
+
+    _testDir = "durability_test"
+
+    def setUp(self):
+        os.mkdir(self._testDir)
+
+    def tearDown(self):
+        durability.setMode(durability.NONE)
+        rmtree(self._testDir)
+
+    def test_noneDoesNotSync(self):
+        missing = join(self._testDir, "missing")
+        durability.syncDirectory(missing)
+        durability.syncFileSystem(missing)
+
+    def test_commitSyncsDirectories(self):
+        durability.setMode(durability.COMMIT)
+        durability.syncFileSystem(self._testDir)
+        durability.syncDirectory(self._testDir)
+        self.assertRaises(
+            OSError, durability.syncDirectory, join(self._testDir, "missing"))
+
+    def test_paranoidSyncsFiles(self):
+        src = join(self._testDir, "cheese")
+        with open(src, 'w') as f:
+            f.write("cheddar")
+        fd = os.open(src, os.O_RDONLY)
+        os.close(fd)
+        # A closed file can't be synced, which shows whether it's tried.
+        durability.setMode(durability.COMMIT)
+        durability.syncFile(fd)
+        durability.setMode(durability.PARANOID)
+        self.assertRaises(OSError, durability.syncFile, fd)
+        copier.copyFile(src, join(self._testDir, "brie"))
+        with open(join(self._testDir, "brie")) as f:
+            self.assertEqual(f.read(), "cheddar")
+
+if __name__ == '__main__':
+    unittest.main()
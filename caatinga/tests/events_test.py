@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Chris Taylor
+#
+# This file is part of caatinga.
+#
+# Caatinga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Caatinga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+import threading
+import unittest
+import caatinga.core.events as events
+from caatinga.core.settings import Settings
+from glob import glob
+
+
+class EventsTestCase(unittest.TestCase):
+    """
+    Test suite for the event log written during a backup.
+    """
+
+    _logFile = "events_test.log"
+
+    def setUp(self):
+        self.settings = Settings()
+        self.settings.eventLog = self._logFile
+
+    def tearDown(self):
+        for logFile in glob(self._logFile + "*"):
+            os.remove(logFile)
+
+    def test_disabledLogIgnoresEvents(self):
+        self.settings.eventLog = ""
+        eventLog = events.openEventLog(self.settings, False)
+        eventLog.log(events.COPY, "/etc/fstab")
+        eventLog.close()
+        self.assertFalse(eventLog.isEnabled)
+        self.assertFalse(os.path.exists(self._logFile))
+
+    def test_writesJsonLines(self):
+        with events.openEventLog(self.settings, False) as eventLog:
+            eventLog.log(events.COPY, "/etc/fstab")
+            eventLog.log(events.ERROR, "/etc/shadow", "Unable to copy")
+        records = self._readRecords()
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[0]["level"], events.COPY)
+        self.assertEqual(records[0]["path"], "/etc/fstab")
+        self.assertEqual(records[1]["message"], "Unable to copy")
+
+    def test_writesText(self):
+        self.settings.eventLogFormat = events.TEXT
+        with events.openEventLog(self.settings, False) as eventLog:
+            eventLog.log(events.LINK, "/etc/hosts")
+        with open(self._logFile) as f:
+            self.assertEqual(f.read(), "Linking: /etc/hosts\n")
+
+    def test_samplesEvents(self):
+        self.settings.eventLogMode = events.SAMPLE
+        self.settings.eventLogSample = 10
+        with events.openEventLog(self.settings, False) as eventLog:
+            for number in range(25):
+                eventLog.log(events.COPY, "/srv/{0}".format(number))
+            eventLog.log(events.ERROR, "/srv/bad")
+        records = self._readRecords()
+        self.assertEqual(
+            [r.get("path") for r in records],
+            ["/srv/0", "/srv/10", "/srv/20", "/srv/bad", None])
+        self.assertEqual(
+            records[-1]["counts"], {events.COPY: 25, events.ERROR: 1})
+
+    def test_writesOnlySummary(self):
+        self.settings.eventLogMode = events.SUMMARY
+        with events.openEventLog(self.settings, False) as eventLog:
+            for _ in range(3):
+                eventLog.log(events.IGNORE, "/tmp")
+        records = self._readRecords()
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]["level"], events.SUMMARY)
+        self.assertEqual(records[0]["counts"], {events.IGNORE: 3})
+
+    def test_rotatesLog(self):
+        self.settings.eventLogMaxSize = 200
+        self.settings.eventLogKeep = 2
+        with events.openEventLog(self.settings, False) as eventLog:
+            for number in range(20):
+                eventLog.log(events.COPY, "/srv/{0}".format(number))
+        self.assertEqual(
+            sorted(glob(self._logFile + "*")),
+            [self._logFile, self._logFile + ".1", self._logFile + ".2"])
+        for logFile in glob(self._logFile + "*"):
+            self.assertLessEqual(os.path.getsize(logFile), 200)
+        self.assertEqual(self._readRecords()[-1]["path"], "/srv/19")
+
+    def test_rotatesLogByBytes(self):
+        self.settings.eventLogFormat = events.TEXT
+        self.settings.eventLogMaxSize = 200
+        self.settings.eventLogKeep = 2
+        with events.openEventLog(self.settings, False) as eventLog:
+            for number in range(20):
+                eventLog.log(events.COPY, "/srv/p\u00e3o-{0}".format(number))
+        for logFile in glob(self._logFile + "*"):
+            self.assertLessEqual(os.path.getsize(logFile), 200)
+
+    def test_pausedStopsWriterThread(self):
+        threads = threading.active_count()
+        with events.openEventLog(self.settings, False) as eventLog:
+            eventLog.log(events.COPY, "/etc/fstab")
+            with eventLog.paused():
+                self.assertEqual(len(self._readRecords()), 1)
+                self.assertEqual(threading.active_count(), threads)
+                eventLog.log(events.LINK, "/etc/hosts")
+        records = self._readRecords()
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[1]["path"], "/etc/hosts")
+
+    def _readRecords(self):
+        with open(self._logFile) as f:
+            return [json.loads(line) for line in f]
+
+if __name__ == '__main__':
+    unittest.main()
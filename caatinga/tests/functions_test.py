@@ -19,11 +19,13 @@
 
 import os
 import unittest
+import caatinga.core.chunks as chunks
 import caatinga.core.functions as fn
 from os import sep
 from shutil import rmtree
 from os.path import join, exists
 from datetime import datetime
+from caatinga.caat.workers import BackupWorkers
 from testutils import touch
 
 
@@ -252,6 +254,16 @@ class FunctionsTestCase(unittest.TestCase):
         os.remove(src)
         os.remove(dest)
 
+    def test_setXattrs(self):
+        item = join(self._backupHome, "foo")
+        self.touch(item)
+        os.setxattr(item, "user.cheese", b"cheddar")
+        os.setxattr(item, "user.bacon", b"crispy")
+        fn.setXattrs(item, {"user.cheese": b"brie", "user.ham": b""})
+        self.assertEqual(
+            fn.getXattrs(item), {"user.cheese": b"brie", "user.ham": b""})
+        os.remove(item)
+
     def test_copyDir(self):
         src = join(self._backupHome, "foo")
         dest = join(self._backupHome, "bar")
@@ -263,6 +275,73 @@ class FunctionsTestCase(unittest.TestCase):
         fn.shutil.rmtree(src)
         fn.shutil.rmtree(dest)
 
+    def test_copyDirWithWorkers(self):
+        src = join(self._backupHome, "foo")
+        dest = join(self._backupHome, "bar")
+        deepDir = src + sep + "cheese" + sep + "beef"
+        os.makedirs(deepDir)
+        for i in range(20):
+            self.touch(deepDir + sep + "hotdog" + str(i))
+        os.utime(deepDir, (1340664089, 1320861443))
+        with BackupWorkers(4, minWorkers=1) as workers:
+            fn.copyDir(src, dest, workers=workers)
+        destDir = dest + sep + "cheese" + sep + "beef"
+        self.assertEqual(len(os.listdir(destDir)), 20)
+        self.assertEqual(os.stat(destDir).st_mtime, 1320861443)
+        fn.shutil.rmtree(src)
+        fn.shutil.rmtree(dest)
+
+    def test_isModified_sizeChanged(self):
+        item1 = join(self._backupHome, "item1")
+        item2 = join(self._backupHome, "item2")
+        self.touch(item1)
+        with open(item2, 'w') as f:
+            f.write("cheese")
+        os.utime(item1, (1340664089, 1320861443))
+        os.utime(item2, (1340664089, 1320861443))
+        self.assertTrue(fn.isModified(item1, item2))
+        self.assertFalse(
+            fn.isModified(item1, item2, changeDetection=["mtime_ns"]))
+
+    def test_isModified_checksum(self):
+        item1 = join(self._backupHome, "item1")
+        item2 = join(self._backupHome, "item2")
+        for item, content in [(item1, "cheese"), (item2, "bacon!")]:
+            with open(item, 'w') as f:
+                f.write(content)
+        self.assertTrue(
+            fn.isModified(item1, item2, changeDetection=["checksum"]))
+        with open(item2, 'w') as f:
+            f.write("cheese")
+        self.assertFalse(
+            fn.isModified(item1, item2, changeDetection=["checksum"]))
+
+    def test_isModified_checksumOfChunkedFile(self):
+        item1 = join(self._backupHome, "item1")
+        item2 = join(self._backupHome, "item2")
+        with open(item1, 'wb') as f:
+            f.write(os.urandom(3000))
+        store = chunks.ChunkStore(
+            chunks.getChunkStoreHome(self._backupHome), 1024, 2048)
+        store.writeFile(item1, item2, os.stat(item1))
+        self.assertFalse(fn.isModified(
+            item1, item2, None, os.stat(item1), ["checksum"],
+            self._backupHome, chunks.STORAGE))
+        with open(item1, 'r+b') as f:
+            f.write(b"cheese")
+        self.assertTrue(fn.isModified(
+            item1, item2, None, os.stat(item1), ["checksum"],
+            self._backupHome, chunks.STORAGE))
+
+    def test_getChangeDetection(self):
+        self.assertEqual(
+            fn.getChangeDetection("mtime_ns, size"),
+            ("mtime_ns", "size"))
+        self.assertEqual(
+            fn.getChangeDetection("+ctime,+inode"),
+            ("mtime_ns", "size", "ctime", "inode"))
+        self.assertEqual(fn.getChangeDetection("checksum"), ("checksum",))
+
     def test_removeAltRoot_noAlt(self):
         testFile = "/mnt/foo/bar"
         newRoot = fn.removeAltRoot("/", testFile)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Chris Taylor
+#
+# This file is part of caatinga.
+#
+# Caatinga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Caatinga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from caatinga.core.ignore import IgnoreMatcher, IgnoreRules
+
+
+class IgnoreMatcherTestCase(unittest.TestCase):
+    """
+    Test case for matching paths against ignore patterns.
+    """
+
+    def setUp(self):
+        self.matcher = IgnoreMatcher([
+            "/proc",
+            "/home/*/.cache",
+            "/var/log/*.gz",
+            "/srv/data/"])
+
+    def test_literalPaths(self):
+        self.assertTrue("/proc" in self.matcher)
+        self.assertTrue("/srv/data" in self.matcher)
+        self.assertFalse("/proc/1" in self.matcher)
+        self.assertFalse("/srv" in self.matcher)
+
+    def test_globPaths(self):
+        self.assertTrue("/home/chris/.cache" in self.matcher)
+        self.assertTrue("/var/log/syslog.1.gz" in self.matcher)
+        self.assertFalse("/home/chris/.config" in self.matcher)
+        self.assertFalse("/var/log/syslog" in self.matcher)
+
+    def test_wildcardsDontCrossDirectories(self):
+        self.assertFalse("/var/log/apt/history.gz" in self.matcher)
+
+    def test_wildcardsSkipHiddenNames(self):
+        self.assertFalse("/var/log/.old.gz" in self.matcher)
+        self.matcher.add("/var/log/.*")
+        self.assertTrue("/var/log/.old.gz" in self.matcher)
+
+    def test_literalAndGlobShareTrie(self):
+        self.matcher.add("/home/chris")
+        self.assertTrue("/home/chris" in self.matcher)
+        self.assertTrue("/home/chris/.cache" in self.matcher)
+
+    def test_patterns(self):
+        self.assertEqual(len(self.matcher), 4)
+        self.assertTrue("/proc" in list(self.matcher))
+
+
+class IgnoreRulesTestCase(unittest.TestCase):
+    """
+    Test case for the rules read from .caatignore files.
+    """
+
+    def setUp(self):
+        self.rules = IgnoreRules().extend("/src", [
+            "# Build output",
+            "",
+            "node_modules",
+            "target/",
+            "/build",
+            "docs/**/*.tmp",
+            "*.log",
+            "!keep.log"])
+
+    def test_namesMatchAtAnyDepth(self):
+        self.assertTrue(self.rules.isIgnored(
+            "/src/a/b/node_modules", "node_modules", True))
+        self.assertTrue(self.rules.isIgnored("/src/a/x.log", "x.log", False))
+
+    def test_directoryOnlyRules(self):
+        self.assertTrue(self.rules.isIgnored("/src/target", "target", True))
+        self.assertFalse(self.rules.isIgnored("/src/target", "target", False))
+
+    def test_anchoredRules(self):
+        self.assertTrue(self.rules.isIgnored("/src/build", "build", True))
+        self.assertFalse(self.rules.isIgnored("/src/a/build", "build", True))
+        self.assertTrue(self.rules.isIgnored(
+            "/src/docs/a/b/x.tmp", "x.tmp", False))
+        self.assertFalse(self.rules.isIgnored("/other/build", "build", True))
+
+    def test_negatedRules(self):
+        self.assertFalse(self.rules.isIgnored(
+            "/src/keep.log", "keep.log", False))
+
+    def test_rulesStack(self):
+        rules = self.rules.extend("/src/a", ["!node_modules", "*.c"])
+        self.assertFalse(rules.isIgnored(
+            "/src/a/node_modules", "node_modules", True))
+        self.assertTrue(rules.isIgnored("/src/a/x.c", "x.c", False))
+        self.assertFalse(self.rules.isIgnored("/src/x.c", "x.c", False))
+
+    def test_emptyRules(self):
+        self.assertFalse(IgnoreRules())
+        self.assertFalse(IgnoreRules().extend("/src", ["# comment"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Chris Taylor
+#
+# This file is part of caatinga.
+#
+# Caatinga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Caatinga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import unittest
+import caatinga.core.journal as journal
+from caatinga.caatd.inotify import Inotify
+from caatinga.caatd.watcher import Watcher
+from caatinga.core.ignore import IgnoreMatcher
+from os.path import join
+from shutil import rmtree
+
+
+class JournalTestCase(unittest.TestCase):
+    """
+    Test case for writing and reading the change journal.
+    """
+
+    _journalDir = "journal_test"
+
+    def setUp(self):
+        os.mkdir(self._journalDir)
+        self.writer = journal.JournalWriter(self._journalDir, "cheese")
+
+    def tearDown(self):
+        rmtree(self._journalDir)
+
+    def _rotate(self):
+        self.writer.rotate()
+        return journal.Segment.read(join(self._journalDir, "rotated"))
+
+    def test_rotateEndsSegment(self):
+        self.writer.add(journal.DIRECTORY, "/home/chris")
+        self.writer.add(journal.TREE, "/srv/new")
+        segment = self._rotate()
+        self.assertTrue(segment.isComplete)
+        self.assertEqual(segment.session, "cheese")
+        self.assertEqual(segment.sequence, 0)
+        self.assertEqual(segment.directories, {"/home/chris"})
+        self.assertEqual(segment.trees, {"/srv/new"})
+        self.assertEqual(self._rotate().sequence, 1)
+
+    def test_overflowMakesSegmentIncomplete(self):
+        self.writer.overflow()
+        self.assertFalse(self._rotate().isComplete)
+        self.assertTrue(self._rotate().isComplete)
+
+    def test_unfinishedSegmentIsIncomplete(self):
+        self.writer.flush()
+        segment = journal.Segment.read(join(self._journalDir, "current"))
+        self.assertFalse(segment.isComplete)
+
+    def test_follows(self):
+        segment = self._rotate()
+        self.assertTrue(segment.follows("cheese", -1))
+        self.assertFalse(segment.follows("cheese", 0))
+        self.assertFalse(segment.follows("bacon", -1))
+
+    def test_isClean(self):
+        segment = journal.Segment(
+            "cheese", 1, True, ["/home/chris/src"], ["/srv/new"])
+        self.assertFalse(segment.isClean("/home/chris/src"))
+        self.assertFalse(segment.isClean("/home"))
+        self.assertFalse(segment.isClean("/srv/new/a/b"))
+        self.assertTrue(segment.isClean("/home/chris/src/a"))
+        self.assertTrue(segment.isClean("/home/chris/docs"))
+        self.assertFalse(segment.isClean("/srv"))
+        self.assertTrue(segment.isClean("/var"))
+
+    def test_takeSegmentWithoutDaemon(self):
+        self.assertEqual(journal.takeSegment(self._journalDir), None)
+
+
+class WatcherTestCase(unittest.TestCase):
+    """
+    Test case for recording changes seen through inotify.
+    """
+
+    _root = "watcher_test"
+
+    def setUp(self):
+        os.makedirs(join(self._root, "journal"))
+        os.makedirs(join(self._root, "src/a/b"))
+        self.root = os.path.abspath(join(self._root, "src"))
+        self.journalDir = join(self._root, "journal")
+        self.writer = journal.JournalWriter(self.journalDir, "cheese")
+        self.inotify = Inotify()
+        self.watcher = Watcher(
+            self.inotify, self.writer, IgnoreMatcher(), lambda x: x)
+        self.watcher.watchTree(self.root)
+
+    def tearDown(self):
+        self.inotify.close()
+        rmtree(self._root)
+
+    def _getSegment(self):
+        self.watcher.handleEvents(self.inotify.readEvents())
+        self.writer.rotate()
+        return journal.Segment.read(join(self.journalDir, "rotated"))
+
+    def test_changedFileMarksDirectory(self):
+        with open(join(self.root, "a/b/cheese"), 'w') as f:
+            f.write("bacon")
+        segment = self._getSegment()
+        self.assertEqual(segment.directories, {join(self.root, "a/b")})
+        self.assertTrue(segment.isClean(join(self.root, "a/c")))
+
+    def test_newDirectoryMarksTree(self):
+        os.mkdir(join(self.root, "a/new"))
+        segment = self._getSegment()
+        self.assertEqual(segment.trees, {join(self.root, "a/new")})
+        with open(join(self.root, "a/new/cheese"), 'w') as f:
+            f.write("bacon")
+        segment = self._getSegment()
+        self.assertEqual(segment.directories, {join(self.root, "a/new")})
+
+    def test_ignoreFileMarksTree(self):
+        with open(join(self.root, "a/.caatignore"), 'w') as f:
+            f.write("b\n")
+        self.assertEqual(
+            self._getSegment().trees, {join(self.root, "a")})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Chris Taylor
+#
+# This file is part of caatinga.
+#
+# Caatinga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Caatinga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import unittest
+import caatinga.caat.maintenance as maint
+import caatinga.core.functions as fn
+from caatinga.caat.objects import ObjectStore, getObjectStoreHome
+from os.path import join
+from shutil import rmtree
+
+
+class ObjectStoreTestCase(unittest.TestCase):
+    """
+    Test case for testing the content addressed object store.
+    """
+
+    _backupHome = "objects_test"
+
+    def setUp(self):
+        os.mkdir(self._backupHome)
+        os.mkdir(join(self._backupHome, "backup"))
+        self.store = ObjectStore(getObjectStoreHome(self._backupHome))
+
+    def tearDown(self):
+        rmtree(self._backupHome)
+
+    def _write(self, name, content, mtime=1320861443):
+        fileName = join(self._backupHome, name)
+        with open(fileName, 'w') as f:
+            f.write(content)
+        os.utime(fileName, (mtime, mtime))
+        return fileName, os.stat(fileName)
+
+    def _getObjects(self):
+        objects = []
+        for root, _, files in os.walk(getObjectStoreHome(self._backupHome)):
+            objects.extend(files)
+        return objects
+
+    def _backup(self, src, st, encoding=None):
+        dest = join(self._backupHome, "backup", os.path.basename(src))
+        self.store.backupFile(src, dest, st, encoding)
+        return os.stat(dest)
+
+    def test_identicalFilesAreLinked(self):
+        first = self._backup(*self._write("cheese", "bacon"))
+        second = self._backup(*self._write("renamed", "bacon"))
+        self.assertEqual(first.st_ino, second.st_ino)
+        self.assertEqual(second.st_nlink, 3)
+
+    def test_differentContentIsCopied(self):
+        first = self._backup(*self._write("cheese", "bacon"))
+        second = self._backup(*self._write("renamed", "beef"))
+        self.assertNotEqual(first.st_ino, second.st_ino)
+
+    def test_differentMetadataIsCopied(self):
+        first = self._backup(*self._write("cheese", "bacon"))
+        second = self._backup(*self._write("renamed", "bacon", 1340664089))
+        self.assertNotEqual(first.st_ino, second.st_ino)
+        self.assertEqual(second.st_mtime, 1340664089)
+
+    def test_differentXattrsAreCopied(self):
+        first = self._backup(*self._write("cheese", "bacon"))
+        src, st = self._write("renamed", "bacon")
+        os.setxattr(src, "user.taste", b"smoky")
+        second = self._backup(src, os.stat(src))
+        self.assertNotEqual(first.st_ino, second.st_ino)
+
+    def test_objectIsNamedAfterContents(self):
+        src, st = self._write("cheese", "bacon")
+        self._backup(src, st)
+        self.assertEqual(self._getObjects(), [fn.getDigest(src)])
+
+    def test_differentEncodingIsCopied(self):
+        first = self._backup(*self._write("cheese", "bacon"))
+        second = self._backup(*self._write("renamed", "bacon"), "zlib")
+        self.assertNotEqual(first.st_ino, second.st_ino)
+
+    def test_deleteUnreferencedObjects(self):
+        self._backup(*self._write("cheese", "bacon"))
+        self._backup(*self._write("beef", "jerky"))
+        os.remove(join(self._backupHome, "backup", "cheese"))
+        maint.deleteUnreferencedObjects(self._backupHome, lambda x: x)
+        self.assertEqual(len(self._getObjects()), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -37,11 +37,39 @@ class SettingsTestCase(unittest.TestCase):
         confFile.write("hostname = foobar\n")
         confFile.write("max_file_size = 10\n")
         confFile.write("max_images = 5\n")
+        confFile.write("backup_workers = 4\n")
+        confFile.write("adaptive_workers = yes\n")
+        confFile.write("min_backup_workers = 2\n")
+        confFile.write("max_backup_writes = 3\n")
+        confFile.write("backup_processes = 2\n")
+        confFile.write("durability = Paranoid\n")
+        confFile.write("change_detection = +ctime\n")
+        confFile.write("dedup = yes\n")
+        confFile.write("chunk_threshold = 100\n")
+        confFile.write("chunk_size = 512\n")
+        confFile.write("compression = LZMA\n")
+        confFile.write("compression_min_size = 8\n")
+        confFile.write("compression_skip = +.ISO, img\n")
+        confFile.write("event_log = /var/log/caatinga.log\n")
+        confFile.write("event_log_format = Text\n")
+        confFile.write("event_log_mode = sample\n")
+        confFile.write("event_log_sample = 50\n")
+        confFile.write("event_log_max_size = 10\n")
+        confFile.write("event_log_keep = 3\n")
+        confFile.write("max_read_rate = 1.5\n")
+        confFile.write("one_file_system = yes\n")
+        confFile.write("include_mount = /home/\n")
+        confFile.write("include_mount = /data\n")
+        confFile.write("max_write_rate = 20\n")
+        confFile.write("max_iops = 500\n")
+        confFile.write("io_class = Idle\n")
+        confFile.write("nice = 10\n")
         confFile.write("keep_days = 14\n")
         confFile.write("backup_location = /home\n")
         confFile.write("ignore = /var\n")
         confFile.write("ignore = /etc/group\n")
         confFile.write("ignore = /etc/passwd\n")
+        confFile.write("ignore = /tmp/*.log\n")
         confFile.write("backup_group = {0}\n".format(
             grp.getgrall()[0].gr_name))
         confFile.write("reduce_backups = yes\n")
@@ -77,6 +105,118 @@ class SettingsTestCase(unittest.TestCase):
             10485760,
             "Max file size not valid.")
 
+    def test_BackupWorkers(self):
+        self.assertEqual(
+            self.settings.backupWorkers,
+            4,
+            "Backup workers is not valid.")
+
+    def test_AdaptiveWorkers(self):
+        self.assertEqual(
+            (self.settings.adaptiveWorkers, self.settings.minBackupWorkers),
+            (True, 2),
+            "Adaptive workers are not valid.")
+
+    def test_MaxBackupWrites(self):
+        self.assertEqual(
+            self.settings.maxBackupWrites,
+            3,
+            "Max backup writes is not valid.")
+
+    def test_BackupProcesses(self):
+        self.assertEqual(
+            self.settings.backupProcesses,
+            2,
+            "Backup processes is not valid.")
+
+    def test_Durability(self):
+        self.assertEqual(
+            self.settings.durability,
+            "paranoid",
+            "Durability is not valid.")
+
+    def test_ChangeDetection(self):
+        self.assertEqual(
+            self.settings.changeDetection,
+            ("mtime_ns", "size", "ctime"),
+            "Change detection is not valid.")
+
+    def test_Dedup(self):
+        self.assertTrue(self.settings.dedup, "Dedup was not set")
+
+    def test_ChunkThreshold(self):
+        self.assertEqual(
+            self.settings.chunkThreshold,
+            100 * 1024 * 1024,
+            "Chunk threshold is not valid.")
+
+    def test_ChunkSize(self):
+        self.assertEqual(
+            self.settings.chunkSize,
+            512 * 1024,
+            "Chunk size is not valid.")
+
+    def test_Compression(self):
+        self.assertEqual(
+            self.settings.compression,
+            "lzma",
+            "Compression is not valid.")
+
+    def test_CompressionMinSize(self):
+        self.assertEqual(
+            self.settings.compressionMinSize,
+            8 * 1024,
+            "Compression min size is not valid.")
+
+    def test_CompressionSkip(self):
+        self.assertTrue(
+            {"iso", "img", "gz"} <= self.settings.compressionSkip,
+            "Compression skip is not valid.")
+
+    def test_EventLog(self):
+        self.assertEqual(
+            self.settings.eventLog,
+            "/var/log/caatinga.log",
+            "Event log is not valid.")
+
+    def test_EventLogFormat(self):
+        self.assertEqual(
+            self.settings.eventLogFormat,
+            "text",
+            "Event log format is not valid.")
+
+    def test_EventLogSampling(self):
+        self.assertEqual(
+            (self.settings.eventLogMode, self.settings.eventLogSample),
+            ("sample", 50),
+            "Event log sampling is not valid.")
+
+    def test_EventLogRotation(self):
+        self.assertEqual(
+            (self.settings.eventLogMaxSize, self.settings.eventLogKeep),
+            (10 * 1024 * 1024, 3),
+            "Event log rotation is not valid.")
+
+    def test_OneFileSystem(self):
+        self.assertEqual(
+            (self.settings.oneFileSystem, self.settings.includedMounts),
+            (True, {"/home", "/data"}),
+            "One file system is not valid.")
+
+    def test_MaxRates(self):
+        self.assertEqual(
+            (self.settings.maxReadRate, self.settings.maxWriteRate,
+             self.settings.maxIops),
+            (1536 * 1024, 20 * 1024 * 1024, 500),
+            "Rate limits are not valid.")
+
+    def test_Priority(self):
+        self.assertEqual(
+            (self.settings.ioClass, self.settings.ioPriority,
+             self.settings.nice),
+            ("idle", 4, 10),
+            "Priority is not valid.")
+
     def test_MaxImages(self):
         self.assertEqual(
             self.settings.maxImages,
@@ -95,17 +235,15 @@ class SettingsTestCase(unittest.TestCase):
             "/home",
             "Backup location not valid.")
 
-    def test_IgnoreDirectories(self):
-        for d in ["/home", "/var"]:
-            self.assertTrue(
-                self.settings.ignoredDirectories.count(d) == 1,
-                "Ignore directory list has an invalid entry.")
-
-    def test_IgnoreFiles(self):
-        for f in ["/etc/group", "/etc/passwd"]:
+    def test_Ignore(self):
+        for item in ["/home", "/var", "/etc/group", "/etc/passwd",
+                     "/tmp/new.log"]:
             self.assertTrue(
-                self.settings.ignoredFiles.count(f) == 1,
-                "Ignore file list has an invalid entry.")
+                item in self.settings.ignored,
+                "Ignore patterns are missing {0}.".format(item))
+        self.assertFalse(
+            "/etc/fstab" in self.settings.ignored,
+            "Ignore patterns match too much.")
 
     def test_BackupGroup(self):
         self.assertEqual(
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Chris Taylor
+#
+# This file is part of caatinga.
+#
+# Caatinga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Caatinga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+import threading
+import unittest
+from caatinga.caat.stats import BackupStats
+
+
+class StatsTestCase(unittest.TestCase):
+    """
+    Test suite for the counters and timers of a backup run.
+    """
+
+    _statsFile = "stats_test.json"
+
+    def tearDown(self):
+        if os.path.exists(self._statsFile):
+            os.remove(self._statsFile)
+
+    def test_addsCountersFromThreads(self):
+        stats = BackupStats()
+        threads = [threading.Thread(target=self._addFiles, args=(stats,))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(stats.getCounters()["files_copied"], 4000)
+
+    def _addFiles(self, stats):
+        for _ in range(1000):
+            stats.add("files_copied")
+
+    def test_timerAddsSeconds(self):
+        stats = BackupStats()
+        stats.addTime("copy", 1.5)
+        with stats.timer("copy"):
+            pass
+        self.assertGreaterEqual(stats.getTimers()["copy"], 1.5)
+        self.assertLess(stats.getTimers()["copy"], 2)
+
+    def test_mergesSnapshots(self):
+        stats = BackupStats()
+        shard = BackupStats()
+        stats.add("files_linked", 2)
+        shard.add("files_linked", 3)
+        shard.addTime("link", 0.5)
+        stats.merge(shard.snapshot())
+        self.assertEqual(stats.getCounters()["files_linked"], 5)
+        self.assertEqual(stats.getTimers()["link"], 0.5)
+
+    def test_writesJson(self):
+        stats = BackupStats()
+        stats.add("bytes_copied", 4096)
+        stats.addTime("backup", 2)
+        stats.finish()
+        stats.write(self._statsFile)
+        with open(self._statsFile) as f:
+            written = json.load(f)
+        self.assertEqual(written["counters"]["bytes_copied"], 4096)
+        self.assertEqual(written["counters"]["files_scanned"], 0)
+        self.assertEqual(written["timers"]["backup"], 2)
+        self.assertEqual(written["bytes_per_second"], 2048)
+
+    def test_summaryListsCounters(self):
+        stats = BackupStats()
+        stats.add("files_scanned", 12)
+        summary = stats.getSummary()
+        self.assertIn("Files scanned:", summary)
+        self.assertIn("12", summary)
+        self.assertIn("Throughput:", summary)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Chris Taylor
+#
+# This file is part of caatinga.
+#
+# Caatinga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Caatinga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import unittest
+import caatinga.core.chunks as chunks
+import caatinga.core.functions as fn
+import caatinga.core.storage as storage
+from os.path import join
+from shutil import rmtree
+
+CONTENT = b"cheese and bacon\n" * 1000
+
+
+class StorageTestCase(unittest.TestCase):
+    """
+    Test case for writing and reading compressed backup files.
+    """
+
+    _home = "storage_test"
+
+    def setUp(self):
+        os.mkdir(self._home)
+        self.src = join(self._home, "src")
+        with open(self.src, 'wb') as f:
+            f.write(CONTENT)
+        os.utime(self.src, (1320861443, 1320861443))
+
+    def tearDown(self):
+        rmtree(self._home)
+
+    def _write(self, encoding):
+        dest = join(self._home, "dest")
+        storage.writeFile(self.src, dest, os.stat(self.src), encoding)
+        return dest
+
+    def test_writeFileCompresses(self):
+        for encoding in storage.getCompressions():
+            dest = self._write(encoding)
+            self.assertLess(os.stat(dest).st_size, len(CONTENT))
+            self.assertEqual(os.stat(dest).st_mtime, 1320861443)
+
+    def test_writeFileWithoutEncodingCopies(self):
+        dest = self._write(None)
+        with open(dest, 'rb') as f:
+            self.assertEqual(f.read(), CONTENT)
+
+    def test_openFileDecompresses(self):
+        for encoding in storage.getCompressions():
+            with storage.openFile(self._write(encoding), encoding) as f:
+                self.assertEqual(f.read(), CONTENT)
+
+    def test_restoreFileDecompresses(self):
+        restored = join(self._home, "restored")
+        storage.restoreFile(
+            self._write(storage.ZLIB), restored, self._home,
+            encoding=storage.ZLIB)
+        with open(restored, 'rb') as f:
+            self.assertEqual(f.read(), CONTENT)
+        self.assertEqual(os.stat(restored).st_mtime, 1320861443)
+
+    def test_restoreFileKeepsHoles(self):
+        size = 16 * 1024 * 1024
+        with open(self.src, 'wb') as f:
+            f.write(CONTENT)
+            f.truncate(size)
+        restored = join(self._home, "restored")
+        storage.restoreFile(
+            self._write(storage.ZLIB), restored, self._home,
+            encoding=storage.ZLIB)
+        st = os.stat(restored)
+        self.assertEqual(st.st_size, size)
+        self.assertLess(st.st_blocks * 512, size // 4)
+        with open(restored, 'rb') as f:
+            self.assertEqual(f.read(len(CONTENT)), CONTENT)
+
+    def test_openFileDetectsTruncation(self):
+        dest = self._write(storage.LZMA)
+        os.truncate(dest, os.stat(dest).st_size - 10)
+        with storage.openFile(dest, storage.LZMA) as f:
+            self.assertRaises(IOError, f.read)
+
+    def test_getDigestDecodes(self):
+        dest = self._write(storage.ZLIB)
+        self.assertEqual(
+            fn.getDigest(self.src), fn.getDigest(dest, storage.ZLIB))
+        self.assertNotEqual(fn.getDigest(self.src), fn.getDigest(dest))
+
+    def test_plainFilesWithHeadersAreNotDecoded(self):
+        for header in [storage._MAGIC[storage.ZLIB],
+                       storage._MAGIC[storage.LZMA], chunks.MAGIC]:
+            with open(self.src, 'wb') as f:
+                f.write(header + CONTENT)
+            dest = self._write(None)
+            restored = join(self._home, "restored")
+            fn.copyFile(dest, restored, backupHome=self._home)
+            with open(restored, 'rb') as f:
+                self.assertEqual(f.read(), header + CONTENT)
+            self.assertFalse(fn.isModified(
+                self.src, dest, changeDetection=["checksum"],
+                backupHome=self._home))
+            os.remove(restored)
+
+
+if __name__ == '__main__':
+    unittest.main()
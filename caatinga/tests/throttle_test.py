@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Chris Taylor
+#
+# This file is part of caatinga.
+#
+# Caatinga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Caatinga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import subprocess
+import sys
+import time
+import unittest
+import caatinga.core.throttle as throttle
+
+
+class ThrottleTestCase(unittest.TestCase):
+    """
+    Test suite for the I/O rate limits and priorities.
+    """
+
+    def tearDown(self):
+        throttle.setLimits()
+
+    def test_bucketAllowsBurstOfOneSecond(self):
+        bucket = throttle.TokenBucket(1000)
+        start = time.monotonic()
+        bucket.consume(1000)
+        self.assertLess(time.monotonic() - start, 0.1)
+
+    def test_bucketSleepsWhenInDebt(self):
+        bucket = throttle.TokenBucket(1000)
+        start = time.monotonic()
+        bucket.consume(1200)
+        bucket.consume(100)
+        self.assertGreaterEqual(time.monotonic() - start, 0.25)
+
+    def test_readAndWriteCountOperations(self):
+        throttle.setLimits(iops=10)
+        start = time.monotonic()
+        for _ in range(6):
+            throttle.read(4096)
+            throttle.write(4096)
+        self.assertGreaterEqual(time.monotonic() - start, 0.15)
+
+    def test_unlimitedDoesNotSleep(self):
+        start = time.monotonic()
+        throttle.read(1024 * 1024 * 1024)
+        throttle.operations(1000000)
+        self.assertLess(time.monotonic() - start, 0.1)
+
+    def test_shareLimits(self):
+        throttle.setLimits(readRate=3000, iops=300)
+        throttle.shareLimits(3)
+        self.assertEqual(throttle._readBucket.rate, 1000)
+        self.assertEqual(throttle._writeBucket, None)
+        self.assertEqual(throttle._operationsBucket.rate, 100)
+
+    def test_setPriority(self):
+        # Priorities can't be lowered again, so they are set in a child.
+        script = (
+            "import os, caatinga.core.throttle as t; "
+            "t.setPriority('idle', 4, 15); "
+            "print(os.getpriority(os.PRIO_PROCESS, 0))")
+        root = os.path.dirname(os.path.dirname(os.path.dirname(
+            os.path.abspath(throttle.__file__))))
+        result = subprocess.run(
+            [sys.executable, "-c", script], cwd=root, check=True,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True)
+        self.assertEqual(result.stdout.strip(), "15")
+        self.assertEqual(result.stderr, "")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -31,6 +31,26 @@ class MockSettings():
     def __init__(self):
         self.backupLocation = BACKUP_HOME
         self.root = "/"
+        self.backupWorkers = 1
+        self.minBackupWorkers = 1
+        self.maxBackupWrites = 0
+        self.backupProcesses = 1
+        self.durability = "commit"
+        self.changeDetection = ("mtime_ns", "size")
+        self.chunkThreshold = 0
+        self.chunkSize = 1024 * 1024
+        self.compression = "none"
+        self.eventLogFormat = "json"
+        self.eventLogMode = "all"
+        self.eventLogSample = 100
+        self.eventLogMaxSize = 0
+        self.eventLogKeep = 5
+        self.maxReadRate = 0
+        self.maxWriteRate = 0
+        self.maxIops = 0
+        self.ioClass = ""
+        self.ioPriority = 4
+        self.nice = None
         self.preBackupHooksDir = "/"
         self.postBackupHooksDir = "/"
         self.preRestoreHooksDir = "/"
@@ -65,6 +85,70 @@ class SettingsValidatorTestCase(unittest.TestCase):
         self.settings.root = NONEXISTING_DIR
         self.assertValidateRaisesException()
 
+    def test_hasValidWorkerCount(self):
+        self.settings.backupWorkers = 0
+        self.assertValidateRaisesException()
+
+    def test_hasValidMinWorkerCount(self):
+        self.settings.minBackupWorkers = 2
+        self.assertValidateRaisesException()
+
+    def test_hasValidWriteCount(self):
+        self.settings.maxBackupWrites = -1
+        self.assertValidateRaisesException()
+
+    def test_hasValidProcessCount(self):
+        self.settings.backupProcesses = 0
+        self.assertValidateRaisesException()
+
+    def test_hasValidDurability(self):
+        self.settings.durability = "cheese"
+        self.assertValidateRaisesException()
+
+    def test_hasValidChangeDetection(self):
+        self.settings.changeDetection = ("mtime_ns", "cheese")
+        self.assertValidateRaisesException()
+
+    def test_hasValidChunkThreshold(self):
+        self.settings.chunkThreshold = -1
+        self.assertValidateRaisesException()
+
+    def test_hasValidChunkSize(self):
+        self.settings.chunkSize = 0
+        self.assertValidateRaisesException()
+
+    def test_hasValidCompression(self):
+        self.settings.compression = "cheese"
+        self.assertValidateRaisesException()
+
+    def test_hasValidEventLogFormat(self):
+        self.settings.eventLogFormat = "xml"
+        self.assertValidateRaisesException()
+
+    def test_hasValidEventLogMode(self):
+        self.settings.eventLogMode = "everything"
+        self.assertValidateRaisesException()
+
+    def test_hasValidEventLogSample(self):
+        self.settings.eventLogSample = 0
+        self.assertValidateRaisesException()
+
+    def test_hasValidLimits(self):
+        self.settings.maxIops = -1
+        self.assertValidateRaisesException()
+
+    def test_hasValidIoClass(self):
+        self.settings.ioClass = "urgent"
+        self.assertValidateRaisesException()
+
+    def test_hasValidIoPriority(self):
+        self.settings.ioPriority = 8
+        self.assertValidateRaisesException()
+
+    def test_hasValidNice(self):
+        self.settings.nice = 20
+        self.assertValidateRaisesException()
+
     def test_doesPreBackupHooksDirectoryExits(self):
         self.settings.preBackupHooksDir = NONEXISTING_DIR
         self.assertValidateRaisesException()
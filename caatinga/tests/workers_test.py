@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Chris Taylor
+#
+# This file is part of caatinga.
+#
+# Caatinga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Caatinga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with caatinga.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+import unittest
+from caatinga.caat.workers import BackupWorkers, ConcurrencyController
+
+
+class BackupWorkersTestCase(unittest.TestCase):
+    """
+    Test case for testing the backup worker pool.
+    """
+
+    def test_directoryFinishesAfterItsJobs(self):
+        done = []
+        finished = []
+        workers = BackupWorkers(4)
+        directory = workers.openDirectory(lambda: finished.append(len(done)))
+        for i in range(50):
+            workers.submit(directory, 10, done.append, i)
+        workers.closeDirectory(directory)
+        workers.join()
+        self.assertEqual(len(done), 50)
+        self.assertEqual(finished, [50])
+
+    def test_emptyDirectoryFinishesWhenClosed(self):
+        finished = []
+        workers = BackupWorkers(2)
+        directory = workers.openDirectory(lambda: finished.append(True))
+        workers.closeDirectory(directory)
+        workers.join()
+        self.assertEqual(finished, [True])
+
+    def test_singleWorkerRunsOnCallingThread(self):
+        threads = []
+        workers = BackupWorkers(1)
+        directory = workers.openDirectory(lambda: None)
+        workers.submit(
+            directory, 0, lambda: threads.append(threading.current_thread()))
+        self.assertEqual(threads, [threading.current_thread()])
+
+    def test_jobErrorIsRaisedOnJoin(self):
+        def fail():
+            raise OSError("Permission Denied")
+
+        workers = BackupWorkers(2)
+        directory = workers.openDirectory(lambda: None)
+        workers.submit(directory, 0, fail)
+        workers.closeDirectory(directory)
+        self.assertRaises(OSError, workers.join)
+
+    def test_jobInterruptIsRaisedOnJoin(self):
+        def interrupt():
+            raise KeyboardInterrupt()
+
+        workers = BackupWorkers(2)
+        directory = workers.openDirectory(lambda: None)
+        workers.submit(directory, 0, interrupt)
+        workers.closeDirectory(directory)
+        self.assertRaises(KeyboardInterrupt, workers.join)
+
+    def test_inFlightBytesAreBounded(self):
+        release = threading.Event()
+        workers = BackupWorkers(2, maxInFlightBytes=100)
+        directory = workers.openDirectory(lambda: None)
+        workers.submit(directory, 80, release.wait)
+        timer = threading.Timer(0.1, release.set)
+        timer.start()
+        workers.submit(directory, 80, lambda: None)
+        self.assertTrue(release.is_set())
+        workers.closeDirectory(directory)
+        workers.join()
+
+    def test_adaptivePoolLimitsRunningJobs(self):
+        lock = threading.Lock()
+        running = []
+        peak = []
+
+        def job():
+            with lock:
+                running.append(True)
+                peak.append(len(running))
+            time.sleep(0.001)
+            with lock:
+                running.pop()
+
+        workers = BackupWorkers(8, minWorkers=2)
+        directory = workers.openDirectory(lambda: None)
+        for _ in range(20):
+            workers.submit(directory, 0, job)
+        workers.closeDirectory(directory)
+        workers.join()
+        self.assertEqual(len(peak), 20)
+        self.assertLessEqual(max(peak), 2)
+
+
+class ConcurrencyControllerTestCase(unittest.TestCase):
+    """
+    Test case for testing the adaptive concurrency of the worker pool.
+    """
+
+    def setUp(self):
+        self.now = 0.0
+
+    def runWindow(self, controller, latency, jobs=64):
+        """
+        Record a window of jobs that each took the provided latency, with
+        the limit number of jobs running at once.
+        """
+        for _ in range(jobs):
+            self.now += latency / controller.limit
+            controller.record(0, latency, self.now)
+
+    def test_startsAtMinimum(self):
+        self.assertEqual(ConcurrencyController(2, 8).limit, 2)
+
+    def test_growsWhileLatencyIsSteady(self):
+        controller = ConcurrencyController(1, 8)
+        for _ in range(20):
+            self.runWindow(controller, 0.01)
+        self.assertEqual(controller.limit, 8)
+
+    def test_shrinksWhenLatencyJumps(self):
+        controller = ConcurrencyController(1, 8)
+        for _ in range(20):
+            self.runWindow(controller, 0.01)
+        self.runWindow(controller, 0.05)
+        self.assertEqual(controller.limit, 6)
+
+    def test_settlesWhereDeviceSaturates(self):
+        # Latency grows with each job past four running at once.
+        controller = ConcurrencyController(1, 16)
+        limits = []
+        for _ in range(50):
+            latency = 0.01 * max(1, controller.limit / 4.0)
+            self.runWindow(controller, latency)
+            limits.append(controller.limit)
+        self.assertLessEqual(max(limits[10:]), 8)
+        self.assertGreaterEqual(min(limits[10:]), 2)
+
+    def test_staysWithinBounds(self):
+        controller = ConcurrencyController(3, 4)
+        for _ in range(10):
+            self.runWindow(controller, 0.01)
+            self.runWindow(controller, 1.0)
+            self.assertTrue(3 <= controller.limit <= 4)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -46,14 +46,17 @@ setup(
     entry_points={
         'console_scripts': [
             'caat = caatinga.caat_main:main',
+            'caatd = caatinga.caatd_main:main',
             'lscaat = caatinga.lscaat_main:main']},
-    packages=['caatinga', 'caatinga.core', 'caatinga.caat', 'caatinga.lscaat'],
+    packages=['caatinga', 'caatinga.core', 'caatinga.caat', 'caatinga.caatd',
+              'caatinga.lscaat'],
     data_files=[('/etc/caatinga', ['caatinga.conf.sample']),
                 ('/etc/caatinga/pre_backup_hooks', []),
                 ('/etc/caatinga/post_backup_hooks', []),
                 ('/etc/caatinga/pre_restore_hooks', []),
                 ('/etc/caatinga/post_restore_hooks', []),
-                ('/usr/share/man/man1', ["docs/lscaat.1.gz", "docs/caat.1.gz"]),
+                ('/usr/share/man/man1', ["docs/lscaat.1.gz", "docs/caat.1.gz",
+                                         "docs/caatd.1.gz"]),
                 ("/usr/share/man/man5", ["docs/caatinga.conf.5.gz"])],
     test_suite="caatinga.tests",
     classifiers=[